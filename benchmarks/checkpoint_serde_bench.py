@@ -0,0 +1,178 @@
+'''
+Benchmark: checkpoint bytes written and load time for long conversations,
+with the stock saver, zstd compression only, and compression + message deltas.
+
+Conversations are replayed from recordings shaped like the agent's real
+traffic (query, tool call, freebusy / events.insert observation, reply)
+through a graph with the agent's MessagesState. Needs a scratch Postgres:
+the benchmark's threads are deleted when it finishes.
+
+usage: python -m benchmarks.checkpoint_serde_bench [--database-url URL] [--conversations 5] [--turns 60]
+'''
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import END, START, StateGraph
+
+from brain.agent_state import MessagesState
+from brain.checkpoint_serde import CompressedSerializer
+from brain.checkpointer import DATABASE_URL, DeltaPostgresSaver, PooledPostgresSaver, create_checkpoint_pool
+
+BYTES_SQL = """
+    SELECT
+        (SELECT coalesce(sum(pg_column_size(t.*)), 0) FROM checkpoints t WHERE thread_id LIKE %(prefix)s)
+        + (SELECT coalesce(sum(pg_column_size(t.*)), 0) FROM checkpoint_blobs t WHERE thread_id LIKE %(prefix)s)
+        + (SELECT coalesce(sum(pg_column_size(t.*)), 0) FROM checkpoint_writes t WHERE thread_id LIKE %(prefix)s)
+        AS bytes
+"""
+CLEANUP_SQL = [f"DELETE FROM {table} WHERE thread_id LIKE %(prefix)s" for table in ("checkpoint_writes", "checkpoint_blobs", "checkpoints")]
+
+
+def busy_observation(rng: random.Random, day: int) -> str:
+    busy = []
+    for hour in sorted(rng.sample(range(8, 19), rng.randint(2, 7))):
+        busy.append({"start": f"2026-01-{day:02}T{hour:02}:00:00Z", "end": f"2026-01-{day:02}T{hour:02}:{rng.choice(['30', '45', '59'])}:00Z"})
+    return json.dumps({"busy": busy})
+
+
+def event_observation(rng: random.Random, day: int, hour: int) -> str:
+    event_id = uuid.UUID(int=rng.getrandbits(128)).hex
+    return json.dumps({
+        "kind": "calendar#event",
+        "etag": f'"{rng.getrandbits(48)}"',
+        "id": event_id,
+        "status": "confirmed",
+        "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+        "created": "2026-01-04T12:00:00.000Z",
+        "updated": "2026-01-04T12:00:00.000Z",
+        "summary": "Meeting with the design team",
+        "description": "Booked by the booking agent",
+        "creator": {"email": "user@example.com", "self": True},
+        "organizer": {"email": "user@example.com", "self": True},
+        "start": {"dateTime": f"2026-01-{day:02}T{hour:02}:00:00Z", "timeZone": "UTC"},
+        "end": {"dateTime": f"2026-01-{day:02}T{hour + 1:02}:00:00Z", "timeZone": "UTC"},
+        "iCalUID": f"{event_id}@google.com",
+        "sequence": 0,
+        "reminders": {"useDefault": True},
+        "eventType": "default",
+    })
+
+
+def recorded_conversation(seed: int, turns: int) -> list[tuple[str, str, dict, str]]:
+    """(query, tool name, tool args, observation) per turn."""
+    rng = random.Random(seed)
+    recording = []
+    for turn in range(turns):
+        day = 5 + turn % 20
+        if turn % 3 == 2:
+            hour = rng.randint(9, 16)
+            args = {"summary": "Meeting", "description": "", "start": {"dateTime": f"2026-01-{day:02}T{hour:02}:00:00Z"}, "end": {"dateTime": f"2026-01-{day:02}T{hour + 1:02}:00:00Z"}}
+            recording.append((f"Book {hour}:00 on Jan {day}", "book_slot", args, event_observation(rng, day, hour)))
+        else:
+            args = {"time_min": f"2026-01-{day:02}T00:00:00Z", "time_max": f"2026-01-{day:02}T23:59:59Z"}
+            recording.append((f"Am I free on Jan {day}?", "get_slots", args, busy_observation(rng, day)))
+    return recording
+
+
+def build_graph(checkpointer, recording):
+    """Replays the recording: llm_call asks for the recorded tool, environment returns its observation."""
+    async def llm_call(state):
+        turn = sum(isinstance(m, HumanMessage) for m in state["messages"]) - 1
+        _, tool, args, _ = recording[turn]
+        if isinstance(state["messages"][-1], HumanMessage):
+            return {"messages": [AIMessage(content="", tool_calls=[{"name": tool, "args": args, "id": f"call_{turn}"}],
+                                           response_metadata={"model_name": "recorded", "finish_reason": "tool_calls"},
+                                           usage_metadata={"input_tokens": 900 + 40 * turn, "output_tokens": 30, "total_tokens": 930 + 40 * turn})]}
+        return {"messages": [AIMessage(content=f"Done, here is what I found for turn {turn}.",
+                                       response_metadata={"model_name": "recorded", "finish_reason": "stop"})]}
+
+    async def environment(state):
+        turn = sum(isinstance(m, HumanMessage) for m in state["messages"]) - 1
+        _, tool, _, observation = recording[turn]
+        return {"messages": [ToolMessage(content=observation, tool_call_id=f"call_{turn}", name=tool, response_metadata={"duration_ms": 120.0})]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("llm_call", llm_call)
+    builder.add_node("environment", environment)
+    builder.add_edge(START, "llm_call")
+    builder.add_conditional_edges("llm_call", lambda s: "environment" if s["messages"][-1].tool_calls else END)
+    builder.add_edge("environment", "llm_call")
+    return builder.compile(checkpointer=checkpointer)
+
+
+async def run_variant(pool, label: str, make_saver, conversations: int, turns: int, loads: int, run_id: str) -> dict:
+    prefix = f"bench-{run_id}-{label}-"
+    saver = make_saver(pool)
+    started = time.perf_counter()
+    for index in range(conversations):
+        recording = recorded_conversation(index, turns)
+        graph = build_graph(saver, recording)
+        config = {"configurable": {"thread_id": f"{prefix}{index}"}}
+        for query, _, _, _ in recording:
+            await graph.ainvoke({"messages": [HumanMessage(content=query)]}, config)
+    write_seconds = time.perf_counter() - started
+
+    # Cold loads of the latest checkpoint, as a new worker would do
+    load_times = []
+    for _ in range(loads):
+        fresh = make_saver(pool)
+        for index in range(conversations):
+            started = time.perf_counter()
+            await fresh.aget_tuple({"configurable": {"thread_id": f"{prefix}{index}"}})
+            load_times.append(time.perf_counter() - started)
+
+    async with pool.connection() as conn:
+        row = await (await conn.execute(BYTES_SQL, {"prefix": prefix + "%"})).fetchone()
+        for sql in CLEANUP_SQL:
+            await conn.execute(sql, {"prefix": prefix + "%"})
+    return {
+        "bytes": row["bytes"],
+        "write_s": write_seconds,
+        "load_ms_p50": statistics.median(load_times) * 1000,
+        "load_ms_max": max(load_times) * 1000,
+    }
+
+
+async def run(database_url: str, conversations: int, turns: int, loads: int):
+    variants = {
+        "stock": lambda pool: PooledPostgresSaver(pool),
+        "zstd": lambda pool: PooledPostgresSaver(pool, serde=CompressedSerializer()),
+        "zstd+delta": lambda pool: DeltaPostgresSaver(pool, serde=CompressedSerializer()),
+    }
+    pool = create_checkpoint_pool(database_url)
+    await pool.open(wait=True)
+    try:
+        await PooledPostgresSaver(pool).setup()
+        run_id = uuid.uuid4().hex[:8]
+        results = {label: await run_variant(pool, label, make, conversations, turns, loads, run_id)
+                   for label, make in variants.items()}
+    finally:
+        await pool.close()
+
+    baseline = results["stock"]["bytes"]
+    print(f"{conversations} conversations x {turns} turns")
+    print(f"{'variant':<12}{'bytes written':>16}{'vs stock':>10}{'write s':>10}{'load p50 ms':>13}{'load max ms':>13}")
+    for label, r in results.items():
+        print(f"{label:<12}{r['bytes']:>16,}{r['bytes'] / baseline:>10.2f}{r['write_s']:>10.2f}{r['load_ms_p50']:>13.2f}{r['load_ms_max']:>13.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--conversations", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--loads", type=int, default=5)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set, pass --database-url")
+    asyncio.run(run(args.database_url, args.conversations, args.turns, args.loads))
+
+
+if __name__ == "__main__":
+    main()
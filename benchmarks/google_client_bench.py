@@ -0,0 +1,115 @@
+'''
+Micro-benchmark: per-request cost of getting a Calendar client and running one
+freebusy query, before (build() per request) and after (GoogleClientFactory).
+
+Runs fully offline: a local keep-alive HTTP server stands in for the Calendar API.
+
+usage: python -m benchmarks.google_client_bench [--requests 200]
+'''
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from server.services.google_client import GoogleClientFactory
+
+FREEBUSY_BODY = {
+    "timeMin": "2026-01-05T09:00:00Z",
+    "timeMax": "2026-01-05T17:00:00Z",
+    "items": [{"id": "primary"}],
+}
+
+
+class _FreeBusyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Headers and body are written separately; without this Nagle + delayed ACK
+    # adds ~40ms to every request on a reused connection
+    disable_nagle_algorithm = True
+    connections = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        _FreeBusyHandler.connections.add(self.client_address)
+        payload = json.dumps({"calendars": {"primary": {"busy": []}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _timed(fn, n: int) -> list[float]:
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float], connections: int):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(
+        f"{label:<28} mean {statistics.mean(samples):7.3f} ms   "
+        f"p50 {statistics.median(samples):7.3f} ms   p95 {p95:7.3f} ms   "
+        f"tcp connections {connections}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FreeBusyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}/calendar/v3/"
+    creds = Credentials(token="benchmark-token")
+
+    def before_build():
+        build("calendar", "v3", credentials=creds, static_discovery=True,
+              client_options={"api_endpoint": endpoint})
+
+    def before_request():
+        client = build("calendar", "v3", credentials=creds, static_discovery=True,
+                       client_options={"api_endpoint": endpoint})
+        client.freebusy().query(body=FREEBUSY_BODY).execute()
+
+    factory = GoogleClientFactory(api_endpoints={"calendar": endpoint})
+
+    def after_build():
+        factory.calendar(creds)
+
+    def after_request():
+        factory.calendar(creds).freebusy().query(body=FREEBUSY_BODY).execute()
+
+    # Warm imports and the factory's document cache so only steady-state cost is measured
+    before_build()
+    after_build()
+
+    print(f"{args.requests} iterations each\n")
+    _report("build() client", _timed(before_build, args.requests), 0)
+    _report("factory client", _timed(after_build, args.requests), 0)
+
+    _FreeBusyHandler.connections.clear()
+    samples = _timed(before_request, args.requests)
+    _report("build() + freebusy", samples, len(_FreeBusyHandler.connections))
+
+    _FreeBusyHandler.connections.clear()
+    samples = _timed(after_request, args.requests)
+    _report("factory + freebusy", samples, len(_FreeBusyHandler.connections))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
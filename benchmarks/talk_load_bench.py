@@ -0,0 +1,322 @@
+'''
+Load test: N concurrent conversations against /talk, fully offline.
+
+Runs the real FastAPI app (server/api.py: lifespan, auth, users database,
+checkpointer) and the real BookingAgent graph, with two stand-ins:
+
+- the Groq chat model is replaced by ScriptedChatModel, which answers every
+  user message with one scripted tool call (get_slots or book_slot) and then
+  a short reply, after a configurable delay;
+- a local HTTP server plays the Calendar API (freeBusy and events.insert),
+  also with a configurable delay, behind the real GoogleClientFactory.
+
+The users database is a throwaway SQLite file unless --database-url points at
+a Postgres, which also turns the checkpointer on. Benchmark users and threads
+are deleted at the end.
+
+Save a run with --output and pass it as --baseline to a later run to see the
+change per metric.
+
+usage: python -m benchmarks.talk_load_bench [--conversations 50] [--concurrency 10] [--turns 4]
+           [--llm-latency-ms 300] [--google-latency-ms 80] [--stream] [--database-url URL]
+           [--output run.json] [--baseline previous.json]
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+CLEANUP_SQL = [f"DELETE FROM {table} WHERE thread_id LIKE %(prefix)s" for table in ("checkpoint_writes", "checkpoint_blobs", "checkpoints")]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the agent's chat model. `script` maps a user
+    message to the (tool name, args) the model asks for; once the tool has
+    answered, the model replies with text. Anything else (e.g. the context
+    summarizer's prompt) gets a short text answer.
+    """
+    script: dict
+    latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        usage = {
+            "input_tokens": sum(len(str(m.content)) for m in messages) // 4,
+            "output_tokens": 24,
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        if isinstance(last, HumanMessage) and last.content in self.script:
+            tool, args = self.script[last.content]
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": tool, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}],
+                usage_metadata=usage,
+            )
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Done, {last.name} answered.", usage_metadata=usage)
+        return AIMessage(content="Summary of the earlier turns.", usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return ChatResult(generations=[ChatGeneration(message=self.reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return ChatResult(generations=[ChatGeneration(message=self.reply(messages))])
+
+
+class _CalendarHandler(BaseHTTPRequestHandler):
+    """
+    Answers calendar/v3 freeBusy and events.insert after `latency_seconds`, and
+    events.list (the calendar mirror's sync) with an empty calendar.
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+    latency_seconds = 0.0
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        _CalendarHandler.requests += 1
+        time.sleep(self.latency_seconds)
+        if self.path.endswith("/freeBusy"):
+            day = body["timeMin"][:10]
+            payload = {"calendars": {"primary": {"busy": [
+                {"start": f"{day}T10:00:00Z", "end": f"{day}T11:00:00Z"},
+                {"start": f"{day}T14:00:00Z", "end": f"{day}T15:30:00Z"},
+            ]}}}
+        elif "/events" in self.path:
+            payload = {"kind": "calendar#event", "id": uuid.uuid4().hex, "status": "confirmed", **body}
+        else:
+            self.send_error(404)
+            return
+        self.send_json(payload)
+
+    def do_GET(self):
+        _CalendarHandler.requests += 1
+        time.sleep(self.latency_seconds)
+        if "/events" not in self.path:
+            self.send_error(404)
+            return
+        self.send_json({"kind": "calendar#events", "timeZone": "UTC", "items": [], "nextSyncToken": uuid.uuid4().hex})
+
+    def send_json(self, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def scripted_turns(seed: int, turns: int) -> list[tuple[str, str, dict]]:
+    """(user message, tool, args) per turn: availability questions, every third turn a booking."""
+    rng = random.Random(seed)
+    recording = []
+    for turn in range(turns):
+        day = f"2026-01-{5 + rng.randrange(20):02}"
+        if turn % 3 == 2:
+            hour = rng.randint(9, 16)
+            args = {
+                "summary": "Load test meeting", "description": "",
+                "start": {"dateTime": f"{day}T{hour:02}:00:00Z"}, "end": {"dateTime": f"{day}T{hour:02}:30:00Z"},
+            }
+            recording.append((f"[{seed}.{turn}] Book {hour}:00 on {day}", "book_slot", args))
+        else:
+            args = {"time_min": f"{day}T00:00:00Z", "time_max": f"{day}T23:59:59Z"}
+            recording.append((f"[{seed}.{turn}] Am I free on {day}?", "get_slots", args))
+    return recording
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def seed_users(prefix: str, count: int) -> list[str]:
+    from server.db.database import AsyncSessionLocal
+    from server.services.google_oauth import google_oauth_service
+
+    expiry = (datetime.now(timezone.utc) + timedelta(days=1)).replace(tzinfo=None).isoformat()
+    user_ids = [f"{prefix}user-{index}" for index in range(count)]
+    async with AsyncSessionLocal() as db:
+        for user_id in user_ids:
+            tokens = {"token": "offline-token", "refresh_token": "offline-refresh", "expiry": expiry}
+            await google_oauth_service.asave_tokens(db, user_id, f"{user_id}@example.com", tokens)
+    return user_ids
+
+
+async def delete_users(prefix: str):
+    from sqlalchemy import delete
+    from server.db.database import AsyncSessionLocal
+    from server.db.models import User
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(User).where(User.id.like(f"{prefix}%")))
+        await db.commit()
+
+
+async def talk(client, path: str, user_id: str, body: dict, stream: bool) -> bool:
+    headers = {"Cookie": f"booking_session={user_id}"}
+    if not stream:
+        response = await client.post(path, json=body, headers=headers)
+        return response.status_code == 200
+    async with client.stream("POST", path, json=body, headers=headers) as response:
+        events = [line async for line in response.aiter_lines() if line.startswith("event: ")]
+    return response.status_code == 200 and "event: done" in events
+
+
+async def run(args) -> dict:
+    import httpx
+    from server.api import app
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}-"
+    recordings = [scripted_turns(index, args.turns) for index in range(args.conversations)]
+    path = "/talk/stream" if args.stream else "/talk"
+    latencies: list[float] = []
+    failures = 0
+
+    async with app.router.lifespan_context(app):
+        user_ids = await seed_users(prefix, args.conversations)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+
+            async def conversation(index: int):
+                nonlocal failures
+                async with semaphore:
+                    for query, _, _ in recordings[index]:
+                        body = {"query": query, "conversation_id": f"{prefix}{index}",
+                                "timezone": "UTC", "client_time": "2026-01-04T09:00:00Z"}
+                        started = time.perf_counter()
+                        try:
+                            ok = await talk(client, path, user_ids[index], body, args.stream)
+                        except Exception:
+                            ok = False
+                        latencies.append(time.perf_counter() - started)
+                        failures += not ok
+
+            rss_before = peak_rss_mb()
+            started = time.perf_counter()
+            await asyncio.gather(*(conversation(index) for index in range(args.conversations)))
+            elapsed = time.perf_counter() - started
+
+        checkpointer = getattr(app.state, "checkpointer", None)
+        if checkpointer is not None:
+            async with checkpointer.conn.connection() as conn:
+                for sql in CLEANUP_SQL:
+                    await conn.execute(sql, {"prefix": prefix + "%"})
+        await delete_users(prefix)
+
+    return {
+        "endpoint": path,
+        "checkpointer": checkpointer is not None,
+        "conversations": args.conversations,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "failures": failures,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "peak_rss_mb_before": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+        "calendar_requests": _CalendarHandler.requests,
+    }
+
+
+def print_report(result: dict, baseline: dict | None):
+    print(f"{result['conversations']} conversations x {result['requests'] // max(1, result['conversations'])} turns, "
+          f"concurrency {result['concurrency']}, {result['endpoint']}, "
+          f"checkpointer {'on' if result['checkpointer'] else 'off'}")
+    keys = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "peak_rss_mb", "failures", "calendar_requests")
+    for key in keys:
+        line = f"{key:<20}{result[key]:>12.2f}"
+        if baseline and key in baseline and baseline[key]:
+            line += f"   {(result[key] - baseline[key]) / baseline[key]:+8.1%} vs baseline ({baseline[key]:.2f})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--google-latency-ms", type=float, default=80)
+    parser.add_argument("--stream", action="store_true", help="drive /talk/stream instead of /talk")
+    parser.add_argument("--database-url", help="Postgres URL (enables the checkpointer); default is a temporary SQLite file")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    # Settings are read at import time, so the environment is set before the app is imported
+    scratch = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{scratch.name}/bench.db"
+    os.environ["ENV"] = "local"
+    os.environ["LLM_PROVIDER"] = "groq"
+    os.environ["GROQ_API_KEY"] = "offline"
+    os.environ["ANTHROPIC_API_KEY"] = ""  # a single provider, no routing
+
+    _CalendarHandler.latency_seconds = args.google_latency_ms / 1000
+    calendar = ThreadingHTTPServer(("127.0.0.1", 0), _CalendarHandler)
+    calendar.daemon_threads = True
+    threading.Thread(target=calendar.serve_forever, daemon=True).start()
+
+    import brain.llm_config.config as llm_config
+    from server.services.google_client import google_client_factory
+
+    script = {query: (tool, tool_args) for index in range(args.conversations)
+              for query, tool, tool_args in scripted_turns(index, args.turns)}
+    llm_config.ChatGroq = lambda **kwargs: ScriptedChatModel(script=script, latency_seconds=args.llm_latency_ms / 1000)
+    google_client_factory.api_endpoints["calendar"] = f"http://127.0.0.1:{calendar.server_port}/calendar/v3/"
+
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        calendar.shutdown()
+        scratch.cleanup()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
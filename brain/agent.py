@@ -1,48 +1,69 @@
+import asyncio
 import json
+import logging
+import time
 from typing import Literal
-from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from brain.agent_state import MessagesState
+from brain.context_manager import ContextManager
+from brain.intent_router import AGENT, intent_router
+from brain.temporal_context import resolve_time
 from brain.llm_config.config import LLMConfig
 from langgraph.graph import START, StateGraph, END
 from brain.llm_config.prompts import get_system_prompt
-from brain.tools.config import setup_agent_tools
-from dotenv import load_dotenv
-import os
-from server.services.google_calendar import GoogleCalendarService
-from langgraph.checkpoint.postgres import PostgresSaver
-
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-CHECKPOINTER = None
-if DATABASE_URL:
-    try:
-      # 1. Instantiate the saver
-      _cm = PostgresSaver.from_conn_string(DATABASE_URL)
-      CHECKPOINTER = _cm.__enter__()    # enter once, keep alive
-      # 2. CRITICAL: Call setup() to create the tables
-      # This must be done the first time it is run.
-      CHECKPOINTER.setup() 
-      print("INFO: LangGraph Postgres checkpointer initialized and tables ensured.")
-        
-    except Exception as e:
-        print(f"ERROR: Failed to initialize Postgres checkpointer: {e}")
-        CHECKPOINTER = None # Disable if setup fails
-        
-else:
-    print("WARNING: DATABASE_URL not set, checkpointer disabled")
+from brain.tools.config import (
+   BOOKING_TOOLS,
+   DEFAULT_TOOL_TIMEOUT_SECONDS,
+   MAX_CONCURRENT_TOOL_CALLS,
+   TOOL_TIMEOUT_SECONDS,
+   setup_agent_tools,
+)
+from server.metrics import (
+   AGENT_ITERATIONS,
+   LLM_DURATION,
+   LLM_TOKENS,
+   TOOL_DURATION,
+   TOOL_ERRORS,
+   timed_node,
+)
+
+logger = logging.getLogger(__name__)
+
 
 class BookingAgent:
-   def __init__(self,google_calendar_service: GoogleCalendarService):
+   """
+   Builds and compiles the booking graph. The graph holds no per-user state:
+   the user's GoogleCalendarService travels in the run config, so one compiled
+   graph serves every request (see get_compiled_booking_agent).
+   The nodes are async, so the graph must be run with ainvoke/astream.
+   """
+   def __init__(self, checkpointer=None):
       llm_config = LLMConfig()
-      self.tools, self.tool_by_name = setup_agent_tools(google_calendar_service)
-      self.llm_with_tools = llm_config.llm.bind_tools(self.tools)
+      self.tools, self.tool_by_name = setup_agent_tools()
+      # Groq or Anthropic (LLM_PROVIDER), bound to the tools with any provider prompt caching
+      self.chat_provider = llm_config.chat_provider(self.tools)
+      self.context_manager = ContextManager(llm_config.llm)
       
       agent_builder = StateGraph(MessagesState)
-      agent_builder.add_node("llm_call", self.llm_call)
-      agent_builder.add_node("environment", self.tool_node)
+      # Each node's duration is exported on /metrics (booking_graph_node_duration_seconds)
+      agent_builder.add_node("route_intent", timed_node("route_intent", intent_router.route))
+      agent_builder.add_node("resolve_time", timed_node("resolve_time", resolve_time))
+      agent_builder.add_node("manage_context", timed_node("manage_context", self.context_manager.compact))
+      agent_builder.add_node("llm_call", timed_node("llm_call", self.llm_call))
+      agent_builder.add_node("environment", timed_node("environment", self.tool_node))
 
-      agent_builder.add_edge(START, "llm_call")
+      # Greetings and thanks get a templated reply; everything else reaches the model
+      agent_builder.add_edge(START, "route_intent")
+      agent_builder.add_conditional_edges(
+         "route_intent",
+         intent_router.next_node,
+         {"answered": END, AGENT: "resolve_time"},
+      )
+      # The current time and the dates in the message go to the model with the prompt
+      agent_builder.add_edge("resolve_time", "manage_context")
+      # Context is compacted once per turn, before the first model call
+      agent_builder.add_edge("manage_context", "llm_call")
       agent_builder.add_conditional_edges(
          "llm_call",
          self.should_continue,
@@ -54,72 +75,178 @@ class BookingAgent:
       )
       agent_builder.add_edge("environment", "llm_call")
 
-      if CHECKPOINTER:
-         self._booking_agent = agent_builder.compile(checkpointer=CHECKPOINTER)
+      if checkpointer:
+         self._booking_agent = agent_builder.compile(checkpointer=checkpointer)
       else:
          self._booking_agent = agent_builder.compile()
 
    def get_booking_agent(self):
       return self._booking_agent
 
-   def llm_call(self,state: MessagesState):
-      print("--- Entering LLM Call Node ---")
-      curr_messages = state.get("messages", [])
-      
-      has_system_message = any(isinstance(msg, SystemMessage) for msg in curr_messages)
-      if not has_system_message:
-         system_message = SystemMessage(content=get_system_prompt())
-         full_message_list = [system_message] + curr_messages
-      else:
-         # System message already exists, don't add it again
-         full_message_list = curr_messages
-      # 3. Invoke the LLM with the complete message list
-      response_message = self.llm_with_tools.invoke(full_message_list)
-      print(response_message.pretty_print)
+   async def llm_call(self,state: MessagesState, config: RunnableConfig):
+      logger.debug("--- Entering LLM Call Node ---")
+      # System prompt + running summary + windowed history, bounded by the ContextManager
+      history = self.context_manager.window(state.get("messages", []))
+      started = time.perf_counter()
+      response_message = await self.chat_provider.ainvoke(
+         get_system_prompt(), state.get("summary"), history, config, state.get("temporal_context")
+      )
+      self.record_llm_step(response_message, time.perf_counter() - started)
+      if logger.isEnabledFor(logging.DEBUG):
+         logger.debug(response_message.pretty_repr())
       return {
             "messages": [response_message]
       }
 
-   def tool_node(self,state: dict):
-      '''Excecute the tool call'''
-      print("--- Entering Environment (Tool) Node ---")
-      result = []
-      print(f"Tool Call Request: {state['messages'][-1].tool_calls}")
-      for tool_call in state["messages"][-1].tool_calls:
-            tool = self.tool_by_name[tool_call["name"]]
-            if tool.name == "get_current_date":
-                  observation = (
-                     f"User current time is {state.get('client_time')} "
-                     f"in timezone {state.get("timezone")}"
-                  )
-            else:
-               observation = tool.invoke(tool_call["args"])
-            observation_str: str
-            if isinstance(observation, (dict, list)):
-                # Convert structured output to a JSON string
-                observation_str = json.dumps(observation)
-            elif observation is not None:
-                # Convert all other non-None objects (like Pydantic models, dates) to string
-                observation_str = str(observation)
+   def record_llm_step(self, response_message: AIMessage, seconds: float):
+      provider = response_message.response_metadata.get("served_by", self.chat_provider.name)
+      LLM_DURATION.labels(provider).observe(seconds)
+      usage = response_message.usage_metadata
+      if usage:
+         LLM_TOKENS.labels(provider, "input").observe(usage.get("input_tokens", 0))
+         LLM_TOKENS.labels(provider, "output").observe(usage.get("output_tokens", 0))
+         # Prompt caching (Anthropic): input tokens read from / written to the cache
+         details = usage.get("input_token_details") or {}
+         for direction in ("cache_read", "cache_creation"):
+            if details.get(direction) is not None:
+               LLM_TOKENS.labels(provider, direction).observe(details[direction])
+         logger.debug(
+            "LLM usage %s: input=%s output=%s cache_read=%s cache_creation=%s", provider,
+            usage.get("input_tokens"), usage.get("output_tokens"), details.get("cache_read"), details.get("cache_creation"),
+         )
+
+   async def tool_node(self,state: dict, config: RunnableConfig):
+      '''
+      Excecute the tool calls of the last AI message concurrently.
+      ToolMessages keep the order of the tool calls; a failing or timed out call
+      becomes an error ToolMessage and doesn't cancel the others.
+      '''
+      logger.debug("--- Entering Environment (Tool) Node ---")
+      # Tools can't see the graph state; hand them the user's timezone through the config
+      tool_config = {
+         **config,
+         "configurable": {**config.get("configurable", {}), "timezone": state.get("timezone")},
+      }
+      tool_calls = state["messages"][-1].tool_calls
+      logger.debug("Tool Call Request: %s", tool_calls)
+      semaphore = asyncio.Semaphore(MAX_CONCURRENT_TOOL_CALLS)
+      result = await asyncio.gather(
+         *(self.run_tool_call(tool_call, state, tool_config, semaphore) for tool_call in tool_calls)
+      )
+      logger.debug("--- Exiting Environment (Tool) Node ---")
+      return {"messages": list(result)}
+
+   async def run_tool_call(self, tool_call: dict, state: dict, config: RunnableConfig, semaphore: asyncio.Semaphore) -> ToolMessage:
+      '''Run one tool call with its timeout and record how long it took'''
+      name = tool_call["name"]
+      timeout = TOOL_TIMEOUT_SECONDS.get(name, DEFAULT_TOOL_TIMEOUT_SECONDS)
+      status = "success"
+      error_reason = None
+      started = time.perf_counter()
+      try:
+         async with semaphore:
+            tool = self.tool_by_name.get(name)
+            if name == "get_current_date":
+               # No longer offered to the model, the time is in the turn context;
+               # still answered for threads whose history has the tool
+               observation = state.get("temporal_context") or (
+                  f"User current time is {state.get('client_time')} "
+                  f"in timezone {state.get('timezone')}"
+               )
+            elif tool is None:
+               raise ValueError(f"unknown tool '{name}'")
             else:
-                observation_str = "Tool executed successfully with no direct output." # Handle None/empty output
-            result.append(
-               ToolMessage(content=observation_str,tool_call_id=tool_call["id"],name=tool_call["name"])
+               # The run config carries the per-user google_calendar_service
+               call = tool.ainvoke(tool_call["args"], config=config)
+               if name in BOOKING_TOOLS:
+                  # A timeout must not abandon a booking halfway; it finishes in the background
+                  call = asyncio.shield(call)
+               observation = await asyncio.wait_for(call, timeout)
+         observation_str = self.format_observation(observation)
+      except asyncio.TimeoutError:
+         status = "error"
+         error_reason = "timeout"
+         if name in BOOKING_TOOLS:
+            observation_str = (
+               f"Tool {name} did not finish within {timeout} seconds, so the outcome is unknown: "
+               "the booking may still go through. Check the calendar with get_slots before booking again."
             )
-      print("--- Exiting Environment (Tool) Node ---")
-      return {"messages": result}
+         else:
+            observation_str = f"Tool {name} timed out after {timeout} seconds."
+      except Exception as e:
+         status = "error"
+         error_reason = "exception"
+         observation_str = f"Tool {name} failed: {e}"
+      seconds = time.perf_counter() - started
+      duration_ms = round(seconds * 1000, 1)
+      # Names come from the model; don't let a hallucinated one become a label
+      tool_label = name if name in self.tool_by_name else "unknown"
+      TOOL_DURATION.labels(tool_label, status).observe(seconds)
+      if error_reason:
+         TOOL_ERRORS.labels(tool_label, error_reason).inc()
+      logger.debug("Tool %s finished in %s ms (%s)", name, duration_ms, status)
+      return ToolMessage(
+         content=observation_str,
+         tool_call_id=tool_call["id"],
+         name=name,
+         status=status,
+         response_metadata={"duration_ms": duration_ms},
+      )
+
+   @staticmethod
+   def format_observation(observation) -> str:
+      if isinstance(observation, (dict, list)):
+          # Convert structured output to a JSON string
+          return json.dumps(observation)
+      elif observation is not None:
+          # Convert all other non-None objects (like Pydantic models, dates) to string
+          return str(observation)
+      return "Tool executed successfully with no direct output." # Handle None/empty output
 
    def should_continue(self,state: MessagesState) -> Literal["environment", END]:
       """Decide if we should continue the loop or stop based upon whether the LLM made a tool call"""
 
       messages = state["messages"]
       last_message = messages[-1]
-      print("-----------------------Should conitnue -------------------------------")
-      print(last_message.tool_calls)
-      print("----------------------------------------------------------------------")
+      logger.debug("Should continue, tool calls: %s", last_message.tool_calls)
       # If the LLM makes a tool call, then perform an action
       if last_message.tool_calls:
             return "Action"
       # Otherwise, we stop (reply to the user)
+      AGENT_ITERATIONS.observe(self.loop_iterations(messages))
+      return END
+
+   @staticmethod
+   def loop_iterations(messages: list) -> int:
+      """LLM calls since the latest user message, i.e. for the turn that just ended."""
+      iterations = 0
+      for message in reversed(messages):
+         if isinstance(message, HumanMessage):
+            break
+         if isinstance(message, AIMessage):
+            iterations += 1
+      return iterations
+
+
+_COMPILED_BOOKING_AGENT = None
+
+
+def init_booking_agent(checkpointer=None):
+   """
+   Compiles the process-wide booking graph. Called once from the FastAPI lifespan
+   after the checkpointer is opened.
+   """
+   global _COMPILED_BOOKING_AGENT
+   _COMPILED_BOOKING_AGENT = BookingAgent(checkpointer=checkpointer).get_booking_agent()
+   return _COMPILED_BOOKING_AGENT
+
 
-      return END
\ No newline at end of file
+def get_compiled_booking_agent():
+   """
+   Returns the process-wide compiled booking graph, building it (without a
+   checkpointer) if the app didn't initialise it at startup.
+   Invoke it with {"configurable": {"thread_id": ..., "google_calendar_service": ...}}.
+   """
+   if _COMPILED_BOOKING_AGENT is None:
+      return init_booking_agent()
+   return _COMPILED_BOOKING_AGENT
@@ -10,4 +10,8 @@ class MessagesState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages] #add_messages automaticaly adds 
     conversation_id: str
     timezone: str
-    client_time: str
\ No newline at end of file
+    client_time: str
+    summary: str  # running summary of turns folded out of `messages` (see ContextManager)
+    temporal_context: str  # current time and resolved dates for the turn (see brain/temporal_context.py)
+    user_id: str  # owner of the thread, set by its first turn; checked before it is continued or its history served
+    intent: str | None  # the /talk endpoint's intent router decision for this turn, consumed by the route node
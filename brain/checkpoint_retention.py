@@ -0,0 +1,238 @@
+'''
+Checkpoint retention: LangGraph writes a checkpoint per super-step for every
+thread and never deletes them. CheckpointRetention keeps the latest N
+checkpoints of each thread and drops threads idle for longer than the TTL.
+
+Work is done in small batches of threads, each in its own short transaction
+with a lock timeout, so live conversations are never blocked behind it.
+
+usage: python -m brain.checkpoint_retention [--keep-last 20] [--ttl-days 30] [--batch-size 200]
+'''
+import argparse
+import asyncio
+import json
+import logging
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+from brain.checkpointer import DATABASE_URL, create_checkpoint_pool
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pause between batches so retention yields to live traffic
+BATCH_PAUSE_SECONDS = 0.1
+# A batch that can't get its row locks quickly is skipped, not waited on
+BATCH_LOCK_TIMEOUT = "2s"
+
+THREADS_OVER_LIMIT_SQL = """
+    SELECT thread_id FROM checkpoints
+    WHERE thread_id > %(after)s
+    GROUP BY thread_id, checkpoint_ns
+    HAVING count(*) > %(keep_last)s
+    ORDER BY thread_id
+    LIMIT %(limit)s
+"""
+
+# Old checkpoints and their pending writes beyond the latest `keep_last` per (thread, namespace)
+PRUNE_CHECKPOINTS_SQL = """
+    WITH ranked AS (
+        SELECT thread_id, checkpoint_ns, checkpoint_id,
+               row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rank
+        FROM checkpoints
+        WHERE thread_id = ANY(%(threads)s)
+    ), doomed AS (
+        SELECT thread_id, checkpoint_ns, checkpoint_id FROM ranked WHERE rank > %(keep_last)s
+    ), deleted_writes AS (
+        DELETE FROM checkpoint_writes w USING doomed d
+        WHERE w.thread_id = d.thread_id AND w.checkpoint_ns = d.checkpoint_ns AND w.checkpoint_id = d.checkpoint_id
+        RETURNING pg_column_size(w.*) AS size
+    ), deleted_checkpoints AS (
+        DELETE FROM checkpoints c USING doomed d
+        WHERE c.thread_id = d.thread_id AND c.checkpoint_ns = d.checkpoint_ns AND c.checkpoint_id = d.checkpoint_id
+        RETURNING pg_column_size(c.*) AS size
+    )
+    SELECT
+        (SELECT count(*) FROM deleted_checkpoints) AS checkpoints,
+        (SELECT count(*) FROM deleted_writes) AS writes,
+        (SELECT coalesce(sum(size), 0) FROM deleted_checkpoints)
+            + (SELECT coalesce(sum(size), 0) FROM deleted_writes) AS bytes
+"""
+
+# Channel blobs older than the oldest version any remaining checkpoint references
+# (or, for delta blobs, the keyframe they are built on; see brain/checkpoint_serde.py).
+# Blobs are written before their checkpoint row, so anything newer is left alone.
+PRUNE_BLOBS_SQL = """
+    WITH kept AS (
+        SELECT c.thread_id, c.checkpoint_ns, v.key AS channel,
+               min(CASE WHEN rb.type LIKE 'delta:%%' THEN split_part(rb.type, ':', 2) ELSE v.value END) AS min_version
+        FROM checkpoints c
+        CROSS JOIN jsonb_each_text(c.checkpoint -> 'channel_versions') v
+        LEFT JOIN checkpoint_blobs rb
+            ON rb.thread_id = c.thread_id AND rb.checkpoint_ns = c.checkpoint_ns
+            AND rb.channel = v.key AND rb.version = v.value
+        WHERE c.thread_id = ANY(%(threads)s)
+        GROUP BY c.thread_id, c.checkpoint_ns, v.key
+    ), deleted AS (
+        DELETE FROM checkpoint_blobs b USING kept k
+        WHERE b.thread_id = k.thread_id AND b.checkpoint_ns = k.checkpoint_ns
+          AND b.channel = k.channel AND b.version < k.min_version
+        RETURNING pg_column_size(b.*) AS size
+    )
+    SELECT count(*) AS blobs, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+IDLE_THREADS_SQL = """
+    SELECT thread_id FROM checkpoints
+    WHERE thread_id > %(after)s
+    GROUP BY thread_id
+    HAVING max((checkpoint ->> 'ts')::timestamptz) < now() - make_interval(secs => %(ttl_seconds)s)
+    ORDER BY thread_id
+    LIMIT %(limit)s
+"""
+
+DELETE_THREADS_SQL = """
+    WITH deleted_writes AS (
+        DELETE FROM checkpoint_writes WHERE thread_id = ANY(%(threads)s)
+        RETURNING pg_column_size(checkpoint_writes.*) AS size
+    ), deleted_blobs AS (
+        DELETE FROM checkpoint_blobs WHERE thread_id = ANY(%(threads)s)
+        RETURNING pg_column_size(checkpoint_blobs.*) AS size
+    ), deleted_checkpoints AS (
+        DELETE FROM checkpoints WHERE thread_id = ANY(%(threads)s)
+        RETURNING pg_column_size(checkpoints.*) AS size
+    )
+    SELECT
+        (SELECT count(*) FROM deleted_checkpoints) AS checkpoints,
+        (SELECT count(*) FROM deleted_writes) AS writes,
+        (SELECT count(*) FROM deleted_blobs) AS blobs,
+        (SELECT coalesce(sum(size), 0) FROM deleted_checkpoints)
+            + (SELECT coalesce(sum(size), 0) FROM deleted_writes)
+            + (SELECT coalesce(sum(size), 0) FROM deleted_blobs) AS bytes
+"""
+
+
+def empty_report() -> dict:
+    return {"threads_expired": 0, "checkpoints": 0, "writes": 0, "blobs": 0, "rows": 0, "bytes": 0}
+
+
+class CheckpointRetention:
+    """
+    Prunes the LangGraph checkpoint tables through the checkpointer's pool.
+    `bytes` in the report is the size of the deleted rows; Postgres reuses the
+    space after autovacuum, it isn't returned to the OS.
+    """
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        keep_last: int = settings.CHECKPOINT_KEEP_LAST,
+        ttl_seconds: float = settings.CHECKPOINT_THREAD_TTL_DAYS * 86400,
+        batch_size: int = settings.CHECKPOINT_RETENTION_BATCH_SIZE,
+    ):
+        self.pool = pool
+        self.keep_last = max(1, keep_last)  # the latest checkpoint is the conversation itself
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+
+    async def run(self) -> dict:
+        """One full pass: expire idle threads, then trim the rest."""
+        report = empty_report()
+        if self.ttl_seconds > 0:
+            await self.delete_idle_threads(report)
+        await self.prune_threads(report)
+        report["rows"] = report["checkpoints"] + report["writes"] + report["blobs"]
+        return report
+
+    async def delete_idle_threads(self, report: dict):
+        after = ""
+        while True:
+            threads = await self.fetch_threads(IDLE_THREADS_SQL, {"after": after, "ttl_seconds": self.ttl_seconds})
+            if not threads:
+                return
+            deleted = await self.run_batch([(DELETE_THREADS_SQL, {"threads": threads})])
+            if deleted:
+                report["threads_expired"] += len(threads)
+                self.add(report, deleted[0])
+            if len(threads) < self.batch_size:
+                return
+            after = threads[-1]
+            await asyncio.sleep(BATCH_PAUSE_SECONDS)
+
+    async def prune_threads(self, report: dict):
+        after = ""
+        while True:
+            threads = await self.fetch_threads(THREADS_OVER_LIMIT_SQL, {"after": after, "keep_last": self.keep_last})
+            if not threads:
+                return
+            params = {"threads": threads, "keep_last": self.keep_last}
+            for row in await self.run_batch([(PRUNE_CHECKPOINTS_SQL, params), (PRUNE_BLOBS_SQL, params)]):
+                self.add(report, row)
+            if len(threads) < self.batch_size:
+                return
+            after = threads[-1]
+            await asyncio.sleep(BATCH_PAUSE_SECONDS)
+
+    async def fetch_threads(self, sql: str, params: dict) -> list[str]:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(sql, {**params, "limit": self.batch_size})
+            # A thread with several namespaces can come back more than once
+            return list(dict.fromkeys(row["thread_id"] for row in await cursor.fetchall()))
+
+    async def run_batch(self, statements: list) -> list[dict]:
+        """Runs the statements in one transaction; a batch that hits a lock is skipped."""
+        rows = []
+        try:
+            async with self.pool.connection() as conn, conn.transaction():
+                await conn.execute(f"SET LOCAL lock_timeout = '{BATCH_LOCK_TIMEOUT}'")
+                for sql, params in statements:
+                    cursor = await conn.execute(sql, params)
+                    rows.append(await cursor.fetchone())
+        except psycopg.errors.LockNotAvailable:
+            logger.warning("Checkpoint retention batch skipped, threads are busy")
+            return []
+        return rows
+
+    @staticmethod
+    def add(report: dict, row: dict):
+        for key in ("checkpoints", "writes", "blobs", "bytes"):
+            report[key] += row.get(key, 0)
+
+
+async def checkpoint_retention_loop(pool: AsyncConnectionPool, interval_seconds: float = settings.CHECKPOINT_RETENTION_INTERVAL_SECONDS):
+    """Background task (started in the app lifespan) pruning the checkpoint tables."""
+    retention = CheckpointRetention(pool)
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            report = await retention.run()
+            if report["rows"]:
+                logger.info("Checkpoint retention reclaimed %s rows (%s bytes): %s", report["rows"], report["bytes"], report)
+        except Exception as e:
+            logger.error("Checkpoint retention failed: %s", e)
+
+
+async def run_once(database_url: str, keep_last: int, ttl_days: float, batch_size: int) -> dict:
+    pool = create_checkpoint_pool(database_url)
+    await pool.open(wait=True)
+    try:
+        return await CheckpointRetention(pool, keep_last, ttl_days * 86400, batch_size).run()
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--keep-last", type=int, default=settings.CHECKPOINT_KEEP_LAST)
+    parser.add_argument("--ttl-days", type=float, default=settings.CHECKPOINT_THREAD_TTL_DAYS,
+                        help="delete threads idle for longer than this, 0 keeps them")
+    parser.add_argument("--batch-size", type=int, default=settings.CHECKPOINT_RETENTION_BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set, pass --database-url")
+
+    report = asyncio.run(run_once(args.database_url, args.keep_last, args.ttl_days, args.batch_size))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+'''
+Compact checkpoint encoding.
+
+- CompressedSerializer: zstd with a shared dictionary on top of LangGraph's
+  msgpack serializer. Tool observations (freebusy / events JSON) and message
+  envelopes repeat the same keys and class paths, which the dictionary primes.
+- Delta blobs: the `messages` channel is stored as the messages appended since
+  a base version, with a full keyframe every DELTA_KEYFRAME_EVERY versions
+  (written and read by DeltaPostgresSaver in brain/checkpointer.py).
+'''
+from typing import Any
+import zstandard
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# Payloads smaller than this aren't worth a zstd frame
+COMPRESS_MIN_BYTES = 128
+ZSTD_LEVEL = 3
+
+# Raw-content dictionary. Stored blobs depend on these exact bytes:
+# never edit it, add "zstd2" next to it instead.
+DICTIONARY_V1 = b"".join([
+    b"\xbdlangchain_core.messages.human\xacHumanMessage",
+    b"\xbalangchain_core.messages.ai\xa9AIMessage",
+    b"\xbclangchain_core.messages.tool\xabToolMessage",
+    b"\xbelangchain_core.messages.system\xadSystemMessage",
+    b"\xa7content\xb1additional_kwargs\x80\xb1response_metadata",
+    b"\xa4type\xa5human\xa4name\xc0\xa2id\xb3model_validate_json",
+    b"\xa4type\xa2ai\xa4name\xc0\xa2id\xaatool_calls\xb2invalid_tool_calls\x90\xaeusage_metadata",
+    b"\xacinput_tokens\xadoutput_tokens\xactotal_tokens\xb3input_token_details",
+    b"\xaamodel_name\xadfinish_reason\xaatool_calls\xa4stop\xabtoken_usage",
+    b"\xa4args\xa4type\xa9tool_call\xa4name\xa9get_slots\xa4name\xa9book_slot",
+    b"\xa4name\xaefind_free_slots\xa4name\xb0get_current_date",
+    b"\xa4type\xa4tool\xactool_call_id\xa8artifact\xc0\xa6status\xa7success\xabduration_ms",
+    b"\xaaserved_by\xaellm_latency_ms\xa4groq\xa9anthropic",
+    b'{"busy": [{"start": "2026-01-05T09:00:00Z", "end": "2026-01-05T10:00:00Z"}, ',
+    b'{"start": "2026-01-05T09:00:00+00:00", "end": "2026-01-05T09:30:00+00:00", "free_until": "',
+    b'{"kind": "calendar#event", "etag": "\\"', b'", "id": "', b'", "status": "confirmed", ',
+    b'"htmlLink": "https://www.google.com/calendar/event?eid=', b'", "created": "', b'", "updated": "',
+    b'", "summary": "', b'", "description": "', b'", "creator": {"email": "', b'", "self": true}, ',
+    b'"organizer": {"email": "', b'"start": {"dateTime": "', b'", "timeZone": "', b'"end": {"dateTime": "',
+    b'"iCalUID": "', b'@google.com", "sequence": 0, "reminders": {"useDefault": true}, "eventType": "default"}',
+    b"User current time is ", b" in timezone ", b"Tool get_slots failed: ", b"timed out after ",
+])
+
+ZSTD_DICTIONARIES = {
+    "zstd1": zstandard.ZstdCompressionDict(DICTIONARY_V1, dict_type=zstandard.DICT_TYPE_RAWCONTENT),
+}
+CURRENT_DICTIONARY = "zstd1"
+
+# Channels stored as deltas, and how often a full copy is written
+DELTA_CHANNELS = ("messages",)
+DELTA_KEYFRAME_EVERY = 16
+
+
+class CompressedSerializer(SerializerProtocol):
+    """
+    Wraps a serializer and zstd-compresses its output, tagging the type
+    like EncryptedSerializer does ("msgpack+zstd1"). Untagged blobs written
+    before compression was enabled still load.
+    """
+    def __init__(self, serde: SerializerProtocol | None = None, level: int = ZSTD_LEVEL):
+        self.serde = serde or JsonPlusSerializer()
+        self.level = level
+        for dictionary in ZSTD_DICTIONARIES.values():
+            dictionary.precompute_compress(level=level)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) < COMPRESS_MIN_BYTES:
+            return type_, data
+        # Compressor objects aren't thread safe and _dump_blobs runs on worker threads
+        compressor = zstandard.ZstdCompressor(level=self.level, dict_data=ZSTD_DICTIONARIES[CURRENT_DICTIONARY])
+        compressed = compressor.compress(data)
+        if len(compressed) >= len(data):
+            return type_, data
+        return f"{type_}+{CURRENT_DICTIONARY}", compressed
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if "+" in type_:
+            type_, dictionary = type_.rsplit("+", 1)
+            decompressor = zstandard.ZstdDecompressor(dict_data=ZSTD_DICTIONARIES[dictionary])
+            payload = decompressor.decompress(payload)
+        return self.serde.loads_typed((type_, payload))
+
+
+def delta_type(keyframe_version: str, inner_type: str) -> str:
+    # The keyframe is in the type column so retention knows to keep it
+    return f"delta:{keyframe_version}:{inner_type}"
+
+
+def parse_delta_type(type_: str) -> tuple[str, str]:
+    _, keyframe_version, inner_type = type_.split(":", 2)
+    return keyframe_version, inner_type
@@ -0,0 +1,321 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.postgres.base import SELECT_SQL
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from psycopg import AsyncCursor
+from psycopg.rows import DictRow, dict_row
+from psycopg_pool import AsyncConnectionPool
+from brain.checkpoint_serde import (
+    DELTA_CHANNELS,
+    DELTA_KEYFRAME_EVERY,
+    CompressedSerializer,
+    delta_type,
+    parse_delta_type,
+)
+from server.config import settings
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Connection settings AsyncPostgresSaver expects from every pooled connection
+CHECKPOINT_CONNECTION_KWARGS = {
+    "autocommit": True,
+    "prepare_threshold": 0,
+    "row_factory": dict_row,
+}
+
+
+class PooledPostgresSaver(AsyncPostgresSaver):
+    """
+    AsyncPostgresSaver guards every query with one asyncio.Lock, which is only
+    needed when it shares a single connection. On a pool each query checks out
+    its own connection, so checkpoint reads/writes of different conversations
+    run concurrently instead of queueing behind the lock.
+    """
+    @asynccontextmanager
+    async def _cursor(self, *, pipeline: bool = False) -> AsyncIterator[AsyncCursor[DictRow]]:
+        if not isinstance(self.conn, AsyncConnectionPool) or self.pipe:
+            async with super()._cursor(pipeline=pipeline) as cur:
+                yield cur
+            return
+        async with self.conn.connection() as conn:
+            if pipeline and self.supports_pipeline:
+                async with conn.pipeline(), conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+            elif pipeline:
+                async with conn.transaction(), conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+            else:
+                async with conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+
+
+# Threads whose last written/loaded message list is kept for delta encoding
+DELTA_CACHE_THREADS = 1024
+
+# The checkpoint query plus, for each delta-encoded channel, its blobs from the
+# keyframe (in the delta's type, see delta_type) up to the checkpoint's version.
+# The chain comes back with the checkpoint row, on the connection that read it.
+SELECT_WITH_DELTA_CHAINS_SQL = SELECT_SQL.replace(
+    " as pending_writes\nfrom checkpoints ",
+    """ as pending_writes,
+    (
+        select array_agg(array[chain.channel::bytea, chain.version::bytea, chain.type::bytea, chain.blob])
+        from jsonb_each_text(checkpoint -> 'channel_versions')
+        inner join checkpoint_blobs bl
+            on bl.thread_id = checkpoints.thread_id
+            and bl.checkpoint_ns = checkpoints.checkpoint_ns
+            and bl.channel = jsonb_each_text.key
+            and bl.version = jsonb_each_text.value
+            and bl.type like 'delta:%%'
+        inner join checkpoint_blobs chain
+            on chain.thread_id = bl.thread_id
+            and chain.checkpoint_ns = bl.checkpoint_ns
+            and chain.channel = bl.channel
+            and chain.version >= split_part(bl.type, ':', 2)
+            and chain.version <= bl.version
+    ) as delta_chains
+from checkpoints """,
+)
+assert "delta_chains" in SELECT_WITH_DELTA_CHAINS_SQL, "langgraph's checkpoint SELECT changed, update SELECT_WITH_DELTA_CHAINS_SQL"
+
+
+class DeltaPostgresSaver(PooledPostgresSaver):
+    """
+    AsyncPostgresSaver storing DELTA_CHANNELS as deltas.
+
+    A delta blob holds {"base": <version>, "tail": [new messages]} and is only
+    written when the new list is the base list (same message objects) plus
+    appended messages; a rewrite such as context compaction produces a keyframe.
+    The base is this process's last written or loaded version of the thread's
+    list, so after a restart the first write of a thread is a keyframe.
+    Loading a delta reads the keyframe..target range in the checkpoint's own query.
+    """
+    SELECT_SQL = SELECT_WITH_DELTA_CHAINS_SQL
+
+    def __init__(self, conn, pipe=None, serde: SerializerProtocol | None = None):
+        super().__init__(conn, pipe=pipe, serde=serde)
+        # (thread_id, checkpoint_ns, channel) -> (version, keyframe_version, depth, messages)
+        self.recent_lists: OrderedDict = OrderedDict()
+        # Written in _dump_blobs, promoted to recent_lists once aput has committed
+        self.pending_lists: dict = {}
+        self.cache_lock = threading.Lock()
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        keys = [
+            (thread_id, checkpoint_ns, channel, new_versions[channel])
+            for channel in DELTA_CHANNELS if channel in new_versions
+        ]
+        try:
+            next_config = await super().aput(config, checkpoint, metadata, new_versions)
+            for key in keys:
+                if key in self.pending_lists:
+                    self.remember(key[:3], *self.pending_lists[key])
+            return next_config
+        finally:
+            for key in keys:
+                self.pending_lists.pop(key, None)
+
+    def _dump_blobs(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        values: dict[str, Any],
+        versions: ChannelVersions,
+    ) -> list[tuple[str, str, str, str, str, bytes | None]]:
+        rows = super()._dump_blobs(
+            thread_id,
+            checkpoint_ns,
+            {k: v for k, v in values.items() if not self.is_delta_value(k, v)},
+            versions,
+        )
+        for index, row in enumerate(rows):
+            channel, version = row[2], row[3]
+            if not self.is_delta_value(channel, values.get(channel)):
+                continue
+            messages = values[channel]
+            keyframe_version, depth, base = version, 0, None
+            with self.cache_lock:
+                recent = self.recent_lists.get((thread_id, checkpoint_ns, channel))
+            if recent:
+                base_version, base_keyframe, base_depth, base_messages = recent
+                if (
+                    base_depth + 1 < DELTA_KEYFRAME_EVERY
+                    and base_version < version
+                    and len(messages) >= len(base_messages)
+                    and all(a is b for a, b in zip(base_messages, messages))
+                ):
+                    keyframe_version, depth, base = base_keyframe, base_depth + 1, base_version
+            if base is None:
+                type_, blob = self.serde.dumps_typed(messages)
+            else:
+                inner_type, blob = self.serde.dumps_typed(
+                    {"base": base, "tail": messages[len(recent[3]):]}
+                )
+                type_ = delta_type(keyframe_version, inner_type)
+            rows[index] = (thread_id, checkpoint_ns, channel, version, type_, blob)
+            self.pending_lists[(thread_id, checkpoint_ns, channel, version)] = (
+                version, keyframe_version, depth, tuple(messages)
+            )
+        return rows
+
+    async def _load_checkpoint_tuple(self, value) -> CheckpointTuple:
+        entries = value["channel_values"] or []
+        deltas = [entry for entry in entries if entry[1].startswith(b"delta:")]
+        if deltas:
+            value = {**value, "channel_values": [entry for entry in entries if entry not in deltas]}
+        checkpoint_tuple = await super()._load_checkpoint_tuple(value)
+
+        thread_id = checkpoint_tuple.config["configurable"]["thread_id"]
+        checkpoint_ns = checkpoint_tuple.config["configurable"]["checkpoint_ns"]
+        channel_values = checkpoint_tuple.checkpoint["channel_values"]
+        channel_versions = checkpoint_tuple.checkpoint.get("channel_versions", {})
+        chains = {}
+        for channel_bytes, version_bytes, type_bytes, blob in value.get("delta_chains") or []:
+            chains.setdefault(channel_bytes.decode(), {})[version_bytes.decode()] = (type_bytes.decode(), blob)
+        delta_channels = set()
+        for channel_bytes, type_bytes, _ in deltas:
+            channel = channel_bytes.decode()
+            delta_channels.add(channel)
+            version = channel_versions[channel]
+            keyframe_version, depth, messages = self.rebuild_delta_chain(
+                thread_id, version, parse_delta_type(type_bytes.decode())[0], chains.get(channel, {})
+            )
+            channel_values[channel] = messages
+            self.remember((thread_id, checkpoint_ns, channel), version, keyframe_version, depth, tuple(messages))
+        for channel in DELTA_CHANNELS:
+            if channel not in delta_channels and self.is_delta_value(channel, channel_values.get(channel)):
+                # A keyframe: later writes of this thread can be deltas against it
+                version = channel_versions[channel]
+                self.remember((thread_id, checkpoint_ns, channel), version, version, 0, tuple(channel_values[channel]))
+        return checkpoint_tuple
+
+    def rebuild_delta_chain(self, thread_id: str, version: str, keyframe_version: str, blobs: dict):
+        """Rebuilds a delta-encoded list: walks base pointers back to the keyframe, then appends the tails."""
+        tails = []
+        current = version
+        while True:
+            if current not in blobs:
+                raise ValueError(f"Checkpoint delta chain for thread {thread_id} is missing version {current}")
+            type_, blob = blobs[current]
+            if not type_.startswith("delta:"):
+                messages = list(self.serde.loads_typed((type_, blob)))
+                break
+            delta = self.serde.loads_typed((parse_delta_type(type_)[1], blob))
+            tails.append(delta["tail"])
+            current = delta["base"]
+        for tail in reversed(tails):
+            messages.extend(tail)
+        return keyframe_version, len(tails), messages
+
+    def remember(self, key: tuple, version: str, keyframe_version: str, depth: int, messages: tuple):
+        with self.cache_lock:
+            self.recent_lists[key] = (version, keyframe_version, depth, messages)
+            self.recent_lists.move_to_end(key)
+            while len(self.recent_lists) > DELTA_CACHE_THREADS:
+                self.recent_lists.popitem(last=False)
+
+    @staticmethod
+    def is_delta_value(channel: str, value: Any) -> bool:
+        return channel in DELTA_CHANNELS and isinstance(value, list)
+
+
+def log_reconnect_failed(pool: AsyncConnectionPool):
+    logger.error("Checkpointer pool '%s' could not reconnect to Postgres", pool.name)
+
+
+def create_checkpoint_pool(database_url: str) -> AsyncConnectionPool:
+    """
+    Sized pool for checkpoint reads/writes. Connections are health-checked when
+    they are handed out, recycled after CHECKPOINT_POOL_MAX_LIFETIME_SECONDS and
+    re-established in the background if Postgres drops them.
+    """
+    return AsyncConnectionPool(
+        database_url,
+        name="checkpointer",
+        kwargs=CHECKPOINT_CONNECTION_KWARGS,
+        min_size=settings.CHECKPOINT_POOL_MIN_SIZE,
+        max_size=settings.CHECKPOINT_POOL_MAX_SIZE,
+        timeout=settings.CHECKPOINT_POOL_TIMEOUT_SECONDS,
+        max_idle=settings.CHECKPOINT_POOL_MAX_IDLE_SECONDS,
+        max_lifetime=settings.CHECKPOINT_POOL_MAX_LIFETIME_SECONDS,
+        check=AsyncConnectionPool.check_connection,
+        reconnect_failed=log_reconnect_failed,
+        open=False,
+    )
+
+
+def checkpointer_health(checkpointer: DeltaPostgresSaver | None) -> dict:
+    """Pool status for the health endpoint."""
+    if checkpointer is None:
+        return {"status": "disabled"}
+    pool = checkpointer.conn
+    if pool.closed:
+        return {"status": "closed"}
+    stats = pool.get_stats()
+    return {
+        "status": "ok",
+        "pool_size": stats.get("pool_size", 0),
+        "pool_available": stats.get("pool_available", 0),
+        "requests_waiting": stats.get("requests_waiting", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+    }
+
+
+@asynccontextmanager
+async def open_checkpointer(database_url: str | None = DATABASE_URL):
+    """
+    Opens the async Postgres checkpointer on a connection pool for the lifetime of the app.
+    Yields None (checkpointing disabled) when DATABASE_URL is unset or setup fails,
+    so the agent still runs, just without conversation memory.
+    """
+    if not database_url:
+        logger.warning("DATABASE_URL not set, checkpointer disabled")
+        yield None
+        return
+    if not database_url.startswith(("postgresql://", "postgres://")):
+        # e.g. the local sqlite default for the users table
+        logger.warning("DATABASE_URL is not a Postgres URL, checkpointer disabled")
+        yield None
+        return
+
+    pool = create_checkpoint_pool(database_url)
+    checkpointer = None
+    try:
+        # Fail fast at startup instead of on the first /talk
+        await pool.open(wait=True, timeout=settings.CHECKPOINT_POOL_TIMEOUT_SECONDS)
+        # zstd-compressed blobs, message history stored as deltas (brain/checkpoint_serde.py)
+        checkpointer = DeltaPostgresSaver(pool, serde=CompressedSerializer())
+        # Creates the tables on first run, no-op afterwards
+        await checkpointer.setup()
+        logger.info(
+            "LangGraph Postgres checkpointer initialized and tables ensured (pool %s-%s connections)",
+            settings.CHECKPOINT_POOL_MIN_SIZE, settings.CHECKPOINT_POOL_MAX_SIZE,
+        )
+    except Exception as e:
+        logger.error("Failed to initialize Postgres checkpointer: %s", e)
+        checkpointer = None  # Disable if setup fails
+    try:
+        yield checkpointer
+    finally:
+        await pool.close()
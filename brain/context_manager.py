@@ -0,0 +1,124 @@
+import json
+import logging
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AnyMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.runnables import RunnableConfig
+from brain.agent_state import MessagesState
+from brain.llm_config.constants import (
+    CONTEXT_KEEP_RECENT_TURNS,
+    CONTEXT_MAX_PROMPT_TOKENS,
+    CONTEXT_TOOL_OUTPUT_CHARS,
+)
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and a calendar booking assistant.
+Update the summary with the new turns below. Keep every fact that may matter later:
+dates and times discussed (with timezone), availability found, events booked (title, time, id)
+and any open requests or user preferences. Be concise, use plain sentences, no preamble.
+"""
+
+
+def estimate_tokens(messages: list[AnyMessage]) -> int:
+    """Cheap token estimate (~4 characters per token) over content and tool calls."""
+    chars = 0
+    for message in messages:
+        content = message.content
+        chars += len(content) if isinstance(content, str) else len(json.dumps(content))
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            chars += len(json.dumps(tool_call.get("args", {}))) + len(tool_call.get("name", ""))
+    return chars // 4
+
+
+def turn_starts(messages: list[AnyMessage]) -> list[int]:
+    """Indexes of the user messages that open each turn."""
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+class ContextManager:
+    """
+    Keeps the prompt for each llm_call bounded, however long the thread gets.
+
+    - The last `keep_recent_turns` turns are sent verbatim.
+    - Tool outputs of older turns are cut to `tool_output_chars` in the prompt.
+    - When the prompt estimate exceeds `max_prompt_tokens`, the older turns are
+      folded into `summary` in the graph state and removed from `messages`.
+    """
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        max_prompt_tokens: int = CONTEXT_MAX_PROMPT_TOKENS,
+        keep_recent_turns: int = CONTEXT_KEEP_RECENT_TURNS,
+        tool_output_chars: int = CONTEXT_TOOL_OUTPUT_CHARS,
+    ):
+        self.llm = llm
+        self.max_prompt_tokens = max_prompt_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.tool_output_chars = tool_output_chars
+
+    def recent_start(self, messages: list[AnyMessage]) -> int:
+        """Index of the first message that belongs to the recent (verbatim) turns."""
+        starts = turn_starts(messages)
+        if len(starts) <= self.keep_recent_turns:
+            return 0
+        return starts[-self.keep_recent_turns]
+
+    def compress(self, message: AnyMessage) -> AnyMessage:
+        if isinstance(message, ToolMessage) and isinstance(message.content, str) \
+                and len(message.content) > self.tool_output_chars:
+            return message.model_copy(
+                update={"content": message.content[: self.tool_output_chars] + " …[truncated]"}
+            )
+        return message
+
+    def window(self, messages: list[AnyMessage]) -> list[AnyMessage]:
+        """History as sent to the model: older turns compressed, recent turns verbatim."""
+        cut = self.recent_start(messages)
+        return [self.compress(m) for m in messages[:cut]] + messages[cut:]
+
+    def estimate_prompt_tokens(self, state: MessagesState) -> int:
+        summary_tokens = len(state.get("summary") or "") // 4
+        return summary_tokens + estimate_tokens(self.window(state.get("messages", [])))
+
+    async def compact(self, state: MessagesState, config: RunnableConfig):
+        """
+        Graph node run at the start of every turn. Folds the older turns into the
+        running summary once the prompt would exceed the token budget.
+        """
+        messages = state.get("messages", [])
+        cut = self.recent_start(messages)
+        if cut == 0:
+            return {}
+        if self.estimate_prompt_tokens(state) <= self.max_prompt_tokens:
+            return {}
+
+        folded = [self.compress(m) for m in messages[:cut]]
+        transcript = "\n".join(f"{m.type}: {m.content}" for m in folded if m.content)
+        try:
+            response = await self.llm.ainvoke(
+                [
+                    SystemMessage(content=SUMMARY_PROMPT),
+                    HumanMessage(content=(
+                        f"Current summary:\n{state.get('summary') or '(none)'}\n\n"
+                        f"New turns:\n{transcript}"
+                    )),
+                ],
+                config={**config, "tags": ["context_summary"]},
+            )
+        except Exception as e:
+            # Keep the history; windowing still bounds tool outputs in the prompt
+            logger.error("Failed to summarize conversation context: %s", e)
+            return {}
+
+        logger.info("Folded %s messages into the conversation summary", cut)
+        return {
+            "summary": response.content if isinstance(response.content, str) else str(response.content),
+            "messages": [RemoveMessage(id=m.id) for m in messages[:cut]],
+        }
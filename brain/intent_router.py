@@ -0,0 +1,249 @@
+'''
+Fast path for trivial turns: greetings, thanks, goodbyes and "what can you do".
+These are answered from templates by the graph's first node, so they skip
+context management, the LLM loop and (in /talk) the Google credential refresh,
+while the exchange is still checkpointed with the rest of the thread.
+
+A message is classified by
+1. rules: the whole normalised message matches a known phrase, then
+2. a tiny local model: nearest labelled example by cosine similarity of
+   hashed character trigrams. It must clear INTENT_MODEL_MIN_SIMILARITY and
+   beat the closest example the agent has to handle by INTENT_MODEL_MIN_MARGIN.
+Messages that are long, hold a digit or mention anything calendar related
+always go to the agent, as does anything the router isn't sure about.
+So does every message answering the assistant's last reply when that reply
+asked something or proposed an action: "ok thanks" may be a confirmation.
+'''
+import re
+import threading
+import zlib
+from typing import NamedTuple
+import numpy as np
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage
+from brain.agent_state import MessagesState
+from brain.llm_config.constants import (
+    INTENT_MAX_WORDS,
+    INTENT_MODEL_MIN_MARGIN,
+    INTENT_MODEL_MIN_SIMILARITY,
+)
+from server.config import settings
+from server.metrics import INTENT_ROUTES
+
+AGENT = "agent"
+SERVED_BY = "intent_router"
+VECTOR_DIMENSIONS = 1024
+
+TEMPLATES = {
+    "greeting": "Hi! I can check your availability, suggest free times and book meetings on your Google Calendar. What would you like to do?",
+    "thanks": "You're welcome! Let me know if there's anything else I can book or check for you.",
+    "goodbye": "Goodbye! Come back any time you need to check your calendar or book a slot.",
+    "capabilities": (
+        "I manage your Google Calendar: I can tell you when you're busy or free, "
+        "suggest open times for a meeting, and book one or several events for you. "
+        "Try \"Am I free tomorrow afternoon?\" or \"Book a 30 minute call with Sam on Friday at 10\"."
+    ),
+}
+
+RULES = {
+    "greeting": r"(hi|hello|hey|hiya|howdy|yo|greetings|good (morning|afternoon|evening))( there)?( (how are you|how are you doing|hows it going))?",
+    "thanks": r"((great|perfect|awesome|ok|okay|cool|nice) )?(thanks|thank you|thx|ty|cheers)( (so much|a lot|very much|for (your|the) help))?",
+    "goodbye": r"(bye|bye bye|goodbye|see you|see you later|see ya|good night|have a (nice|good|great) day)",
+    "capabilities": r"(help|what can you do|what do you do|who are you|what are you|how does this work|how can you help( me)?)",
+}
+
+# Labelled examples for the model. The agent's examples are close to trivial
+# phrasings so that "ok" or "hi can you check my calendar" aren't mistaken for them.
+EXAMPLES = {
+    "greeting": [
+        "hi", "hello", "hey", "hey there", "hello there", "hi there", "hiya", "howdy",
+        "good morning", "good afternoon", "good evening", "hey how are you", "hi how are you doing",
+        "hello how is it going", "whats up", "sup", "hellooo", "heya",
+    ],
+    "thanks": [
+        "thanks", "thank you", "thanks a lot", "thank you so much", "thank you very much", "thx",
+        "many thanks", "much appreciated", "thanks for your help", "thanks for the help",
+        "great thanks", "perfect thank you", "awesome thank you", "cheers", "thank u",
+    ],
+    "goodbye": [
+        "bye", "goodbye", "bye bye", "see you", "see you later", "see ya", "talk to you later",
+        "thats all for now", "thats all", "have a nice day", "have a good one", "good night", "later",
+    ],
+    "capabilities": [
+        "help", "what can you do", "what do you do", "what are you", "who are you",
+        "how does this work", "how can you help me", "what can i ask you", "what are you able to do",
+        "what can you help me with",
+    ],
+    AGENT: [
+        "yes", "no", "ok", "okay", "sure", "yes please", "go ahead", "do it", "sounds good",
+        "that works", "not that one", "the first one", "the second one", "another time",
+        "hi can you check my calendar", "hello am i free", "thanks can you also book it",
+        "what about later", "any other options", "what else", "how about after lunch",
+        "cancel it", "move it", "book it", "check again", "great", "cool", "nice", "perfect", "awesome", "alright",
+    ],
+}
+
+# The assistant asked or offered something the user may be answering
+PROPOSAL_WORDS = re.compile(
+    r"\b(shall i|should i|would you like|do you want|want me to|let me know|confirm|go ahead)\b",
+    re.IGNORECASE,
+)
+
+# Anything that may need the calendar or the conversation's context
+AGENT_WORDS = re.compile(
+    r"\b(book|booking|schedule|slot|slots|free|busy|availab\w*|meeting|meetings|call|event|events|calendar|"
+    r"cancel|move|reschedule|invite|today|tonight|tomorrow|yesterday|week|weekend|month|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|am|pm|noon|lunch|hour|hours|minute|minutes|"
+    r"next|before|after|at|on|with|yes|no|ok|okay)\b"
+)
+
+
+class IntentDecision(NamedTuple):
+    intent: str          # one of TEMPLATES, or AGENT
+    source: str          # "rule", "model", "guard", "context" or "disabled"
+    score: float = 1.0   # the model's similarity; 1 for rules
+
+    @property
+    def fast_path(self) -> bool:
+        return self.intent != AGENT
+
+
+def normalize(text: str) -> str:
+    """Lowercase words only; letters repeated 3+ times collapse ("heyyy" -> "hey")."""
+    text = re.sub(r"[’']", "", text.lower())
+    text = re.sub(r"[^a-z0-9]+", " ", text).strip()
+    return re.sub(r"(.)\1{2,}", r"\1", text)
+
+
+def trigram_vector(text: str) -> np.ndarray:
+    padded = f"  {text} "
+    vector = np.zeros(VECTOR_DIMENSIONS, dtype=np.float32)
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode()) % VECTOR_DIMENSIONS] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class IntentRouter:
+    """
+    Classifies the latest user message and, for trivial intents, answers it.
+    Also keeps the numbers behind its hit rate and the latency it saves:
+    turns are timed by the /talk endpoints through record_turn.
+    """
+    def __init__(self, enabled: bool = settings.INTENT_ROUTER_ENABLED):
+        self.enabled = enabled
+        self.rules = {intent: re.compile(pattern) for intent, pattern in RULES.items()}
+        self.labels = [intent for intent, phrases in EXAMPLES.items() for _ in phrases]
+        self.matrix = np.stack([trigram_vector(normalize(p)) for phrases in EXAMPLES.values() for p in phrases])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fast_turn_seconds = 0.0
+        self.agent_turn_seconds = 0.0
+
+    def classify(self, text: str, previous: AnyMessage | None = None) -> IntentDecision:
+        """`previous` is the thread's message before `text`, if known. Counted in INTENT_ROUTES."""
+        decision = self.decide(text, previous)
+        INTENT_ROUTES.labels(decision.intent, decision.source).inc()
+        return decision
+
+    def decide(self, text: str, previous: AnyMessage | None) -> IntentDecision:
+        if not self.enabled:
+            return IntentDecision(AGENT, "disabled")
+        if self.awaiting_reply(previous):
+            return IntentDecision(AGENT, "context")
+        normalized = normalize(text)
+        for intent, rule in self.rules.items():
+            if rule.fullmatch(normalized):
+                return IntentDecision(intent, "rule")
+        if (
+            not normalized
+            or len(normalized.split()) > INTENT_MAX_WORDS
+            or re.search(r"\d", normalized)
+            or AGENT_WORDS.search(normalized)
+        ):
+            return IntentDecision(AGENT, "guard")
+        return self.predict(normalized)
+
+    def predict(self, normalized: str) -> IntentDecision:
+        similarities = self.matrix @ trigram_vector(normalized)
+        best = int(np.argmax(similarities))
+        intent, score = self.labels[best], float(similarities[best])
+        closest_agent = max(
+            (float(s) for s, label in zip(similarities, self.labels) if label == AGENT),
+            default=0.0,
+        )
+        if intent == AGENT or score < INTENT_MODEL_MIN_SIMILARITY or score - closest_agent < INTENT_MODEL_MIN_MARGIN:
+            return IntentDecision(AGENT, "model", score)
+        return IntentDecision(intent, "model", score)
+
+    @staticmethod
+    def awaiting_reply(message: AnyMessage | None) -> bool:
+        """Whether the assistant's last message asked a question or proposed an action."""
+        if not isinstance(message, AIMessage) or message.response_metadata.get("served_by") == SERVED_BY:
+            return False
+        if message.tool_calls:
+            return True
+        content = message.content if isinstance(message.content, str) else " ".join(
+            block.get("text", "") for block in message.content if isinstance(block, dict)
+        )
+        return "?" in content or bool(PROPOSAL_WORDS.search(content))
+
+    @staticmethod
+    def latest_query(state: MessagesState) -> str:
+        message = state["messages"][-1] if state.get("messages") else None
+        if not isinstance(message, HumanMessage) or not isinstance(message.content, str):
+            return ""
+        return message.content
+
+    async def route(self, state: MessagesState):
+        """
+        Graph node: a templated reply for a trivial message, nothing otherwise.
+        Follows the decision the /talk endpoint stored in `intent` (it already
+        left out the calendar service on the fast path) and classifies only
+        runs that came without one. The decision is cleared for the next turn.
+        """
+        intent = state.get("intent")
+        if intent not in TEMPLATES and intent != AGENT:
+            messages = state.get("messages", [])
+            intent = self.classify(self.latest_query(state), messages[-2] if len(messages) > 1 else None).intent
+        if intent == AGENT:
+            return {"intent": None}
+        return {"intent": None, "messages": [AIMessage(
+            content=TEMPLATES[intent],
+            response_metadata={"served_by": SERVED_BY, "intent": intent},
+        )]}
+
+    @staticmethod
+    def next_node(state: MessagesState) -> str:
+        """Ends the turn after a templated reply, otherwise hands over to the agent."""
+        message = state["messages"][-1]
+        if isinstance(message, AIMessage) and message.response_metadata.get("served_by") == SERVED_BY:
+            return "answered"
+        return AGENT
+
+    def record_turn(self, fast_path: bool, seconds: float):
+        with self._lock:
+            if fast_path:
+                self.hits += 1
+                self.fast_turn_seconds += seconds
+            else:
+                self.misses += 1
+                self.agent_turn_seconds += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            turns = self.hits + self.misses
+            fast_average = self.fast_turn_seconds / self.hits if self.hits else 0.0
+            agent_average = self.agent_turn_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / turns if turns else 0.0,
+                "fast_turn_avg_seconds": fast_average,
+                "agent_turn_avg_seconds": agent_average,
+                # What the routed turns would have cost at the agent's average
+                "latency_saved_seconds": self.hits * max(0.0, agent_average - fast_average) if self.misses else 0.0,
+            }
+
+
+intent_router = IntentRouter()
@@ -1,20 +1,31 @@
+import logging
 import os
 from dotenv import load_dotenv
 from anthropic import Anthropic
 from brain.llm_config.constants import MODEL_NAME, GROQ_MODEL_NAME
+from brain.llm_config.providers import AnthropicChatProvider, ChatProvider
+from brain.llm_config.router import RoutingChatProvider
+from langchain_anthropic import ChatAnthropic
 from langchain_groq import ChatGroq 
 from langchain_core.language_models.chat_models import BaseChatModel
 
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("groq", "anthropic")
+
 
 class LLMConfig:
     """
     Configuration class to initialize and manage LLM clients.
-    Prioritizes Groq for agent operations if the key is available.
+    Prioritizes Groq for agent operations if the key is available; set
+    LLM_PROVIDER=anthropic to run the agent on Claude (with prompt caching).
+    With both keys set the other provider backs the selected one (see router.py).
     """
     def __init__(
         self, 
         model_name: str = MODEL_NAME, 
-        groq_model_name: str = GROQ_MODEL_NAME
+        groq_model_name: str = GROQ_MODEL_NAME,
+        provider: str | None = None
     ):
         load_dotenv()
 
@@ -22,30 +33,66 @@ class LLMConfig:
         def get_env_var(name):
             value = os.getenv(name)
             if not value:
-                print(f"WARNING: Environment variable {name} not found.")
+                logger.warning("Environment variable %s not found.", name)
             return value
 
         ANTHROPIC_API_KEY = get_env_var("ANTHROPIC_API_KEY") 
         GROQ_API_KEY = get_env_var("GROQ_API_KEY")
         self.model_name = model_name
         self.groq_model_name = groq_model_name
+        self.provider = (provider or os.getenv("LLM_PROVIDER") or "groq").lower()
+        if self.provider not in PROVIDERS:
+            raise ValueError(f"Unknown LLM_PROVIDER '{self.provider}', expected one of {PROVIDERS}.")
         self.llm: BaseChatModel = None
+        self.groq_llm: BaseChatModel = None
+        self.anthropic_llm: BaseChatModel = None
         
         # 1. Initialize Groq (Preferred Agent Model)
         if GROQ_API_KEY:
-            self.llm = ChatGroq(
+            self.groq_llm = ChatGroq(
                 model=self.groq_model_name, 
                 temperature=0.0, # for agents
                 groq_api_key=GROQ_API_KEY
             )
-            print(f"INFO: Primary LLM set to Groq ({self.groq_model_name}).")
         
         # 2. Initialize Anthropic (Fallback or secondary client)
         if ANTHROPIC_API_KEY:
             self.anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
-            print(f"INFO: Anthropic client initialized.")
+            self.anthropic_llm = ChatAnthropic(
+                model=self.model_name,
+                temperature=0.0,
+                max_tokens=4096,
+                api_key=ANTHROPIC_API_KEY
+            )
+            logger.info("Anthropic client initialized.")
         else:
             self.anthropic_client = None
 
+        if self.provider == "anthropic":
+            self.llm = self.anthropic_llm
+            if self.llm:
+                logger.info("Primary LLM set to Anthropic (%s).", self.model_name)
+        else:
+            self.llm = self.groq_llm
+            if self.llm:
+                logger.info("Primary LLM set to Groq (%s).", self.groq_model_name)
+
         if not self.llm:
-             raise EnvironmentError("No valid LLM client could be initialized. Please provide GROQ_API_KEY.")
\ No newline at end of file
+             key = "ANTHROPIC_API_KEY" if self.provider == "anthropic" else "GROQ_API_KEY"
+             raise EnvironmentError(f"No valid LLM client could be initialized. Please provide {key}.")
+
+    def chat_provider(self, tools: list) -> ChatProvider | RoutingChatProvider:
+        """
+        The selected model bound to the agent tools. When the other provider's
+        key is also set, it becomes the hedge/failover target behind a router.
+        """
+        providers = []
+        if self.groq_llm:
+            providers.append(ChatProvider(self.groq_llm, tools))
+        if self.anthropic_llm:
+            providers.append(AnthropicChatProvider(self.anthropic_llm, tools))
+        # Selected provider first
+        providers.sort(key=lambda p: p.name != self.provider)
+        if len(providers) == 1:
+            return providers[0]
+        return RoutingChatProvider(providers)
\ No newline at end of file
@@ -1,2 +1,17 @@
 MODEL_NAME = "claude-haiku-4-5-20251001"
-GROQ_MODEL_NAME = "openai/gpt-oss-120b"
\ No newline at end of file
+GROQ_MODEL_NAME = "openai/gpt-oss-120b"
+
+# Conversation context management (see brain/context_manager.py)
+CONTEXT_MAX_PROMPT_TOKENS = 6000   # fold older turns into the summary above this estimate
+CONTEXT_KEEP_RECENT_TURNS = 3      # turns (from a user message on) always sent verbatim
+CONTEXT_TOOL_OUTPUT_CHARS = 400    # tool outputs of older turns are cut to this length
+
+# LLM routing across providers (see brain/llm_config/router.py)
+LLM_HEDGE_AFTER_SECONDS = 4.0        # send a hedged request to the secondary after this long
+LLM_BREAKER_FAILURE_THRESHOLD = 3    # consecutive failures that open a provider's circuit
+LLM_BREAKER_RESET_SECONDS = 30.0     # how long an open circuit skips the provider
+
+# Fast-path intent router (see brain/intent_router.py)
+INTENT_MAX_WORDS = 8               # longer messages always go to the agent
+INTENT_MODEL_MIN_SIMILARITY = 0.6  # nearest-example cosine needed for the model to route a message
+INTENT_MODEL_MIN_MARGIN = 0.1      # ... and its lead over the closest example the agent must handle
@@ -0,0 +1,64 @@
+from langchain_anthropic.chat_models import convert_to_anthropic_tool
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+
+# Anthropic prompt-cache breakpoint; everything up to and including the marked block is cached
+EPHEMERAL_CACHE = {"type": "ephemeral"}
+
+
+def format_summary(summary: str) -> str:
+    return f"<CONVERSATION_SUMMARY>\n{summary}\n</CONVERSATION_SUMMARY>"
+
+
+class ChatProvider:
+    """
+    A chat model bound to the agent tools, plus the provider-specific shape of
+    the system message. BookingAgent.llm_call talks to the model only through this.
+    """
+    name = "groq"
+
+    def __init__(self, llm: BaseChatModel, tools: list):
+        self.llm = llm
+        self.llm_with_tools = self.bind_tools(tools)
+
+    def bind_tools(self, tools: list):
+        return self.llm.bind_tools(tools)
+
+    def system_message(self, system_prompt: str, summary: str | None = None, context: str | None = None) -> SystemMessage:
+        if summary:
+            system_prompt = f"{system_prompt}\n{format_summary(summary)}"
+        if context:
+            system_prompt = f"{system_prompt}\n{context}"
+        return SystemMessage(content=system_prompt)
+
+    async def ainvoke(self, system_prompt: str, summary: str | None, history: list[AnyMessage], config: RunnableConfig, context: str | None = None) -> AIMessage:
+        messages = [self.system_message(system_prompt, summary, context)] + history
+        return await self.llm_with_tools.ainvoke(messages, config=config)
+
+
+class AnthropicChatProvider(ChatProvider):
+    """
+    Claude via langchain-anthropic with prompt caching.
+
+    The tool schemas and the static system prompt are identical on every call,
+    so cache breakpoints are placed on the last tool definition and on the
+    system prompt block. The per-thread summary and the per-turn context go in
+    separate, uncached system blocks after the breakpoint so they don't
+    invalidate the cache.
+    """
+    name = "anthropic"
+
+    def bind_tools(self, tools: list):
+        schemas = [convert_to_anthropic_tool(tool) for tool in tools]
+        if schemas:
+            schemas[-1] = {**schemas[-1], "cache_control": EPHEMERAL_CACHE}
+        return self.llm.bind_tools(schemas)
+
+    def system_message(self, system_prompt: str, summary: str | None = None, context: str | None = None) -> SystemMessage:
+        blocks = [{"type": "text", "text": system_prompt, "cache_control": EPHEMERAL_CACHE}]
+        if summary:
+            blocks.append({"type": "text", "text": format_summary(summary)})
+        if context:
+            blocks.append({"type": "text", "text": context})
+        return SystemMessage(content=blocks)
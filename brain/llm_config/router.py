@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+import anthropic
+import groq
+import httpx
+from langchain_core.messages import AIMessage, AnyMessage
+from langchain_core.runnables import RunnableConfig
+from brain.llm_config.constants import (
+    LLM_BREAKER_FAILURE_THRESHOLD,
+    LLM_BREAKER_RESET_SECONDS,
+    LLM_HEDGE_AFTER_SECONDS,
+)
+from brain.llm_config.providers import ChatProvider
+from server.metrics import LLM_CIRCUIT_STATE, LLM_FAILURES, LLM_HEDGES
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+# Timeouts and connection failures, raised before any HTTP status came back
+TRANSPORT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    httpx.TransportError,
+    anthropic.APIConnectionError,
+    groq.APIConnectionError,
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Rate limits, server errors and transport failures are worth another provider.
+    Anything else (a bad request, a validation error, a bug of ours) would fail
+    there too and must not count against the provider's circuit.
+    """
+    if isinstance(error, TRANSPORT_ERRORS):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+class CircuitBreaker:
+    """
+    Closed: requests flow. Open (after `failure_threshold` consecutive retryable
+    failures): the provider is skipped for `reset_seconds`. Half-open: a single
+    probe request is let through; success closes the circuit, failure re-opens it.
+    """
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a request may go out now; in half-open the caller becomes the probe."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def release(self):
+        """The probe ended without a verdict (cancelled or a non-retryable error)."""
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold or self.state == "half_open":
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+class RoutingChatProvider:
+    """
+    Serves llm_call from an ordered list of providers (primary first).
+
+    - Hedging: if the primary hasn't answered after `hedge_after_seconds`, the
+      same request goes to the next provider and the first answer wins; the
+      slower request is cancelled.
+    - Failover: a 429, 5xx or transport error moves on to the next provider.
+    - Circuit breakers: providers failing repeatedly are skipped for a while.
+
+    Which provider served each step and how long it took is kept in stats()
+    and on the response (response_metadata["served_by"], ["llm_latency_ms"]).
+    Hedges, failures and circuit states are exported on /metrics.
+    """
+    def __init__(self, providers: list[ChatProvider], hedge_after_seconds: float = LLM_HEDGE_AFTER_SECONDS):
+        self.providers = providers
+        self.name = "+".join(provider.name for provider in providers)
+        self.hedge_after_seconds = hedge_after_seconds
+        self.breakers = {provider.name: CircuitBreaker() for provider in providers}
+        for name, breaker in self.breakers.items():
+            # Read at scrape time: open turns half-open by the clock, not on a call
+            LLM_CIRCUIT_STATE.labels(name).set_function(lambda breaker=breaker: CIRCUIT_STATES[breaker.state])
+        self.counters = {
+            provider.name: {"served": 0, "failures": 0, "hedges": 0, "latency_ms_total": 0.0}
+            for provider in providers
+        }
+
+    def available(self) -> list[ChatProvider]:
+        """Providers whose circuit isn't open, in order; half-open ones still need allow() to launch."""
+        return [p for p in self.providers if self.breakers[p.name].state != "open"]
+
+    async def call(self, provider: ChatProvider, args: tuple, probe: bool = False) -> AIMessage:
+        breaker = self.breakers[provider.name]
+        try:
+            response = await provider.ainvoke(*args)
+        except asyncio.CancelledError:
+            if probe:
+                breaker.release()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+                self.counters[provider.name]["failures"] += 1
+                LLM_FAILURES.labels(provider.name).inc()
+            elif probe:
+                breaker.release()
+            raise
+        breaker.record_success()
+        return response
+
+    async def ainvoke(self, system_prompt: str, summary: str | None, history: list[AnyMessage], config: RunnableConfig, context: str | None = None) -> AIMessage:
+        args = (system_prompt, summary, history, config, context)
+        queue = self.available()
+        started = time.perf_counter()
+        running: dict[asyncio.Task, ChatProvider] = {}
+        last_error: BaseException | None = None
+        # A non-retryable error (e.g. a 400) ends the step, but only once no other request can still win
+        rejected: BaseException | None = None
+
+        launched = 0
+
+        def start(provider: ChatProvider, probe: bool = False):
+            nonlocal launched
+            running[asyncio.create_task(self.call(provider, args, probe))] = provider
+            launched += 1
+
+        def launch() -> ChatProvider | None:
+            """Starts the next provider its breaker lets through, if any."""
+            while queue:
+                provider = queue.pop(0)
+                breaker = self.breakers[provider.name]
+                probe = breaker.state == "half_open"
+                if breaker.allow():
+                    start(provider, probe)
+                    return provider
+            return None
+
+        if launch() is None:
+            # Every circuit open or already probing: still try the primary rather than failing outright
+            start(self.providers[0])
+        try:
+            while running:
+                # Only hedge while a spare provider is left and the request hasn't been rejected
+                timeout = self.hedge_after_seconds if queue and rejected is None else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge = launch()
+                    if hedge is not None:
+                        self.counters[hedge.name]["hedges"] += 1
+                        LLM_HEDGES.labels(hedge.name).inc()
+                        logger.info("LLM primary slow after %ss, hedging to %s", self.hedge_after_seconds, hedge.name)
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return self.served(provider, task.result(), started, hedged=launched > 1)
+                    if not is_retryable(error):
+                        logger.warning("LLM provider %s rejected the request (%s)", provider.name, error)
+                        rejected = rejected or error
+                        continue
+                    logger.warning("LLM provider %s failed (%s), failing over", provider.name, error)
+                    last_error = error
+                if not running and rejected is not None:
+                    raise rejected
+                if not running and queue:
+                    launch()
+            raise last_error
+        finally:
+            for task in running:
+                task.cancel()
+
+    def served(self, provider: ChatProvider, response: AIMessage, started: float, hedged: bool) -> AIMessage:
+        """Record which provider answered and how long the step took."""
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        counters = self.counters[provider.name]
+        counters["served"] += 1
+        counters["latency_ms_total"] += latency_ms
+        response.response_metadata["served_by"] = provider.name
+        response.response_metadata["llm_latency_ms"] = latency_ms
+        logger.debug("LLM step served by %s in %s ms%s", provider.name, latency_ms, " (hedged)" if hedged else "")
+        return response
+
+    def stats(self) -> dict:
+        return {
+            name: {**counters, "circuit": self.breakers[name].state}
+            for name, counters in self.counters.items()
+        }
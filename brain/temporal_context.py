@@ -0,0 +1,328 @@
+'''
+Temporal context for each agent turn: the current time in the user's timezone
+and the date/time expressions of their message ("tomorrow afternoon", "next
+Tuesday at 3pm", "the 21st") resolved to concrete local and UTC ranges.
+
+The resolve_time node puts it in the state once per turn and llm_call sends it
+to the model next to the system prompt, so the model neither calls a tool to
+learn the date nor converts relative dates to UTC itself.
+
+The server clock is used for "now" (browser clocks drift); the user's timezone
+comes from the client. Conventions, stated in the context so the model can
+correct them with the user:
+- a bare weekday is its next occurrence (today included), "next <weekday>"
+  is that day in the following week (weeks start on Monday);
+- a clock time without am/pm is afternoon for 1-7 and morning for 8-11;
+- times and parts of the day attach to the nearest single-day expression,
+  a time with no day (e.g. "make it 3pm") is left to the conversation.
+'''
+import re
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import NamedTuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from langchain_core.messages import HumanMessage
+from brain.agent_state import MessagesState
+
+MAX_EXPRESSIONS = 10
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0, "tuesday": 1, "tues": 1, "tue": 1, "wednesday": 2, "wed": 2,
+    "thursday": 3, "thurs": 3, "thur": 3, "thu": 3, "friday": 4, "fri": 4,
+    "saturday": 5, "sat": 5, "sunday": 6, "sun": 6,
+}
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sept": 9, "sep": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "ten": 10}
+# Local hours, end exclusive
+PARTS_OF_DAY = {
+    "morning": (9, 12), "afternoon": (12, 17), "evening": (17, 21), "tonight": (18, 23),
+    "night": (18, 23), "lunch": (12, 14), "lunchtime": (12, 14),
+}
+
+
+def alternation(words) -> str:
+    return "|".join(sorted(words, key=len, reverse=True))
+
+
+WEEKDAY = alternation(WEEKDAYS)
+MONTH = alternation(MONTHS)
+ORDINAL = r"(\d{1,2})(?:st|nd|rd|th)?"
+CLOCK = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?"
+TIME_PREFIX = r"(at|around|from|between|after|before|by|until|till)"
+
+DAY_PATTERNS = [
+    # "tonight" matches empty so that its hours are still found as a part of the day
+    ("relative", re.compile(r"\b(?:(day after tomorrow|tomorrow|today|this(?= (?:morning|afternoon|evening)\b))\b|(?=(tonight)\b))")),
+    ("iso", re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")),
+    ("month_day", re.compile(rf"\b({MONTH})\.? {ORDINAL}\b(?:,? (\d{{4}}))?")),
+    ("day_month", re.compile(rf"\b(?:the )?{ORDINAL} (?:of )?({MONTH})\b(?:,? (\d{{4}}))?")),
+    ("ordinal", re.compile(r"\bthe (\d{1,2})(?:st|nd|rd|th)\b")),
+    ("weekday", re.compile(rf"\b(?:(this|next|coming) )?({WEEKDAY})\b")),
+    ("week", re.compile(r"\b(this|next) week\b")),
+    ("weekend", re.compile(r"\b(?:(this|next|the) )?weekend\b")),
+    ("month", re.compile(r"\b(this|next) month\b")),
+    ("offset", re.compile(rf"\bin ({alternation(NUMBERS)}|\d+) (day|days|week|weeks)\b")),
+]
+TIME_RANGE = re.compile(rf"\b(?:(from|between) )?{CLOCK}\s*(?:-|–|to|and|until|till)\s*{CLOCK}(?=\W|$)")
+TIME_POINT = re.compile(rf"(?:\b{TIME_PREFIX} )?\b(?:{CLOCK}|(noon|midday|midnight))(?=\W|$)")
+PART_OF_DAY = re.compile(rf"\b({alternation(PARTS_OF_DAY)})s?\b")
+
+
+class DayExpression(NamedTuple):
+    start: int
+    end: int
+    first_day: date
+    last_day: date  # inclusive
+
+
+class TimeExpression(NamedTuple):
+    start: int
+    end: int
+    from_time: dt_time
+    to_time: dt_time | None  # None for a point in time
+    until_midnight: bool = False
+
+
+def user_zone(timezone_name: str | None) -> ZoneInfo:
+    try:
+        return ZoneInfo(timezone_name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo("UTC")
+
+
+def to_number(value: str) -> int:
+    return NUMBERS[value] if value in NUMBERS else int(value)
+
+
+def valid_date(year: int, month: int, day: int) -> date | None:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def upcoming(today: date, month: int, day: int, year: str | None) -> date | None:
+    """The date this year, or next year once it has passed (unless the year is given)."""
+    if year:
+        return valid_date(int(year), month, day)
+    candidate = valid_date(today.year, month, day)
+    if candidate is None or candidate < today:
+        candidate = valid_date(today.year + 1, month, day)
+    return candidate
+
+
+def day_range(kind: str, match: re.Match, today: date) -> tuple[date, date] | None:
+    """First and last (inclusive) local day of a day expression."""
+    if kind == "relative":
+        offset = {"day after tomorrow": 2, "tomorrow": 1}.get(match.group(1) or match.group(2), 0)
+        return today + timedelta(days=offset), today + timedelta(days=offset)
+    if kind == "iso":
+        day = valid_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        return (day, day) if day else None
+    if kind == "month_day":
+        day = upcoming(today, MONTHS[match.group(1)], int(match.group(2)), match.group(3))
+        return (day, day) if day else None
+    if kind == "day_month":
+        day = upcoming(today, MONTHS[match.group(2)], int(match.group(1)), match.group(3))
+        return (day, day) if day else None
+    if kind == "ordinal":
+        day_of_month = int(match.group(1))
+        day = valid_date(today.year, today.month, day_of_month)
+        if day is None or day < today:
+            next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+            day = valid_date(next_month.year, next_month.month, day_of_month)
+        return (day, day) if day else None
+    if kind == "weekday":
+        weekday = WEEKDAYS[match.group(2)]
+        if match.group(1) == "next":
+            monday = today - timedelta(days=today.weekday()) + timedelta(days=7)
+            day = monday + timedelta(days=weekday)
+        else:
+            day = today + timedelta(days=(weekday - today.weekday()) % 7)
+        return day, day
+    if kind == "week":
+        monday = today - timedelta(days=today.weekday())
+        if match.group(1) == "next":
+            return monday + timedelta(days=7), monday + timedelta(days=13)
+        return today, monday + timedelta(days=6)
+    if kind == "weekend":
+        saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+        if today.weekday() == 6:
+            saturday = today - timedelta(days=1)
+        if match.group(1) == "next":
+            saturday += timedelta(days=7)
+        return max(saturday, today), saturday + timedelta(days=1)
+    if kind == "month":
+        first = today.replace(day=1)
+        if match.group(1) == "next":
+            first = (first + timedelta(days=32)).replace(day=1)
+            return first, (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return today, (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    if kind == "offset":
+        amount = to_number(match.group(1))
+        day = today + timedelta(days=amount * (7 if match.group(2).startswith("week") else 1))
+        return day, day
+    return None
+
+
+def clock_time(hour: str, minute: str | None, meridiem: str | None, default_meridiem: str | None = None) -> dt_time | None:
+    hour, minute = int(hour), int(minute or 0)
+    meridiem = (meridiem or default_meridiem or "").replace(".", "")
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == "pm" else 0)
+    elif 1 <= hour <= 7:
+        hour += 12  # "at 3" while booking meetings means the afternoon
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return dt_time(hour, minute)
+
+
+def find_days(text: str, today: date) -> list[DayExpression]:
+    days: list[DayExpression] = []
+    taken: list[tuple[int, int]] = []
+    for kind, pattern in DAY_PATTERNS:
+        for match in pattern.finditer(text):
+            if any(match.start() < end and start < match.end() for start, end in taken):
+                continue
+            resolved = day_range(kind, match, today)
+            if resolved is None:
+                continue
+            taken.append(match.span())
+            days.append(DayExpression(match.start(), match.end(), *resolved))
+    return sorted(days)
+
+
+def find_times(text: str, days: list[DayExpression]) -> list[TimeExpression]:
+    """Clock times, time ranges and parts of the day, outside the day expressions' text."""
+    times: list[TimeExpression] = []
+    taken = [(day.start, day.end) for day in days]
+
+    def free(match: re.Match) -> bool:
+        return not any(match.start() < end and start < match.end() for start, end in taken)
+
+    for match in TIME_RANGE.finditer(text):
+        prefix, h1, m1, am1, h2, m2, am2 = match.groups()
+        # Needs "from"/"between", am/pm or minutes, otherwise "2 to 3 people" would be a time
+        if not free(match) or not (prefix or am1 or am2 or (m1 and m2)):
+            continue
+        end_time = clock_time(h2, m2, am2)
+        start_time = clock_time(h1, m1, am1, None if am1 else am2)
+        if start_time and end_time and start_time > end_time and not am1:
+            start_time = clock_time(h1, m1, "am")
+        if start_time and end_time and start_time < end_time:
+            taken.append(match.span())
+            times.append(TimeExpression(match.start(), match.end(), start_time, end_time))
+
+    for match in TIME_POINT.finditer(text):
+        prefix, hour, minute, meridiem, named = match.groups()
+        if not free(match):
+            continue
+        if named:
+            point = dt_time(0) if named == "midnight" else dt_time(12)
+        elif prefix or meridiem or minute:
+            point = clock_time(hour, minute, meridiem)
+        else:
+            continue
+        if point is None:
+            continue
+        taken.append(match.span())
+        if prefix == "after":
+            times.append(TimeExpression(match.start(), match.end(), point, None, until_midnight=True))
+        elif prefix in ("before", "by", "until", "till"):
+            times.append(TimeExpression(match.start(), match.end(), dt_time(0), point))
+        else:
+            times.append(TimeExpression(match.start(), match.end(), point, None))
+
+    for match in PART_OF_DAY.finditer(text):
+        if free(match):
+            first_hour, last_hour = PARTS_OF_DAY[match.group(1)]
+            times.append(TimeExpression(match.start(), match.end(), dt_time(first_hour), dt_time(last_hour % 24)))
+    return sorted(times)
+
+
+def nearest_day(expression: TimeExpression, days: list[DayExpression]) -> DayExpression | None:
+    def distance(day: DayExpression) -> int:
+        return max(day.start - expression.end, expression.start - day.end, 0)
+    single_days = [day for day in days if day.first_day == day.last_day]
+    return min(single_days, key=distance, default=None)
+
+
+def format_utc(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def describe(text: str, start: int, end: int) -> str:
+    return text[start:end].strip()
+
+
+def resolve_expressions(query: str, now: datetime) -> list[str]:
+    """One line per date/time expression in `query`, resolved against `now` (aware, user's zone)."""
+    text = query.lower()
+    tz = now.tzinfo
+    today = now.date()
+    days = find_days(text, today)
+    times = find_times(text, days)
+
+    lines = []
+    timed_days = set()
+    for expression in times:
+        day = nearest_day(expression, days)
+        if day is None:
+            continue
+        timed_days.add(day)
+        start = datetime.combine(day.first_day, expression.from_time, tz)
+        label = describe(text, min(day.start, expression.start), max(day.end, expression.end))
+        if expression.to_time is None and not expression.until_midnight:
+            lines.append(f'- "{label}": {start:%A %d %B %Y, %H:%M} = {format_utc(start)}')
+            continue
+        end = (
+            datetime.combine(day.first_day + timedelta(days=1), dt_time(0), tz)
+            if expression.until_midnight else datetime.combine(day.first_day, expression.to_time, tz)
+        )
+        lines.append(
+            f'- "{label}": {start:%A %d %B %Y, %H:%M}–{end:%H:%M} = {format_utc(start)} to {format_utc(end)}'
+        )
+
+    for day in days:
+        if day in timed_days:
+            continue
+        start = datetime.combine(day.first_day, dt_time(0), tz)
+        end = datetime.combine(day.last_day + timedelta(days=1), dt_time(0), tz)
+        local = f"{day.first_day:%A %d %B %Y}"
+        if day.last_day != day.first_day:
+            local = f"{day.first_day:%A %d %B} – {day.last_day:%A %d %B %Y}"
+        lines.append(f'- "{describe(text, day.start, day.end)}": {local} (whole days) = {format_utc(start)} to {format_utc(end)}')
+    return lines[:MAX_EXPRESSIONS]
+
+
+def temporal_context(query: str, timezone_name: str | None, now: datetime | None = None) -> str:
+    """The text block given to the model for this turn."""
+    tz = user_zone(timezone_name)
+    now = (now or datetime.now(timezone.utc)).astimezone(tz)
+    offset = now.strftime("%z")
+    lines = [
+        "<TURN_CONTEXT>",
+        f"Current time: {now:%A %d %B %Y, %H:%M} in {tz.key} (UTC{offset[:3]}:{offset[3:]}) = {format_utc(now)}",
+    ]
+    expressions = resolve_expressions(query, now)
+    if expressions:
+        lines.append("Dates and times in the user's latest message, resolved in their timezone (ranges end exclusive):")
+        lines.extend(expressions)
+    lines.append("</TURN_CONTEXT>")
+    return "\n".join(lines)
+
+
+async def resolve_time(state: MessagesState):
+    """Graph node: the turn's temporal context, from the latest user message."""
+    query = ""
+    for message in reversed(state.get("messages", [])):
+        if isinstance(message, HumanMessage):
+            query = message.content if isinstance(message.content, str) else ""
+            break
+    return {"temporal_context": temporal_context(query, state.get("timezone"))}
@@ -1,34 +1,73 @@
 from langchain_core.tools import StructuredTool
-from brain.tools.slots_tool import BookSlotInput, GetSlotsInput, SlotTool
-from brain.tools.time_tools import get_current_date
-from server.services.google_calendar import GoogleCalendarService
+from brain.tools.slots_tool import BookSlotInput, BookSlotsInput, FindFreeSlotsInput, GetSlotsInput, SlotTool
 
+# Tool calls from one model turn run concurrently, at most this many at a time
+MAX_CONCURRENT_TOOL_CALLS = 4
 
-def setup_agent_tools(google_calendar_service: GoogleCalendarService):
+# Per-tool timeouts; a timed out call is reported back to the model as an error
+DEFAULT_TOOL_TIMEOUT_SECONDS = 20
+TOOL_TIMEOUT_SECONDS = {
+    "get_slots": 15,
+    "find_free_slots": 15,
+    "book_slot": 25,
+    "book_slots": 40,
+}
+# Tools whose timeout doesn't cancel them: the request may already have reached
+# Google, so the call runs to completion in the background instead
+BOOKING_TOOLS = {"book_slot", "book_slots"}
+
+# Status lines shown to the user while a tool runs (streamed /talk)
+TOOL_PROGRESS_MESSAGES = {
+    "get_slots": "Checking your calendar…",
+    "book_slot": "Booking the slot…",
+    "book_slots": "Booking the slots…",
+    "find_free_slots": "Looking for free time…",
+}
+
+
+def setup_agent_tools():
     """
     Instantiates the SlotTool class and retrieves the runnable tools.
-    This function should be called for every API request/session.
+    This function is called once per process; the tools resolve the user's
+    GoogleCalendarService from the run config at invocation time.
     """
-    # 1. Instantiate the tool wrapper with the dependency
-    slot_tool_instance = SlotTool(google_calendar_service=google_calendar_service)
+    # 1. Instantiate the tool wrapper (stateless, shared across sessions)
+    slot_tool_instance = SlotTool()
     get_slots_tool = StructuredTool.from_function(
             func=slot_tool_instance.get_slots,
+            coroutine=slot_tool_instance.aget_slots,
             args_schema=GetSlotsInput,
             name="get_slots",
-            description="Get the busy slots from the Google calendar. Use this tool to check the user's availability within a specific time range. The times must be provided in UTC (Z) format."
+            description="Get the busy slots from the Google calendar. Use this tool to check the user's availability within a specific time range. The times must be provided in UTC (Z) format. To check attendees or the user's other calendars, pass them in `calendars`: they are all checked in this one call, and `busy` is when anyone is busy."
         )
         
     book_slot_tool = StructuredTool.from_function(
         func=slot_tool_instance.book_slot,
+        coroutine=slot_tool_instance.abook_slot,
         args_schema=BookSlotInput,
         name="book_slot",
         description="Book a new event slot on the Google calendar. Requires summary, description, and start/end times in ISO 8601 format with timezone offset."
     )
+    book_slots_tool = StructuredTool.from_function(
+        func=slot_tool_instance.book_slots,
+        coroutine=slot_tool_instance.abook_slots,
+        args_schema=BookSlotsInput,
+        name="book_slots",
+        description="Book several events on the Google calendar in one call, e.g. a meeting on each day of a week. Use it instead of calling book_slot repeatedly. Each slot needs summary, description, and start/end times in ISO 8601 format with timezone offset. Reports which slots were booked and which failed."
+    )
+    find_free_slots_tool = StructuredTool.from_function(
+        func=slot_tool_instance.find_free_slots,
+        coroutine=slot_tool_instance.afind_free_slots,
+        args_schema=FindFreeSlotsInput,
+        name="find_free_slots",
+        description="Find free time slots of a given duration in the user's Google calendar between two dates (user's local dates), within working hours. Prefer this over get_slots when the user asks when they are free or wants a slot suggested. Returned times are in the user's timezone. Pass attendee emails in `calendars` to find times when everyone is free. Calendars listed in `unavailable_calendars` could not be checked, so the candidates ignore them: tell the user."
+    )
     # 2. Get the bound methods (which are now callable tools)
     tools = [
-        get_current_date,
         get_slots_tool,
         book_slot_tool,
+        book_slots_tool,
+        find_free_slots_tool,
     ]
 
     # 3. Create the lookup dictionary
@@ -1,5 +1,6 @@
 from typing import Any, Dict, List
 
+from langchain_core.runnables import RunnableConfig
 from pydantic.v1 import BaseModel, Field
 from server.services.google_calendar import GoogleCalendarService
 
@@ -8,6 +9,7 @@ class GetSlotsInput(BaseModel):
     """Input for getting available calendar slots."""
     time_min: str = Field(..., description="The start time of the period to check, in ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ).")
     time_max: str = Field(..., description="The end time of the period to check, in ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ).")
+    calendars: List[str] = Field(default_factory=list, description="Other calendars to check together with the user's: calendar ids or attendee email addresses. Leave empty for the user's calendar only.")
 
 class DateTimeInput(BaseModel):
     """Structure for date and time fields in a booking."""
@@ -20,40 +22,111 @@ class BookSlotInput(BaseModel):
     start: DateTimeInput
     end: DateTimeInput
 
+class BookSlotsInput(BaseModel):
+    """Input for booking several slots at once."""
+    slots: List[BookSlotInput] = Field(..., description="The events to book, e.g. one per day for a recurring meeting.")
+
+class FindFreeSlotsInput(BaseModel):
+    """Input for finding free calendar slots."""
+    duration_minutes: int = Field(..., description="Length of the meeting in minutes.")
+    date_from: str = Field(..., description="First day to search, in the user's local time (YYYY-MM-DD).")
+    date_to: str = Field(..., description="Last day to search, inclusive, in the user's local time (YYYY-MM-DD).")
+    work_start: str = Field("09:00", description="Earliest start time of day in the user's local time (HH:MM).")
+    work_end: str = Field("17:00", description="Latest end time of day in the user's local time (HH:MM).")
+    limit: int = Field(5, description="Maximum number of candidate slots to return.")
+    calendars: List[str] = Field(default_factory=list, description="Attendee email addresses or other calendar ids that must also be free. Leave empty for the user's calendar only.")
+
 class SlotTool:
     """
     Wrapper class for Google Calendar operations.
-    An instance of this class must be created per user session.
+    A single instance is shared by every session; the per-user GoogleCalendarService
+    is read from the run config ("configurable" -> "google_calendar_service") on each call.
     """
-    def __init__(self, google_calendar_service: GoogleCalendarService):
-        self.google_calendar_service = google_calendar_service
+    @staticmethod
+    def get_calendar_service(config: RunnableConfig) -> GoogleCalendarService:
+        service = (config or {}).get("configurable", {}).get("google_calendar_service")
+        if service is None:
+            raise ValueError("google_calendar_service is missing from the run config.")
+        return service
 
-    def get_slots(self, time_min: str, time_max: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def build_slot(summary: str, description: str, start: DateTimeInput, end: DateTimeInput) -> Dict[str, Any]:
+        """Reconstruct the slot dictionary needed by the service"""
+        return {
+            "summary": summary,
+            "description": description,
+            "start": {
+                "dateTime": start.dateTime
+            },
+            "end": {
+                "dateTime": end.dateTime
+            }
+        }
+
+    @staticmethod
+    def get_timezone(config: RunnableConfig) -> str:
+        """The user's timezone, copied from MessagesState into the run config by tool_node."""
+        return (config or {}).get("configurable", {}).get("timezone") or "UTC"
+
+    def get_slots(self, time_min: str, time_max: str, config: RunnableConfig, calendars: List[str] | None = None) -> List[Dict[str, Any]]:
         """
         Get the busy slots from the Google calendar.
         Use this tool to check the user's availability within a specific time range.
         The times must be provided in UTC (Z) format.
         The tool gives you the busy time periods check if the user given time periods coincide with any of the busy slots.
+        With `calendars` (attendees or other calendars) all of them are checked in the same call.
         """
-        # The service call needs to be updated to accept the new arguments
-        # slots = self.google_calendar_service.get_slots(time_min, time_max) # Example
-        return self.google_calendar_service.get_slots(time_min, time_max)
+        return self.get_calendar_service(config).get_slots(time_min, time_max, calendars)
     
-    def book_slot(self, summary: str, description: str, start: DateTimeInput, end: DateTimeInput) -> Dict[str, Any]:
+    def book_slot(self, summary: str, description: str, start: DateTimeInput, end: DateTimeInput, config: RunnableConfig) -> Dict[str, Any]:
         """
         Book a new event slot on the Google calendar.
         Requires summary, description, and start/end times in ISO 8601 format with timezone offset.
         """
-        # Reconstruct the slot dictionary needed by the service
-        slot = {
-            "summary": summary,
-            "description": description,
-            "start": {
-                "dateTime": start.dateTime
-            },
-            "end": {
-                "dateTime": end.dateTime
-            }
-        }
-        response = self.google_calendar_service.book_slot(slot)
-        return response
\ No newline at end of file
+        slot = self.build_slot(summary, description, start, end)
+        response = self.get_calendar_service(config).book_slot(slot)
+        return response
+
+    def book_slots(self, slots: List[BookSlotInput], config: RunnableConfig) -> Dict[str, Any]:
+        """
+        Book several event slots on the Google calendar in one batched call.
+        Reports for each slot whether it was booked or why it failed.
+        """
+        return self.format_bookings(self.get_calendar_service(config).book_slots(self.build_slots(slots)))
+
+    @classmethod
+    def build_slots(cls, slots: List[BookSlotInput]) -> List[Dict[str, Any]]:
+        return [cls.build_slot(slot.summary, slot.description, slot.start, slot.end) for slot in slots]
+
+    @staticmethod
+    def format_bookings(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        booked = sum(result["status"] == "booked" for result in results)
+        return {"booked": booked, "failed": len(results) - booked, "results": results}
+
+    def find_free_slots(self, duration_minutes: int, date_from: str, date_to: str, config: RunnableConfig, work_start: str = "09:00", work_end: str = "17:00", limit: int = 5, calendars: List[str] | None = None) -> Dict[str, Any]:
+        """
+        Find free slots of the given duration in the user's calendar between two local dates,
+        within working hours. Returns candidate start/end times in the user's timezone.
+        """
+        return self.get_calendar_service(config).find_free_slots(
+            duration_minutes, date_from, date_to, self.get_timezone(config), work_start, work_end, limit, calendars
+        )
+
+    async def aget_slots(self, time_min: str, time_max: str, config: RunnableConfig, calendars: List[str] | None = None) -> List[Dict[str, Any]]:
+        """Async variant of get_slots."""
+        return await self.get_calendar_service(config).aget_slots(time_min, time_max, calendars)
+
+    async def abook_slot(self, summary: str, description: str, start: DateTimeInput, end: DateTimeInput, config: RunnableConfig) -> Dict[str, Any]:
+        """Async variant of book_slot."""
+        slot = self.build_slot(summary, description, start, end)
+        return await self.get_calendar_service(config).abook_slot(slot)
+
+    async def abook_slots(self, slots: List[BookSlotInput], config: RunnableConfig) -> Dict[str, Any]:
+        """Async variant of book_slots."""
+        return self.format_bookings(await self.get_calendar_service(config).abook_slots(self.build_slots(slots)))
+
+    async def afind_free_slots(self, duration_minutes: int, date_from: str, date_to: str, config: RunnableConfig, work_start: str = "09:00", work_end: str = "17:00", limit: int = 5, calendars: List[str] | None = None) -> Dict[str, Any]:
+        """Async variant of find_free_slots."""
+        return await self.get_calendar_service(config).afind_free_slots(
+            duration_minutes, date_from, date_to, self.get_timezone(config), work_start, work_end, limit, calendars
+        )
@@ -7,8 +7,11 @@ const sendBtn = document.getElementById("sendBtn");
 const introTextEl = document.getElementById("introText");
 const introMessage =
   "Hello, I'm your booking assistant!";
-let conversationId = null;
+// Kept for the tab's lifetime so a reload picks the conversation back up
+let conversationId = sessionStorage.getItem("conversationId");
 let typingBubble = null;
+let loadEarlierBtn = null;
+const HISTORY_PAGE_SIZE = 20;
 
 chatInput.addEventListener("input", () => {
   sendBtn.disabled = chatInput.value.trim().length === 0;
@@ -41,6 +44,7 @@ fetch("/me")
 function showChat() {
   connectContainer.classList.add("hidden");
   chatWrapper.classList.remove("hidden");
+  if (conversationId) loadHistory();
 }
 
 function showConnect() {
@@ -69,7 +73,12 @@ function sendMessage() {
 
   showTyping();
 
-  fetch("/talk", {
+  // Reply bubble filled token by token; created on the first token
+  let draft = null;
+  let draftText = "";
+  let answered = false;
+
+  fetch("/talk/stream", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({
@@ -79,32 +88,159 @@ function sendMessage() {
       conversation_id: conversationId
     })
   })
-    .then(res => res.json())
-    .then(data => {
-      removeTyping();
-      chatInput.disabled = false;
-      sendBtn.disabled = true;
-      chatInput.focus();
-
-      if (data.conversation_id) {
-        conversationId = data.conversation_id;
-      }
-
-      const last = data.messages?.at(-1);
-      if (last?.content) {
-        appendMessage(last.content, "ai", true);
-      }
+    .then(res => {
+      if (!res.ok || !res.body) throw new Error();
+      return readEventStream(res, (event, data) => {
+        switch (event) {
+          case "conversation":
+            conversationId = data.conversation_id;
+            sessionStorage.setItem("conversationId", conversationId);
+            break;
+          case "llm_start":
+            // A new model step starts; text from an earlier step was a preamble to a tool call
+            draftText = "";
+            if (draft) draft.textContent = "";
+            break;
+          case "token":
+            if (!draft) {
+              removeTyping();
+              draft = appendMessage("", "ai");
+            }
+            draftText += data.text;
+            draft.textContent = draftText;
+            chatHistory.scrollTop = chatHistory.scrollHeight;
+            break;
+          case "tool_start":
+            showTyping(data.message);
+            break;
+          case "tool_end":
+            removeTyping();
+            break;
+          case "message":
+            removeTyping();
+            answered = true;
+            if (!data.content) break;
+            if (!draft) draft = appendMessage("", "ai");
+            draft.innerHTML = renderMarkdown(data.content);
+            chatHistory.scrollTop = chatHistory.scrollHeight;
+            break;
+          case "error":
+            throw new Error(data.detail);
+        }
+      });
+    })
+    .then(() => {
+      if (!answered) throw new Error();
+      finishTurn();
     })
     .catch(() => {
-      removeTyping();
-      chatInput.disabled = false;
-      sendBtn.disabled = true;
+      finishTurn();
       appendMessage("Something went wrong.", "ai");
     });
 }
 
+function finishTurn() {
+  removeTyping();
+  chatInput.disabled = false;
+  sendBtn.disabled = true;
+  chatInput.focus();
+}
+
+/* ---------- Server-Sent Events ---------- */
+// EventSource only supports GET, so the POST response body is parsed by hand.
+async function readEventStream(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      onEvent(event, data ? JSON.parse(data) : {});
+    }
+  }
+}
+
+/* ---------- History ---------- */
+// Pages of earlier messages are prepended above what is already shown;
+// new turns are only ever appended, the server sends just their messages.
+function loadHistory(before) {
+  const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+  if (before) params.set("before", before);
+
+  return fetch(`/conversations/${encodeURIComponent(conversationId)}/messages?${params}`)
+    .then(res => {
+      if (res.status === 404) {
+        // Expired or not ours: start a new conversation
+        conversationId = null;
+        sessionStorage.removeItem("conversationId");
+        return null;
+      }
+      if (!res.ok) throw new Error();
+      return res.json();
+    })
+    .then(page => {
+      if (!page) return;
+      prependMessages(page.messages);
+      setLoadEarlier(page.next_cursor);
+      if (!before) chatHistory.scrollTop = chatHistory.scrollHeight;
+    })
+    .catch(() => setLoadEarlier(before));
+}
+
+function prependMessages(messages) {
+  // Keep the visible messages in place while older ones are added above them
+  const anchor = loadEarlierBtn ? loadEarlierBtn.nextSibling : chatHistory.firstChild;
+  const fromBottom = chatHistory.scrollHeight - chatHistory.scrollTop;
+
+  for (const message of messages) {
+    const type = message.role === "user" ? "user" : "ai";
+    chatHistory.insertBefore(createMessageRow(message.content, type, type === "ai"), anchor);
+  }
+  chatHistory.scrollTop = chatHistory.scrollHeight - fromBottom;
+}
+
+function setLoadEarlier(cursor) {
+  if (!cursor) {
+    if (loadEarlierBtn) loadEarlierBtn.remove();
+    loadEarlierBtn = null;
+    return;
+  }
+  if (!loadEarlierBtn) {
+    loadEarlierBtn = document.createElement("button");
+    loadEarlierBtn.className = "load-earlier";
+    loadEarlierBtn.textContent = "Load earlier messages";
+    chatHistory.insertBefore(loadEarlierBtn, chatHistory.firstChild);
+  }
+  loadEarlierBtn.disabled = false;
+  loadEarlierBtn.onclick = () => {
+    loadEarlierBtn.disabled = true;
+    loadHistory(cursor);
+  };
+}
+
 /* ---------- Messages ---------- */
 function appendMessage(text, type, markdown = false) {
+  const row = createMessageRow(text, type, markdown);
+  chatHistory.appendChild(row);
+  chatHistory.scrollTop = chatHistory.scrollHeight;
+  return row.firstChild;
+}
+
+function createMessageRow(text, type, markdown = false) {
   const row = document.createElement("div");
   row.className = `message-row ${type}`;
 
@@ -118,13 +254,13 @@ function appendMessage(text, type, markdown = false) {
   }
 
   row.appendChild(bubble);
-  chatHistory.appendChild(row);
-  chatHistory.scrollTop = chatHistory.scrollHeight;
+  return row;
 }
 
 
 
-function showTyping() {
+function showTyping(status) {
+  removeTyping();
   typingBubble = document.createElement("div");
   typingBubble.className = "message ai typing";
 
@@ -134,6 +270,13 @@ function showTyping() {
     <div class="typing-dot"></div>
   `;
 
+  if (status) {
+    const label = document.createElement("span");
+    label.className = "typing-status";
+    label.textContent = status;
+    typingBubble.appendChild(label);
+  }
+
   chatHistory.appendChild(typingBubble);
   chatHistory.scrollTop = chatHistory.scrollHeight;
 }
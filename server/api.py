@@ -1,26 +1,88 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from server.endpoints import router
-from server.db.database import init_db
+from server.db.database import close_db, init_db
+from brain.agent import init_booking_agent
+from brain.intent_router import intent_router
+from brain.checkpointer import checkpointer_health, open_checkpointer
+from brain.checkpoint_retention import checkpoint_retention_loop
+from server.services.calendar_mirror import calendar_mirror, calendar_mirror_loop
+from server.services.google_client import google_executor
+from server.services.google_oauth import credential_refresh_loop
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from server.config import settings
+from server.metrics import register_stats, render_metrics
+from server.services.availability_cache import availability_cache
+from server.services.credential_cache import credential_cache
+from server.services.google_scheduler import google_api_scheduler
+from server.services.user_cache import user_cache
 import os
 
+logging.basicConfig(format="%(levelname)s: %(message)s")
+# LOG_LEVEL applies to the app's own loggers, libraries stay at WARNING
+for logger_name in ("brain", "server"):
+    logging.getLogger(logger_name).setLevel(settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: runs before the application starts
-    init_db()
-    yield
-    # Shutdown: runs after the application stops (add cleanup here if needed)
+    # LangGraph and other asyncio.to_thread users share this pool; Google calls have their own
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.DEFAULT_EXECUTOR_THREADS, thread_name_prefix="default")
+    )
+    await init_db()
+    async with open_checkpointer() as checkpointer:
+        app.state.checkpointer = checkpointer
+        # Compile the agent graph once so the first /talk doesn't pay for it
+        try:
+            init_booking_agent(checkpointer)
+        except Exception as e:
+            logger.error("Failed to build booking agent at startup: %s", e)
+        background_tasks = [asyncio.create_task(credential_refresh_loop())]
+        if settings.CALENDAR_MIRROR_ENABLED:
+            background_tasks.append(asyncio.create_task(calendar_mirror_loop()))
+        if checkpointer:
+            background_tasks.append(asyncio.create_task(checkpoint_retention_loop(checkpointer.conn)))
+        yield
+        for task in background_tasks:
+            task.cancel()
+        await calendar_mirror.aclose()
+        google_executor.shutdown(wait=False, cancel_futures=True)
+    # Shutdown: runs after the application stops; the checkpointer pool is closed above
+    await close_db()
 
 app = FastAPI(lifespan=lifespan)
 
+register_stats({
+    "user_cache": user_cache.stats,
+    "credential_cache": credential_cache.stats,
+    "availability_cache": availability_cache.stats,
+    "calendar_mirror": calendar_mirror.stats,
+    "intent_router": intent_router.stats,
+    "google_api_scheduler": google_api_scheduler.stats,
+    "checkpointer_pool": lambda: checkpointer_health(getattr(app.state, "checkpointer", None)),
+})
+
 app.include_router(router)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
 app.mount("/frontend", StaticFiles(directory=FRONTEND_DIR), name="frontend")
 
+@app.get("/health")
+def health():
+    return {"checkpointer": checkpointer_health(getattr(app.state, "checkpointer", None))}
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 def serve_ui():
     return FileResponse(os.path.join(FRONTEND_DIR, "index.html"))
\ No newline at end of file
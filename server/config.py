@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class Settings:
+    # Log level for the app's loggers (DEBUG shows each graph step and tool call)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
     # Google OAuth
     GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
     GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
@@ -11,7 +14,82 @@ class Settings:
     
     # Database
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+    DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+    DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
     
+    # LangGraph checkpointer connection pool (see brain/checkpointer.py)
+    CHECKPOINT_POOL_MIN_SIZE = int(os.getenv("CHECKPOINT_POOL_MIN_SIZE", "2"))
+    CHECKPOINT_POOL_MAX_SIZE = int(os.getenv("CHECKPOINT_POOL_MAX_SIZE", "10"))
+    CHECKPOINT_POOL_TIMEOUT_SECONDS = float(os.getenv("CHECKPOINT_POOL_TIMEOUT_SECONDS", "10"))
+    CHECKPOINT_POOL_MAX_IDLE_SECONDS = float(os.getenv("CHECKPOINT_POOL_MAX_IDLE_SECONDS", "300"))
+    CHECKPOINT_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("CHECKPOINT_POOL_MAX_LIFETIME_SECONDS", "1800"))
+
+    # Checkpoint retention (see brain/checkpoint_retention.py)
+    CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))
+    CHECKPOINT_THREAD_TTL_DAYS = float(os.getenv("CHECKPOINT_THREAD_TTL_DAYS", "30"))
+    CHECKPOINT_RETENTION_BATCH_SIZE = int(os.getenv("CHECKPOINT_RETENTION_BATCH_SIZE", "200"))
+    CHECKPOINT_RETENTION_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_RETENTION_INTERVAL_SECONDS", "3600"))
+
+    # Greetings, thanks and the like are answered from templates without the LLM (see brain/intent_router.py)
+    INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+
+    # Worker threads for blocking calls, sized here rather than from the host's CPU count.
+    # googleapiclient and google-auth calls get their own pool (see google_client.py) so a
+    # slow Google can't hold the threads asyncio.to_thread and LangGraph use for everything else.
+    GOOGLE_EXECUTOR_THREADS = int(os.getenv("GOOGLE_EXECUTOR_THREADS", "16"))
+    DEFAULT_EXECUTOR_THREADS = int(os.getenv("DEFAULT_EXECUTOR_THREADS", "8"))
+
+    # Google API transport: keep-alive connections shared by every user's client
+    GOOGLE_HTTP_POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "10"))
+    GOOGLE_HTTP_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "30"))
+
+    # Google API quotas and retries (see server/services/google_scheduler.py).
+    # Defaults follow the Calendar API's per-minute quotas; lower them to match the project's console.
+    GOOGLE_QUOTA_PROJECT_PER_MINUTE = float(os.getenv("GOOGLE_QUOTA_PROJECT_PER_MINUTE", "10000"))
+    GOOGLE_QUOTA_PROJECT_BURST = int(os.getenv("GOOGLE_QUOTA_PROJECT_BURST", "100"))
+    GOOGLE_QUOTA_USER_PER_MINUTE = float(os.getenv("GOOGLE_QUOTA_USER_PER_MINUTE", "600"))
+    GOOGLE_QUOTA_USER_BURST = int(os.getenv("GOOGLE_QUOTA_USER_BURST", "20"))
+    GOOGLE_QUOTA_MAX_WAIT_SECONDS = float(os.getenv("GOOGLE_QUOTA_MAX_WAIT_SECONDS", "10"))
+    GOOGLE_API_MAX_RETRIES = int(os.getenv("GOOGLE_API_MAX_RETRIES", "4"))
+    GOOGLE_API_BACKOFF_BASE_SECONDS = float(os.getenv("GOOGLE_API_BACKOFF_BASE_SECONDS", "0.5"))
+    GOOGLE_API_BACKOFF_MAX_SECONDS = float(os.getenv("GOOGLE_API_BACKOFF_MAX_SECONDS", "8"))
+
+    # Per-user freebusy cache (see server/services/availability_cache.py)
+    AVAILABILITY_CACHE_TTL_SECONDS = float(os.getenv("AVAILABILITY_CACHE_TTL_SECONDS", "120"))
+    AVAILABILITY_CACHE_MAX_USERS = int(os.getenv("AVAILABILITY_CACHE_MAX_USERS", "1000"))
+
+    # Local mirror of each user's primary calendar (see server/services/calendar_mirror.py).
+    # Availability is answered from it while the last sync is younger than the max staleness
+    # (watched calendars) or the polled staleness (no channel, so outside changes only arrive
+    # with a sync; capped at the max staleness). Older mirrors fall back to a live freebusy.
+    # The poll only covers users who looked up availability within the active window, a
+    # bounded number at a time.
+    CALENDAR_MIRROR_ENABLED = os.getenv("CALENDAR_MIRROR_ENABLED", "true").lower() == "true"
+    CALENDAR_MIRROR_DAYS_BEHIND = int(os.getenv("CALENDAR_MIRROR_DAYS_BEHIND", "7"))
+    CALENDAR_MIRROR_DAYS_AHEAD = int(os.getenv("CALENDAR_MIRROR_DAYS_AHEAD", "180"))
+    CALENDAR_MIRROR_MAX_STALENESS_SECONDS = float(os.getenv("CALENDAR_MIRROR_MAX_STALENESS_SECONDS", "600"))
+    CALENDAR_MIRROR_SYNC_INTERVAL_SECONDS = float(os.getenv("CALENDAR_MIRROR_SYNC_INTERVAL_SECONDS", "300"))
+    CALENDAR_MIRROR_POLLED_STALENESS_SECONDS = float(os.getenv("CALENDAR_MIRROR_POLLED_STALENESS_SECONDS", "60"))
+    CALENDAR_MIRROR_ACTIVE_SECONDS = float(os.getenv("CALENDAR_MIRROR_ACTIVE_SECONDS", "3600"))
+    CALENDAR_MIRROR_POLL_CONCURRENCY = int(os.getenv("CALENDAR_MIRROR_POLL_CONCURRENCY", "4"))
+    # Public HTTPS address of POST /calendar/notifications; without it mirrors are only polled
+    CALENDAR_WEBHOOK_URL = os.getenv("CALENDAR_WEBHOOK_URL")
+    CALENDAR_WATCH_TTL_SECONDS = int(os.getenv("CALENDAR_WATCH_TTL_SECONDS", "604800"))
+
+    # Users looked up by session id / email (see server/services/user_cache.py)
+    USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+    USER_CACHE_MAX_USERS = int(os.getenv("USER_CACHE_MAX_USERS", "10000"))
+
+    # Google credentials stay cached while their user is active (see server/services/credential_cache.py)
+    CREDENTIAL_CACHE_IDLE_SECONDS = float(os.getenv("CREDENTIAL_CACHE_IDLE_SECONDS", "3600"))
+    CREDENTIAL_CACHE_MAX_USERS = int(os.getenv("CREDENTIAL_CACHE_MAX_USERS", "10000"))
+    # Cached Google credentials are refreshed in the background this long before expiry
+    CREDENTIAL_REFRESH_MARGIN_SECONDS = float(os.getenv("CREDENTIAL_REFRESH_MARGIN_SECONDS", "300"))
+    CREDENTIAL_REFRESH_INTERVAL_SECONDS = float(os.getenv("CREDENTIAL_REFRESH_INTERVAL_SECONDS", "60"))
+
     # Google OAuth Scopes
     GOOGLE_SCOPES = [
         "https://www.googleapis.com/auth/calendar.readonly",
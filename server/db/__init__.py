@@ -1,5 +1,5 @@
 # Makes db a proper Python package
-from server.db.database import get_db, init_db
-from server.db.models import User, Base
+from server.db.database import close_db, get_db, init_db
+from server.db.models import Base, CalendarEvent, CalendarMirror, User
 
-__all__ = ["get_db", "init_db", "User", "Base"]
\ No newline at end of file
+__all__ = ["close_db", "get_db", "init_db", "User", "Base", "CalendarMirror", "CalendarEvent"]
\ No newline at end of file
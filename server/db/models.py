@@ -1,10 +1,16 @@
-from sqlalchemy import Column, String, JSON, DateTime
+from sqlalchemy import Boolean, Column, String, JSON, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime,timezone
 import uuid
 
 Base = declarative_base()
 
+
+def utcnow() -> datetime:
+    # The columns are TIMESTAMP WITHOUT TIME ZONE holding UTC, like Google's token expiry;
+    # asyncpg refuses aware datetimes for them
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -13,8 +19,44 @@ class User(Base):
     google_access_token = Column(String, nullable=True)  # Stores google access_token
     google_refresh_token = Column(String, nullable=True)  # Stores refresh_token
     google_token_expiry = Column(DateTime, nullable=True)  # Stores access_token expiry
-    created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc), nullable=False)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, nullable=False)
     
     def __repr__(self):
-        return f"<User(id={self.id}, email={self.email}, google_access_token={self.google_access_token}, google_refresh_token={self.google_refresh_token}, google_token_expiry={self.google_token_expiry})>"
\ No newline at end of file
+        return f"<User(id={self.id}, email={self.email}, google_access_token={self.google_access_token}, google_refresh_token={self.google_refresh_token}, google_token_expiry={self.google_token_expiry})>"
+
+
+class CalendarMirror(Base):
+    """Sync state of a user's calendar mirrored into calendar_events (see server/services/calendar_mirror.py)."""
+    __tablename__ = "calendar_mirrors"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    calendar_id = Column(String, primary_key=True, default="primary")
+    time_zone = Column(String, nullable=True)  # calendar's zone, all-day events start at its midnight
+    sync_token = Column(String, nullable=True)  # nextSyncToken of the last events.list
+    window_start = Column(DateTime, nullable=False)  # events are complete inside [window_start, window_end)
+    window_end = Column(DateTime, nullable=False)
+    synced_at = Column(DateTime, nullable=True)
+    channel_id = Column(String, nullable=True, unique=True)  # push notification channel, see events.watch
+    channel_resource_id = Column(String, nullable=True)
+    channel_token = Column(String, nullable=True)
+    channel_expires_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<CalendarMirror(user_id={self.user_id}, calendar_id={self.calendar_id}, synced_at={self.synced_at})>"
+
+
+class CalendarEvent(Base):
+    """One event instance of a mirrored calendar, start/end in naive UTC."""
+    __tablename__ = "calendar_events"
+    __table_args__ = (Index("ix_calendar_events_user_start", "user_id", "calendar_id", "start"),)
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    calendar_id = Column(String, primary_key=True, default="primary")
+    event_id = Column(String, primary_key=True)
+    start = Column(DateTime, nullable=False)
+    end = Column(DateTime, nullable=False)
+    busy = Column(Boolean, nullable=False)  # False for transparent, cancelled or declined events
+
+    def __repr__(self):
+        return f"<CalendarEvent(user_id={self.user_id}, event_id={self.event_id}, start={self.start}, end={self.end})>"
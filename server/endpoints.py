@@ -2,34 +2,50 @@
 This file should contain the endpoints for the application user registration & login authorization flow with Google calendar
 google calendar api documentation: https://developers.google.com/calendar/api/guides/overview
 '''
+import json
+import logging
+import math
+import time
 import uuid
 from dotenv import load_dotenv
-from fastapi import APIRouter, Cookie, Depends, HTTPException
-from starlette.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from brain.agent import BookingAgent
+from fastapi import APIRouter, Cookie, Depends, Header, HTTPException, Query
+from starlette.responses import RedirectResponse, Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from brain.agent import get_compiled_booking_agent
+from brain.intent_router import intent_router
+from brain.tools.config import TOOL_PROGRESS_MESSAGES
 from server.db.database import get_db
-from server.db import User
+from server.services.calendar_mirror import calendar_mirror
 from server.services.google_calendar import GoogleCalendarService
+from server.services.google_client import run_blocking
 from server.services.google_oauth import google_oauth_service
-from langchain_core.messages import HumanMessage
+from server.services.google_scheduler import QuotaExceededError
+from server.services.user_cache import CachedUser, load_user_by_email, load_user_by_id
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
 import os
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-def get_current_user(
+async def get_current_user(
     booking_session: str = Cookie(None),
-    db: Session = Depends(get_db)
-):
+    db: AsyncSession = Depends(get_db)
+) -> CachedUser:
     if not booking_session:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    user = db.query(User).filter(User.id == booking_session).first()
+    # Cached sessions don't touch the database
+    user = await load_user_by_id(db, booking_session)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session")
 
     return user
+
+def quota_exceeded(error: QuotaExceededError) -> HTTPException:
+    """Google quota is used up for now: tell the client when to come back instead of a 500."""
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(math.ceil(error.retry_after))})
+
 # Generate a session ID for tracking
 @router.get("/connect-calendar")
 def connect_google_calendar():
@@ -38,16 +54,19 @@ def connect_google_calendar():
     return RedirectResponse(url=authorization_url)
 
 @router.get("/oauth/google/callback")
-def oauth_callback(code: str, state: str, db: Session = Depends(get_db)):
+async def oauth_callback(code: str, state: str, db: AsyncSession = Depends(get_db)):
     session_id = state
     
-    tokens = google_oauth_service.exchange_code_for_tokens(code)
+    # The Google token and userinfo calls are blocking HTTP, keep them off the event loop
+    tokens = await run_blocking(google_oauth_service.exchange_code_for_tokens, code)
     
     # Fetch email from Google's userinfo endpoint
-    google_email, google_name = google_oauth_service.get_user_info(tokens["token"])  # Returns a dict
+    google_email, google_name = await google_oauth_service.aget_user_info(tokens["token"])
     
     # Create/update user with their actual Google email
-    user = google_oauth_service.save_tokens(db, session_id, google_email, tokens)
+    user = await google_oauth_service.asave_tokens(db, session_id, google_email, tokens)
+    # Seed the local calendar mirror while the user lands on the page
+    calendar_mirror.schedule_sync(user.id)
     
     response = RedirectResponse(url="/")
     secure_var = os.environ.get("ENV") != "local"
@@ -62,9 +81,20 @@ def oauth_callback(code: str, state: str, db: Session = Depends(get_db)):
 
     return response
 
+@router.post("/calendar/notifications")
+async def calendar_notification(
+    x_goog_channel_id: str = Header(...),
+    x_goog_resource_state: str = Header(...),
+    x_goog_channel_token: str | None = Header(None),
+):
+    """Google Calendar push notifications (events.watch); the sync runs in the background."""
+    if not await calendar_mirror.ahandle_notification(x_goog_channel_id, x_goog_channel_token, x_goog_resource_state):
+        raise HTTPException(status_code=404, detail="Unknown channel")
+    return Response(status_code=204)
+
 @router.post("/slots/{email}")
-def get_slots(email: str, time_slots: dict, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def get_slots(email: str, time_slots: dict, db: AsyncSession = Depends(get_db)):
+    user = await load_user_by_email(db, email)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -73,22 +103,24 @@ def get_slots(email: str, time_slots: dict, db: Session = Depends(get_db)):
     
     try:
         # 1. Get/Refresh the Credentials object
-        creds = google_oauth_service.refresh_and_get_credentials(db, user)
+        creds = await google_oauth_service.arefresh_and_get_credentials(db, user)
         
         # 2. Use the valid credentials to build the service
-        google_calendar_service = GoogleCalendarService(creds)
-        slots = google_calendar_service.get_slots(time_slots["min"],time_slots["max"])
+        google_calendar_service = GoogleCalendarService(creds, user_id=user.id)
+        slots = await google_calendar_service.aget_slots(time_slots["min"],time_slots["max"],time_slots.get("calendars"))
         
         return {"slots": slots}
         
+    except QuotaExceededError as e:
+        raise quota_exceeded(e)
     except Exception as e:
         # Catch any errors during the refresh or API call
-        print(f"Error accessing calendar for {email}: {e}")
+        logger.exception("Error accessing calendar for %s", email)
         raise HTTPException(status_code=500, detail=f"Failed to fetch slots: {e}")
 
 @router.post("/book-slot/{email}")
-def book_slot(email: str, slot: dict, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def book_slot(email: str, slot: dict, db: AsyncSession = Depends(get_db)):
+    user = await load_user_by_email(db, email)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -96,58 +128,302 @@ def book_slot(email: str, slot: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=403, detail="User has not authorized calendar access.")
     
     try:
-        creds = google_oauth_service.refresh_and_get_credentials(db, user)
-        google_calendar_service = GoogleCalendarService(creds)
-        response = google_calendar_service.book_slot(slot)
+        creds = await google_oauth_service.arefresh_and_get_credentials(db, user)
+        google_calendar_service = GoogleCalendarService(creds, user_id=user.id)
+        response = await google_calendar_service.abook_slot(slot)
         return {"message": "Slot booked successfully", "response": response}
+    except QuotaExceededError as e:
+        raise quota_exceeded(e)
     except Exception as e:
-        print(f"Error booking slot for {email}: {e}")
+        logger.exception("Error booking slot for %s", email)
         raise HTTPException(status_code=500, detail=f"Failed to book slot: {e}")
 
-@router.post("/talk")
-def converse(user_input: dict,user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.post("/book-slots/{email}")
+async def book_slots(email: str, slots: list[dict], db: AsyncSession = Depends(get_db)):
+    user = await load_user_by_email(db, email)
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     if not user.google_refresh_token:
         raise HTTPException(status_code=403, detail="User has not authorized calendar access.")
-    
-    try:
-        creds = google_oauth_service.refresh_and_get_credentials(db, user)
-        google_calendar_service = GoogleCalendarService(creds)
-        booking_agent = BookingAgent(google_calendar_service).get_booking_agent()
 
-        conversation_id = user_input.get("conversation_id",None)
-        timezone = user_input["timezone"]
-        user_time = user_input["client_time"]
-        query = user_input["query"]
-        if conversation_id=="" or not conversation_id:
-            conversation_id = str(uuid.uuid4())
-        
-        config = {"configurable": {"thread_id": conversation_id}}
+    try:
+        creds = await google_oauth_service.arefresh_and_get_credentials(db, user)
+        google_calendar_service = GoogleCalendarService(creds, user_id=user.id)
+        results = await google_calendar_service.abook_slots(slots)
+    except QuotaExceededError as e:
+        raise quota_exceeded(e)
+    except Exception as e:
+        logger.exception("Error booking slots for %s", email)
+        raise HTTPException(status_code=500, detail=f"Failed to book slots: {e}")
+    booked = sum(result["status"] == "booked" for result in results)
+    return {"message": f"Booked {booked} of {len(results)} slots", "results": results}
 
-        initial_state = {
-            "messages": [HumanMessage(content=query)],
-            "conversation_id": conversation_id,
-            "timezone": timezone,
-            "client_time": user_time
+def build_talk_run(user_input: dict, google_calendar_service: GoogleCalendarService | None):
+    """
+    Builds the (conversation_id, initial_state, run config) for one /talk turn.
+    The run config carries the thread id and the user's calendar service
+    (None for turns the intent router answers, they never reach a tool).
+    The user's message gets its id here so the turn's messages can be told apart
+    from the thread's history.
+    """
+    conversation_id = user_input.get("conversation_id",None)
+    timezone = user_input["timezone"]
+    user_time = user_input["client_time"]
+    query = user_input["query"]
+    if conversation_id=="" or not conversation_id:
+        conversation_id = str(uuid.uuid4())
+    
+    config = {
+        "configurable": {
+            "thread_id": conversation_id,
+            "google_calendar_service": google_calendar_service,
         }
-        if booking_agent.checkpointer:
-            # Checkpointer will merge with existing state automatically
-            result = booking_agent.invoke(initial_state, config=config)
-        else:
-            # Without checkpointer, just invoke normally
-            result = booking_agent.invoke(initial_state)
+    }
+
+    initial_state = {
+        "messages": [HumanMessage(content=query, id=str(uuid.uuid4()))],
+        "conversation_id": conversation_id,
+        "timezone": timezone,
+        "client_time": user_time,
+    }
+    return conversation_id, initial_state, config
+
+async def load_thread(booking_agent, config: dict, user: CachedUser) -> dict:
+    """
+    The saved state of the run's thread, {} for a new one. Only the owner may
+    continue a thread; threads from before owners were recorded belong to no one.
+    """
+    if booking_agent.checkpointer is None:
+        return {}
+    snapshot = await booking_agent.aget_state(config)
+    values = snapshot.values or {}
+    if values and values.get("user_id") != user.id:
+        raise HTTPException(status_code=403, detail="Conversation belongs to another user")
+    return values
+
+async def prepare_talk_run(booking_agent, user_input: dict, user: CachedUser, db: AsyncSession):
+    """
+    build_talk_run plus the ownership check and the user's calendar service.
+    A new thread records the caller as its owner, later turns never change it.
+    Turns the intent router will answer don't need Google credentials, so they
+    skip the refresh; the thread's last message tells whether this one may be
+    a reply to a question (see IntentRouter.awaiting_reply).
+    Returns (fast_path, conversation_id, initial_state, config).
+    """
+    conversation_id, initial_state, config = build_talk_run(user_input, None)
+    # Ids the server just generated have no thread yet
+    thread = await load_thread(booking_agent, config, user) if user_input.get("conversation_id") else {}
+    if not thread:
+        initial_state["user_id"] = user.id
+    messages = thread.get("messages", [])
+    decision = intent_router.classify(user_input["query"], messages[-1] if messages else None)
+    # The graph's route node follows this decision rather than classifying again
+    initial_state["intent"] = decision.intent
+    if not decision.fast_path:
+        creds = await google_oauth_service.arefresh_and_get_credentials(db, user)
+        config["configurable"]["google_calendar_service"] = GoogleCalendarService(creds, user_id=user.id)
+    return decision.fast_path, conversation_id, initial_state, config
+
+def serialize_message(message: AnyMessage, include_tools: bool = False) -> dict | None:
+    """
+    Compact wire form of a message: {id, role, content}.
+    Tool results and the model's tool calls are left out unless include_tools,
+    as are model steps that only called tools (None is returned for those).
+    """
+    if isinstance(message, HumanMessage):
+        return {"id": message.id, "role": "user", "content": chunk_text(message.content)}
+    if isinstance(message, ToolMessage):
+        if not include_tools:
+            return None
+        return {"id": message.id, "role": "tool", "name": message.name, "content": chunk_text(message.content)}
+    if isinstance(message, AIMessage):
+        content = chunk_text(message.content)
+        serialized = {"id": message.id, "role": "assistant", "content": content}
+        if include_tools and message.tool_calls:
+            serialized["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in message.tool_calls]
+        elif not content:
+            return None
+        return serialized
+    return None
+
+def serialize_messages(messages: list[AnyMessage], include_tools: bool = False) -> list[dict]:
+    return [
+        serialized for serialized in (serialize_message(m, include_tools) for m in messages)
+        if serialized is not None
+    ]
+
+def turn_messages(messages: list[AnyMessage], first_id: str) -> list[AnyMessage]:
+    """The messages of the turn opened by the user message `first_id`."""
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].id == first_id:
+            return messages[index:]
+    return []
+
+@router.post("/talk")
+async def converse(user_input: dict,user: CachedUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if not user.google_refresh_token:
+        raise HTTPException(status_code=403, detail="User has not authorized calendar access.")
+    
+    try:
+        started = time.perf_counter()
+        booking_agent = get_compiled_booking_agent()
+        fast_path, conversation_id, initial_state, config = await prepare_talk_run(booking_agent, user_input, user, db)
+        # With a checkpointer the thread's existing state is merged automatically
+        result = await booking_agent.ainvoke(initial_state, config=config)
+        intent_router.record_turn(fast_path, time.perf_counter() - started)
         
+        # Only this turn's messages; earlier ones are paged from GET /conversations/{id}/messages
+        turn_start = initial_state["messages"][0].id
         return {
             "conversation_id": conversation_id,
-            "messages": result.get("messages", []),
-            "timezone": result.get("timezone", timezone)
+            "messages": serialize_messages(
+                turn_messages(result.get("messages", []), turn_start),
+                include_tools=bool(user_input.get("include_tools")),
+            ),
+            # History before this turn is fetched with ?before=<cursor>
+            "cursor": turn_start,
+            "timezone": result.get("timezone", initial_state["timezone"])
         }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error in conversation %s", user.id)
+        raise HTTPException(status_code=500, detail=f"Failed to talk: {e}")
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def chunk_text(content) -> str:
+    """Chat chunks are a string or, for some providers, a list of content blocks."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block.get("text", "") for block in content
+        if isinstance(block, dict) and block.get("type") == "text"
+    )
+
+async def stream_talk_events(booking_agent, initial_state: dict, config: dict, conversation_id: str, fast_path: bool = False, started: float | None = None):
+    """
+    Translates LangGraph's astream_events into SSE frames:
+      conversation -> token* -> (tool_start, tool_end)* -> ... -> message -> done
+    The final `message` frame carries the reply of the model that actually served the step.
+    A turn answered by the intent router has no tokens, only its `message`.
+    A failure after the stream has started is reported as an `error` frame.
+    """
+    started = started or time.perf_counter()
+    yield format_sse("conversation", {"conversation_id": conversation_id})
+    try:
+        final_state = None
+        # A hedged llm_call step runs two models; stream only the first one that produces text
+        streaming_run_by_step = {}
+        async for event in booking_agent.astream_events(initial_state, config=config, version="v2"):
+            kind = event["event"]
+            if kind in ("on_chat_model_start", "on_chat_model_stream") \
+                    and event["metadata"].get("langgraph_node") != "llm_call":
+                # e.g. the context summarizer; only the agent's replies reach the user
+                continue
+            if kind == "on_chat_model_start":
+                step = event["metadata"].get("langgraph_step")
+                if step not in streaming_run_by_step:
+                    streaming_run_by_step[step] = None
+                    yield format_sse("llm_start", {})
+            elif kind == "on_chat_model_stream":
+                step = event["metadata"].get("langgraph_step")
+                if streaming_run_by_step.get(step) is None:
+                    streaming_run_by_step[step] = event["run_id"]
+                elif streaming_run_by_step[step] != event["run_id"]:
+                    continue
+                text = chunk_text(event["data"]["chunk"].content)
+                if text:
+                    yield format_sse("token", {"text": text})
+            elif kind == "on_tool_start":
+                name = event["name"]
+                yield format_sse("tool_start", {
+                    "name": name,
+                    "message": TOOL_PROGRESS_MESSAGES.get(name, "Working on it…")
+                })
+            elif kind == "on_tool_end":
+                yield format_sse("tool_end", {"name": event["name"]})
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                # The root graph run finished, its output is the final state
+                final_state = event["data"]["output"]
+
+        messages = (final_state or {}).get("messages", [])
+        content = chunk_text(messages[-1].content) if messages else ""
+        yield format_sse("message", {"conversation_id": conversation_id, "content": content})
+        yield format_sse("done", {})
+        intent_router.record_turn(fast_path, time.perf_counter() - started)
+    except Exception as e:
+        logger.exception("Error in streamed conversation %s", conversation_id)
+        yield format_sse("error", {"detail": f"Failed to talk: {e}"})
+
+@router.post("/talk/stream")
+async def converse_stream(user_input: dict, user: CachedUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if not user.google_refresh_token:
+        raise HTTPException(status_code=403, detail="User has not authorized calendar access.")
+
+    started = time.perf_counter()
+    booking_agent = get_compiled_booking_agent()
+    try:
+        fast_path, conversation_id, initial_state, config = await prepare_talk_run(booking_agent, user_input, user, db)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in conversation {user.id}: {e}")
+        logger.exception("Error in conversation %s", user.id)
         raise HTTPException(status_code=500, detail=f"Failed to talk: {e}")
 
+    return StreamingResponse(
+        stream_talk_events(booking_agent, initial_state, config, conversation_id, fast_path, started),
+        media_type="text/event-stream",
+        # Disable proxy buffering so frames reach the browser as they are produced
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/conversations/{conversation_id}/messages")
+async def conversation_messages(
+    conversation_id: str,
+    before: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    include_tools: bool = False,
+    user: CachedUser = Depends(get_current_user),
+):
+    """
+    One page of a conversation's history, oldest first: the `limit` messages
+    before the message id `before` (the latest ones without it).
+    `next_cursor` pages further back and is None on the first page.
+    Turns the context manager folded into the summary are no longer in the thread,
+    `summarized` tells the client there was more before them.
+    """
+    booking_agent = get_compiled_booking_agent()
+    if booking_agent.checkpointer is None:
+        # Without a checkpointer threads aren't kept between turns
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    snapshot = await booking_agent.aget_state({"configurable": {"thread_id": conversation_id}})
+    values = snapshot.values or {}
+    # Threads from before owners were recorded aren't served to anyone
+    if values.get("user_id") != user.id:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    messages = values.get("messages", [])
+    if before:
+        end = next((i for i, message in enumerate(messages) if message.id == before), None)
+        if end is None:
+            raise HTTPException(status_code=404, detail="Unknown cursor")
+        messages = messages[:end]
+    visible = serialize_messages(messages, include_tools)
+    page = visible[-limit:]
+    return {
+        "conversation_id": conversation_id,
+        "messages": page,
+        "next_cursor": page[0]["id"] if len(visible) > limit else None,
+        "summarized": bool(values.get("summary")),
+        "timezone": values.get("timezone"),
+    }
+
 @router.post("v1/talk/{email}")
-def conversev1(email: str, user_input: dict, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def conversev1(email: str, user_input: dict, db: AsyncSession = Depends(get_db)):
+    user = await load_user_by_email(db, email)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -155,9 +431,9 @@ def conversev1(email: str, user_input: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=403, detail="User has not authorized calendar access.")
     
     try:
-        creds = google_oauth_service.refresh_and_get_credentials(db, user)
-        google_calendar_service = GoogleCalendarService(creds)
-        booking_agent = BookingAgent(google_calendar_service).get_booking_agent()
+        creds = await google_oauth_service.arefresh_and_get_credentials(db, user)
+        google_calendar_service = GoogleCalendarService(creds, user_id=user.id)
+        booking_agent = get_compiled_booking_agent()
 
         conversation_id = user_input.get("conversation_id",None)
         timezone = user_input["timezone"]
@@ -165,20 +441,20 @@ def conversev1(email: str, user_input: dict, db: Session = Depends(get_db)):
         if not conversation_id:
             conversation_id = str(uuid.uuid4())
         
-        config = {"configurable": {"thread_id": conversation_id}}
+        config = {
+            "configurable": {
+                "thread_id": conversation_id,
+                "google_calendar_service": google_calendar_service,
+            }
+        }
 
         initial_state = {
             "messages": [HumanMessage(content=query)],
             "conversation_id": conversation_id,
             "timezone": timezone
         }
-        if booking_agent.checkpointer:
-            print(f"Merge checkpoint")
-            # Checkpointer will merge with existing state automatically
-            result = booking_agent.invoke(initial_state, config=config)
-        else:
-            # Without checkpointer, just invoke normally
-            result = booking_agent.invoke(initial_state)
+        # With a checkpointer the thread's existing state is merged automatically
+        result = await booking_agent.ainvoke(initial_state, config=config)
         
         return {
             "conversation_id": conversation_id,
@@ -186,12 +462,12 @@ def conversev1(email: str, user_input: dict, db: Session = Depends(get_db)):
             "timezone": result.get("timezone", timezone)
         }
     except Exception as e:
-        print(f"Error in conversation {email}: {e}")
+        logger.exception("Error in conversation %s", email)
         raise HTTPException(status_code=500, detail=f"Failed to talk: {e}")
 
 
 @router.get("/me")
-def me(user: User = Depends(get_current_user)):
+def me(user: CachedUser = Depends(get_current_user)):
     return {
         "email": user.email,
     }
@@ -0,0 +1,139 @@
+'''
+Prometheus metrics, exported on GET /metrics (server/api.py).
+
+- Graph: time per node, LLM tokens per step, tool latency and errors,
+  LLM calls per user message, messages answered by the intent router.
+- LLM routing: hedged and failed requests per provider, circuit breaker state.
+- Dependencies: Google API calls (latency, quota waits, retries, rejections)
+  and users database queries.
+- Service stats: counters the caches and the checkpointer pool already keep,
+  read at scrape time by StatsCollector.
+
+Metrics are per process: with several uvicorn workers, scrape each one.
+'''
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Seconds; LLM steps and Google calls sit between 50 ms and several seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 25)
+
+NODE_DURATION = Histogram(
+    "booking_graph_node_duration_seconds", "Time spent in a graph node",
+    ["node", "status"], buckets=LATENCY_BUCKETS,
+)
+LLM_DURATION = Histogram(
+    "booking_llm_duration_seconds", "Time for one LLM step, by the provider that served it",
+    ["provider"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Histogram(
+    "booking_llm_tokens", "Tokens per LLM step; direction is input, output, or cache_read/cache_creation for prompt caching",
+    ["provider", "direction"], buckets=TOKEN_BUCKETS,
+)
+TOOL_DURATION = Histogram(
+    "booking_tool_duration_seconds", "Time for one tool call, timeouts included",
+    ["tool", "status"], buckets=LATENCY_BUCKETS,
+)
+TOOL_ERRORS = Counter(
+    "booking_tool_errors_total", "Tool calls that failed or timed out",
+    ["tool", "reason"],
+)
+AGENT_ITERATIONS = Histogram(
+    "booking_agent_loop_iterations", "LLM calls needed to answer one user message",
+    buckets=ITERATION_BUCKETS,
+)
+LLM_HEDGES = Counter(
+    "booking_llm_hedges_total", "LLM steps also sent to this provider because the primary was slow",
+    ["provider"],
+)
+LLM_FAILURES = Counter(
+    "booking_llm_failures_total", "LLM requests that failed with a rate limit, server or transport error",
+    ["provider"],
+)
+LLM_CIRCUIT_STATE = Gauge(
+    "booking_llm_circuit_state", "LLM provider circuit breaker: 0 closed, 1 half-open, 2 open",
+    ["provider"],
+)
+INTENT_ROUTES = Counter(
+    "booking_intent_routes_total", "User messages by intent; \"agent\" went through the LLM loop",
+    ["intent", "source"],
+)
+GOOGLE_API_DURATION = Histogram(
+    "booking_google_api_duration_seconds", "Time for one Google API call",
+    ["method", "status"], buckets=LATENCY_BUCKETS,
+)
+GOOGLE_API_QUEUE_WAIT = Histogram(
+    "booking_google_api_queue_wait_seconds", "Time a Google API call waited for quota",
+    ["method"], buckets=LATENCY_BUCKETS,
+)
+GOOGLE_API_RETRIES = Counter(
+    "booking_google_api_retries_total", "Google API calls retried after a rate limit, server or transport error",
+    ["method", "reason"],
+)
+GOOGLE_API_REJECTIONS = Counter(
+    "booking_google_api_rejections_total", "Google API calls refused because the quota wait was too long",
+    ["method", "bucket"],
+)
+DB_QUERY_DURATION = Histogram(
+    "booking_db_query_duration_seconds", "Time for one users database statement",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str):
+    """Observes the block's duration, with a trailing status label of "ok" or "error"."""
+    status = "ok"
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        histogram.labels(*labels, status).observe(time.perf_counter() - started)
+
+
+def timed_node(name: str, node: Callable):
+    """Wraps an async graph node so its duration lands in NODE_DURATION."""
+    async def run(*args, **kwargs):
+        with timed(NODE_DURATION, name):
+            return await node(*args, **kwargs)
+    # LangGraph reads the node's signature to decide whether to pass the config
+    run.__wrapped__ = node
+    run.__name__ = getattr(node, "__name__", name)
+    return run
+
+
+class StatsCollector:
+    """
+    Exposes the numeric values of stats() dicts as gauges, e.g.
+    user_cache.stats()["hits"] becomes booking_user_cache_hits.
+    """
+    def __init__(self, sources: dict[str, Callable[[], dict]]):
+        self.sources = sources
+
+    def collect(self):
+        for source, stats in self.sources.items():
+            try:
+                values = stats()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"booking_{source}_{key}", f"{source} {key.replace('_', ' ')}", value=value)
+
+
+def register_stats(sources: dict[str, Callable[[], dict]]) -> StatsCollector:
+    collector = StatsCollector(sources)
+    REGISTRY.register(collector)
+    return collector
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
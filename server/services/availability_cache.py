@@ -0,0 +1,160 @@
+import threading
+import time
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from server.config import settings
+
+
+def parse_rfc3339(value: str) -> datetime:
+    """Parse an RFC 3339 timestamp; naive values are treated as UTC."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def format_rfc3339(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def merge_intervals(intervals: list[tuple[datetime, datetime]]) -> list[tuple[datetime, datetime]]:
+    """Sort and merge overlapping or touching intervals."""
+    merged: list[tuple[datetime, datetime]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class CoveredRange:
+    """A time range fetched from freebusy, with the busy intervals inside it."""
+    __slots__ = ("start", "end", "fetched_at", "busy")
+
+    def __init__(self, start: datetime, end: datetime, busy: list[tuple[datetime, datetime]], fetched_at: float):
+        self.start = start
+        self.end = end
+        # Only what lies inside the fetched range is known to be complete
+        self.busy = merge_intervals([(max(s, start), min(e, end)) for s, e in busy if e > start and s < end])
+        self.fetched_at = fetched_at
+
+    def __lt__(self, other: "CoveredRange"):
+        return (self.start, self.end) < (other.start, other.end)
+
+
+class BusyIntervalCache:
+    """
+    Per-user cache of freebusy results keyed by the ranges already fetched.
+
+    Each user has a list of CoveredRange sorted by start. A lookup returns the
+    busy intervals for the covered parts of the query plus the uncovered gaps,
+    so the caller only asks Google for what is missing. Ranges expire after
+    `ttl_seconds` and are dropped as soon as a booking touches them.
+    """
+    def __init__(
+        self,
+        ttl_seconds: float = settings.AVAILABILITY_CACHE_TTL_SECONDS,
+        max_users: int = settings.AVAILABILITY_CACHE_MAX_USERS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._ranges: OrderedDict[str, list[CoveredRange]] = OrderedDict()
+        # Last invalidation per user, so a fetch that raced a booking isn't cached
+        self._invalidated_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0          # query answered entirely from cache
+        self.partial_hits = 0  # some of the query was covered, gaps fetched
+        self.misses = 0        # nothing usable in cache
+        self.invalidations = 0
+
+    def lookup(self, user_key: str, start: datetime, end: datetime):
+        """
+        Returns (busy, gaps): busy intervals clipped to [start, end) from cached
+        ranges, and the sub-ranges of [start, end) that still need fetching.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranges = self._ranges.get(user_key)
+            if ranges is not None:
+                ranges[:] = [r for r in ranges if now - r.fetched_at < self.ttl_seconds]
+                self._ranges.move_to_end(user_key)
+
+            busy: list[tuple[datetime, datetime]] = []
+            gaps: list[tuple[datetime, datetime]] = []
+            cursor = start
+            for covered in ranges or []:
+                if covered.start >= end:
+                    break
+                if covered.end <= cursor:
+                    continue
+                if covered.start > cursor:
+                    gaps.append((cursor, covered.start))
+                for busy_start, busy_end in covered.busy:
+                    if busy_end > start and busy_start < end:
+                        busy.append((max(busy_start, start), min(busy_end, end)))
+                cursor = max(cursor, covered.end)
+            if cursor < end:
+                gaps.append((cursor, end))
+
+            if not gaps:
+                self.hits += 1
+            elif gaps == [(start, end)]:
+                self.misses += 1
+            else:
+                self.partial_hits += 1
+        return busy, gaps
+
+    def store(self, user_key: str, start: datetime, end: datetime, busy: list[tuple[datetime, datetime]], requested_at: float):
+        """
+        Cache a freebusy result. `requested_at` is the time.monotonic() taken
+        before the request was sent; results older than the user's last
+        invalidation are discarded.
+        """
+        covered = CoveredRange(start, end, busy, requested_at)
+        with self._lock:
+            if self._invalidated_at.get(user_key, float("-inf")) >= requested_at:
+                return
+            ranges = self._ranges.setdefault(user_key, [])
+            # A range fully inside the new one carries no extra information
+            ranges[:] = [r for r in ranges if not (r.start >= start and r.end <= end)]
+            insort(ranges, covered)
+            self._ranges.move_to_end(user_key)
+            while len(self._ranges) > self.max_users:
+                self._ranges.popitem(last=False)
+
+    def invalidate(self, user_key: str, start: datetime | None = None, end: datetime | None = None):
+        """Drop the user's cached ranges overlapping [start, end), or all of them."""
+        now = time.monotonic()
+        with self._lock:
+            self._invalidated_at[user_key] = now
+            # Entries older than the TTL can no longer reject anything useful
+            for key in [k for k, t in self._invalidated_at.items() if now - t > self.ttl_seconds]:
+                del self._invalidated_at[key]
+            ranges = self._ranges.get(user_key)
+            if not ranges:
+                return
+            self.invalidations += 1
+            if start is None or end is None:
+                del self._ranges[user_key]
+                return
+            ranges[:] = [r for r in ranges if r.end <= start or r.start >= end]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.partial_hits + self.misses
+            return {
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "users": len(self._ranges),
+                "ranges": sum(len(r) for r in self._ranges.values()),
+            }
+
+
+availability_cache = BusyIntervalCache()
@@ -0,0 +1,468 @@
+'''
+Local mirror of each connected user's primary calendar.
+
+A full sync lists the events of [now - CALENDAR_MIRROR_DAYS_BEHIND,
+now + CALENDAR_MIRROR_DAYS_AHEAD) into calendar_events and keeps the
+nextSyncToken; later syncs send only that token and get back what changed.
+Syncs are triggered by push notifications (events.watch channels posting to
+POST /calendar/notifications when CALENDAR_WEBHOOK_URL is set), by a
+background poll of recently active users, and on demand when a lookup finds
+the mirror stale.
+
+GoogleCalendarService.aget_slots answers from the mirror with one indexed
+query while it is fresh, and falls back to freebusy otherwise.
+
+usage: python -m server.services.calendar_mirror sync <user_id>
+       python -m server.services.calendar_mirror notify <user_id> [--url http://localhost:8000]
+
+`notify` is the local stand-in for Google's push: it posts the headers Google
+would send for the user's channel (creating a local one if needed) to the
+webhook, which then runs an incremental sync.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import time
+import urllib.request
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.db.database import AsyncSessionLocal
+from server.db.models import CalendarEvent, CalendarMirror, utcnow
+from server.services.availability_cache import format_rfc3339, parse_rfc3339
+from server.services.google_client import google_client_factory
+from server.services.google_oauth import google_oauth_service
+from server.services.google_scheduler import google_api_scheduler
+from server.services.user_cache import load_user_by_id
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_ID = "primary"
+# events.list page size; 2500 is the API's maximum
+EVENTS_PAGE_SIZE = 2500
+# Watch channels are replaced when they expire within this
+CHANNEL_RENEW_MARGIN = timedelta(days=1)
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    # calendar_events stores naive UTC, like the users table
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def event_time(value: dict, time_zone: str | None) -> datetime:
+    """An event's start or end; all-day dates begin at midnight in the calendar's zone."""
+    if "dateTime" in value:
+        return to_utc_naive(parse_rfc3339(value["dateTime"]))
+    tz = ZoneInfo(value.get("timeZone") or time_zone or "UTC")
+    return to_utc_naive(datetime.combine(date.fromisoformat(value["date"]), dt_time(0), tz))
+
+
+def is_busy(event: dict) -> bool:
+    """Same rule as freebusy: transparent events and declined invitations leave the time free."""
+    if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+        return False
+    return not any(a.get("self") and a.get("responseStatus") == "declined" for a in event.get("attendees", []))
+
+
+def event_row(user_id: str, event: dict, time_zone: str | None) -> CalendarEvent:
+    return CalendarEvent(
+        user_id=user_id,
+        calendar_id=CALENDAR_ID,
+        event_id=event["id"],
+        start=event_time(event["start"], time_zone),
+        end=event_time(event["end"], time_zone),
+        busy=is_busy(event),
+    )
+
+
+def channel_is_live(mirror: CalendarMirror) -> bool:
+    return mirror.channel_expires_at is not None and mirror.channel_expires_at > utcnow()
+
+
+class CalendarMirrorService:
+    """
+    Syncs and queries the mirror. Syncs for one user never overlap: a sync
+    requested while one is running queues a single follow-up run, so a burst
+    of notifications costs at most two events.list calls.
+    """
+    def __init__(
+        self,
+        max_staleness_seconds: float = settings.CALENDAR_MIRROR_MAX_STALENESS_SECONDS,
+        polled_staleness_seconds: float = settings.CALENDAR_MIRROR_POLLED_STALENESS_SECONDS,
+        retry_after_seconds: float = settings.CALENDAR_MIRROR_SYNC_INTERVAL_SECONDS,
+        active_seconds: float = settings.CALENDAR_MIRROR_ACTIVE_SECONDS,
+    ):
+        # Notifications keep a watched calendar current, the bound only covers lost ones.
+        # Without a channel nothing tells us about outside changes, so a polled mirror is
+        # only trusted shortly after a sync; past that lookups use freebusy and resync it.
+        self.max_staleness = timedelta(seconds=max_staleness_seconds)
+        self.polled_staleness = min(timedelta(seconds=polled_staleness_seconds), self.max_staleness)
+        self.retry_after_seconds = retry_after_seconds
+        self.active_seconds = active_seconds
+        self._tasks: dict[str, asyncio.Task] = {}
+        # user_id -> monotonic time of the last availability lookup, for the poll
+        self._active: dict[str, float] = {}
+        self._rerun: set[str] = set()
+        self._failed_at: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.syncs = 0
+        self.full_syncs = 0
+        self.failures = 0
+        self.notifications = 0
+
+    def is_fresh(self, mirror: CalendarMirror) -> bool:
+        if mirror.synced_at is None:
+            return False
+        staleness = self.max_staleness if channel_is_live(mirror) else self.polled_staleness
+        return utcnow() - mirror.synced_at <= staleness
+
+    async def abusy(self, user_id: str, start: datetime, end: datetime) -> list[tuple[datetime, datetime]] | None:
+        """
+        Busy intervals in [start, end) from the mirror, clipped to the range, or
+        None when it can't answer (not seeded, stale, or the range is outside
+        the mirrored window). A missing or stale mirror gets a background sync.
+        """
+        if not settings.CALENDAR_MIRROR_ENABLED:
+            return None
+        self._active[user_id] = time.monotonic()
+        start, end = to_utc_naive(start), to_utc_naive(end)
+        async with AsyncSessionLocal() as db:
+            mirror = await db.get(CalendarMirror, (user_id, CALENDAR_ID))
+            if mirror is None or not self.is_fresh(mirror):
+                self.misses += 1
+                self.schedule_sync(user_id)
+                return None
+            if start < mirror.window_start or end > mirror.window_end:
+                self.misses += 1
+                return None
+            rows = (await db.execute(
+                select(CalendarEvent.start, CalendarEvent.end).where(
+                    CalendarEvent.user_id == user_id,
+                    CalendarEvent.calendar_id == CALENDAR_ID,
+                    CalendarEvent.start < end,
+                    CalendarEvent.end > start,
+                    CalendarEvent.busy,
+                )
+            )).all()
+        self.hits += 1
+        return [
+            (max(s, start).replace(tzinfo=timezone.utc), min(e, end).replace(tzinfo=timezone.utc))
+            for s, e in rows
+        ]
+
+    async def arecord_events(self, user_id: str, events: list[dict]):
+        """
+        Writes events the app just created into an existing mirror, so the next
+        lookup sees them without waiting for a sync. Never raises: the booking
+        itself already succeeded.
+        """
+        if not settings.CALENDAR_MIRROR_ENABLED or not events:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                mirror = await db.get(CalendarMirror, (user_id, CALENDAR_ID))
+                if mirror is not None:
+                    await self.apply_events(db, user_id, events, mirror.time_zone)
+                    await db.commit()
+        except Exception as e:
+            logger.warning("Could not record new events in the calendar mirror of %s: %s", user_id, e)
+
+    def schedule_sync(self, user_id: str) -> asyncio.Task | None:
+        """Syncs the user's mirror in the background; returns the task, or None while a failed sync cools down."""
+        if not settings.CALENDAR_MIRROR_ENABLED:
+            return None
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            self._rerun.add(user_id)
+            return task
+        failed_at = self._failed_at.get(user_id)
+        if failed_at is not None and time.monotonic() - failed_at < self.retry_after_seconds:
+            return None
+        task = self._tasks[user_id] = asyncio.create_task(self._sync_in_background(user_id))
+        return task
+
+    async def _sync_in_background(self, user_id: str):
+        try:
+            while True:
+                self._rerun.discard(user_id)
+                try:
+                    await self.sync(user_id)
+                    self._failed_at.pop(user_id, None)
+                except Exception as e:
+                    self.failures += 1
+                    self._failed_at[user_id] = time.monotonic()
+                    logger.warning("Calendar mirror sync failed for %s: %s", user_id, e)
+                    return
+                if user_id not in self._rerun:
+                    return
+        finally:
+            self._tasks.pop(user_id, None)
+
+    async def sync(self, user_id: str) -> dict:
+        """Brings the mirror up to date: incremental with the stored syncToken, full otherwise."""
+        async with AsyncSessionLocal() as db:
+            user = await load_user_by_id(db, user_id)
+            if user is None or not user.google_refresh_token:
+                raise LookupError(f"user {user_id} has no calendar access")
+            creds = await google_oauth_service.arefresh_and_get_credentials(db, user)
+            client = google_client_factory.calendar(creds)
+            mirror = await db.get(CalendarMirror, (user_id, CALENDAR_ID))
+            # Hand the connection back to the pool while Google answers
+            await db.commit()
+
+            report = None
+            if mirror is not None and mirror.sync_token and not self.window_needs_moving(mirror):
+                try:
+                    report = await self.incremental_sync(db, client, mirror)
+                except HttpError as e:
+                    # 410 Gone: the token expired or was invalidated, start over
+                    if e.status_code != 410:
+                        raise
+                    logger.info("Sync token of %s expired, running a full calendar sync", user_id)
+            if report is None:
+                mirror, report = await self.full_sync(db, client, user_id, mirror)
+            await db.commit()
+
+            if settings.CALENDAR_WEBHOOK_URL:
+                await self.ensure_channel(db, client, mirror)
+                await db.commit()
+        self.syncs += 1
+        logger.debug("Calendar mirror of %s synced: %s", user_id, report)
+        return report
+
+    def window_needs_moving(self, mirror: CalendarMirror) -> bool:
+        """The window is fixed at the full sync; it is re-seeded once half the look-ahead has passed."""
+        return mirror.window_end - utcnow() < timedelta(days=settings.CALENDAR_MIRROR_DAYS_AHEAD / 2)
+
+    async def full_sync(self, db: AsyncSession, client, user_id: str, mirror: CalendarMirror | None) -> tuple[CalendarMirror, dict]:
+        now = datetime.now(timezone.utc)
+        window_start = now - timedelta(days=settings.CALENDAR_MIRROR_DAYS_BEHIND)
+        window_end = now + timedelta(days=settings.CALENDAR_MIRROR_DAYS_AHEAD)
+        events, sync_token, time_zone = await self.alist_events(
+            client, user_id,
+            timeMin=format_rfc3339(window_start), timeMax=format_rfc3339(window_end),
+        )
+        await db.execute(delete(CalendarEvent).where(
+            CalendarEvent.user_id == user_id, CalendarEvent.calendar_id == CALENDAR_ID,
+        ))
+        db.add_all([event_row(user_id, event, time_zone) for event in events if event.get("status") != "cancelled"])
+        if mirror is None:
+            mirror = CalendarMirror(user_id=user_id, calendar_id=CALENDAR_ID)
+            db.add(mirror)
+        mirror.time_zone = time_zone
+        mirror.sync_token = sync_token
+        mirror.window_start = to_utc_naive(window_start)
+        mirror.window_end = to_utc_naive(window_end)
+        mirror.synced_at = utcnow()
+        self.full_syncs += 1
+        return mirror, {"full": True, "events": len(events)}
+
+    async def incremental_sync(self, db: AsyncSession, client, mirror: CalendarMirror) -> dict:
+        synced_at = utcnow()
+        events, sync_token, time_zone = await self.alist_events(
+            client, mirror.user_id, syncToken=mirror.sync_token,
+        )
+        mirror.time_zone = time_zone or mirror.time_zone
+        await self.apply_events(db, mirror.user_id, events, mirror.time_zone)
+        mirror.sync_token = sync_token or mirror.sync_token
+        mirror.synced_at = synced_at
+        return {"full": False, "events": len(events)}
+
+    async def apply_events(self, db: AsyncSession, user_id: str, events: list[dict], time_zone: str | None):
+        """Upserts changed events and drops cancelled ones."""
+        await db.execute(delete(CalendarEvent).where(
+            CalendarEvent.user_id == user_id,
+            CalendarEvent.calendar_id == CALENDAR_ID,
+            CalendarEvent.event_id.in_([event["id"] for event in events]),
+        ))
+        db.add_all([event_row(user_id, event, time_zone) for event in events if event.get("status") != "cancelled"])
+
+    @staticmethod
+    async def alist_events(client, user_id: str, **params) -> tuple[list[dict], str | None, str | None]:
+        """Every page of events.list; returns the events, the nextSyncToken and the calendar's time zone."""
+        events, page_token = [], None
+        while True:
+            request = client.events().list(
+                calendarId=CALENDAR_ID, singleEvents=True, maxResults=EVENTS_PAGE_SIZE, pageToken=page_token, **params,
+            )
+            page = await google_api_scheduler.aexecute(user_id, "events.list", request.execute)
+            events.extend(page.get("items", []))
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return events, page.get("nextSyncToken"), page.get("timeZone")
+
+    async def ensure_channel(self, db: AsyncSession, client, mirror: CalendarMirror):
+        """Opens a watch channel for the calendar, replacing one that is about to expire."""
+        if mirror.channel_expires_at is not None and mirror.channel_expires_at - utcnow() > CHANNEL_RENEW_MARGIN:
+            return
+        old_channel = (mirror.channel_id, mirror.channel_resource_id)
+        channel_id, token = str(uuid.uuid4()), secrets.token_urlsafe(32)
+        request = client.events().watch(calendarId=CALENDAR_ID, body={
+            "id": channel_id,
+            "type": "web_hook",
+            "address": settings.CALENDAR_WEBHOOK_URL,
+            "token": token,
+            "params": {"ttl": str(settings.CALENDAR_WATCH_TTL_SECONDS)},
+        })
+        response = await google_api_scheduler.aexecute(mirror.user_id, "events.watch", request.execute)
+        mirror.channel_id = channel_id
+        mirror.channel_token = token
+        mirror.channel_resource_id = response["resourceId"]
+        mirror.channel_expires_at = to_utc_naive(datetime.fromtimestamp(int(response["expiration"]) / 1000, timezone.utc))
+
+        if old_channel[0] and old_channel[1]:
+            request = client.channels().stop(body={"id": old_channel[0], "resourceId": old_channel[1]})
+            try:
+                await google_api_scheduler.aexecute(mirror.user_id, "channels.stop", request.execute)
+            except HttpError as e:
+                # An expired channel is already gone; a live one just sends notifications nobody accepts
+                logger.info("Could not stop calendar channel %s: %s", old_channel[0], e)
+
+    async def ahandle_notification(self, channel_id: str, token: str | None, resource_state: str) -> bool:
+        """
+        A push notification for `channel_id`. "sync" only confirms a new channel,
+        anything else means the calendar changed. Returns False for unknown
+        channels or a wrong token.
+        """
+        async with AsyncSessionLocal() as db:
+            mirror = (await db.execute(
+                select(CalendarMirror).where(CalendarMirror.channel_id == channel_id)
+            )).scalars().first()
+        if mirror is None or not secrets.compare_digest(mirror.channel_token or "", token or ""):
+            return False
+        self.notifications += 1
+        if resource_state != "sync":
+            self.schedule_sync(mirror.user_id)
+        return True
+
+    def active_users(self) -> list[str]:
+        """Users who looked up availability within the active window; forgets the rest."""
+        cutoff = time.monotonic() - self.active_seconds
+        for user_id in [user_id for user_id, seen in self._active.items() if seen < cutoff]:
+            del self._active[user_id]
+        return list(self._active)
+
+    async def due_for_sync(self, interval_seconds: float) -> list[str]:
+        """
+        Active users a poll running every `interval_seconds` should sync now:
+        mirrors without a live channel that are already stale, watched mirrors
+        not synced for an interval (lost notifications), channels expiring soon.
+        Inactive users are left alone; their next lookup resyncs them.
+        """
+        active = self.active_users()
+        if not active:
+            return []
+        now = utcnow()
+        interval = timedelta(seconds=interval_seconds)
+        polled = or_(CalendarMirror.channel_expires_at.is_(None), CalendarMirror.channel_expires_at <= now)
+        async with AsyncSessionLocal() as db:
+            rows = await db.execute(select(CalendarMirror.user_id).where(
+                CalendarMirror.user_id.in_(active),
+                or_(
+                    CalendarMirror.synced_at.is_(None),
+                    and_(polled, CalendarMirror.synced_at < now - self.polled_staleness),
+                    CalendarMirror.synced_at < now - interval,
+                    CalendarMirror.channel_expires_at < now + CHANNEL_RENEW_MARGIN,
+                ),
+            ))
+            return list(rows.scalars())
+
+    async def aclose(self):
+        """Cancels running syncs on shutdown."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "syncs": self.syncs,
+            "full_syncs": self.full_syncs,
+            "failures": self.failures,
+            "notifications": self.notifications,
+            "syncing": len(self._tasks),
+            "active_users": len(self._active),
+        }
+
+
+calendar_mirror = CalendarMirrorService()
+
+
+async def calendar_mirror_loop(
+    interval_seconds: float = settings.CALENDAR_MIRROR_SYNC_INTERVAL_SECONDS,
+    concurrency: int = settings.CALENDAR_MIRROR_POLL_CONCURRENCY,
+):
+    """Background task (started in the app lifespan) syncing mirrors that no notification refreshed."""
+    # A few users at a time keeps the poll from competing with requests for quota
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def poll(user_id: str):
+        async with semaphore:
+            task = calendar_mirror.schedule_sync(user_id)
+            if task is not None:
+                await task
+
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            due = await calendar_mirror.due_for_sync(interval_seconds)
+            await asyncio.gather(*(poll(user_id) for user_id in due))
+            if due:
+                logger.debug("Calendar mirror poll synced %s user(s)", len(due))
+        except Exception as e:
+            logger.error("Calendar mirror loop failed: %s", e)
+
+
+async def local_channel(user_id: str) -> CalendarMirror:
+    """The user's channel, or a local one that never expires when Google isn't pushing to this host."""
+    async with AsyncSessionLocal() as db:
+        mirror = await db.get(CalendarMirror, (user_id, CALENDAR_ID))
+        if mirror is None:
+            raise SystemExit(f"No calendar mirror for {user_id}, run `sync {user_id}` first")
+        if mirror.channel_id is None:
+            mirror.channel_id = f"local-{uuid.uuid4()}"
+            mirror.channel_token = secrets.token_urlsafe(32)
+            mirror.channel_resource_id = "local"
+            await db.commit()
+        return mirror
+
+
+def post_notification(url: str, mirror: CalendarMirror, resource_state: str) -> int:
+    request = urllib.request.Request(f"{url.rstrip('/')}/calendar/notifications", method="POST", data=b"", headers={
+        "X-Goog-Channel-ID": mirror.channel_id,
+        "X-Goog-Channel-Token": mirror.channel_token,
+        "X-Goog-Resource-ID": mirror.channel_resource_id or "",
+        "X-Goog-Resource-State": resource_state,
+        "X-Goog-Message-Number": str(int(time.time())),
+    })
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["sync", "notify"])
+    parser.add_argument("user_id")
+    parser.add_argument("--url", default="http://localhost:8000", help="app base URL for notify")
+    parser.add_argument("--state", default="exists", help="X-Goog-Resource-State for notify")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        print(json.dumps(asyncio.run(calendar_mirror.sync(args.user_id)), indent=2))
+    else:
+        mirror = asyncio.run(local_channel(args.user_id))
+        print(f"Notified channel {mirror.channel_id}: HTTP {post_notification(args.url, mirror, args.state)}")
+
+
+if __name__ == "__main__":
+    main()
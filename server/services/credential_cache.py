@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from google.oauth2.credentials import Credentials
+
+from server.config import settings
+
+
+def utcnow_naive() -> datetime:
+    # google-auth keeps Credentials.expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_fresh(creds: Credentials, min_valid_seconds: float = 0) -> bool:
+    """True if the access token is valid for at least `min_valid_seconds` more."""
+    if not creds.valid:
+        return False
+    if creds.expiry is None:
+        return True
+    return creds.expiry - utcnow_naive() > timedelta(seconds=min_valid_seconds)
+
+
+class CredentialCache:
+    """
+    Process-level TTL + LRU cache of Google Credentials keyed by user id.
+    An entry is dropped once its user made no request for `idle_seconds`, and
+    the least recently used go first beyond `max_users`. The background refresh
+    only looks at cached users, so it stops once a user goes quiet; its own
+    lookups pass touch=False and don't keep anyone active.
+
+    Each user also gets a lock so that concurrent requests needing a refresh
+    wait for a single refresh (single-flight) instead of all calling Google's
+    token endpoint and committing to the users table.
+    """
+    def __init__(
+        self,
+        idle_seconds: float = settings.CREDENTIAL_CACHE_IDLE_SECONDS,
+        max_users: int = settings.CREDENTIAL_CACHE_MAX_USERS,
+    ):
+        self.idle_seconds = idle_seconds
+        self.max_users = max_users
+        # user id -> (credentials, last used), least recently used first
+        self._credentials: OrderedDict[str, tuple[Credentials, float]] = OrderedDict()
+        self._locks: dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, user_id: str, min_valid_seconds: float = 0, touch: bool = True) -> Credentials | None:
+        now = time.monotonic()
+        with self._guard:
+            entry = self._credentials.get(user_id)
+            if entry is None:
+                return None
+            creds, used_at = entry
+            if now - used_at >= self.idle_seconds:
+                self._remove(user_id)
+                return None
+            if touch:
+                self._credentials[user_id] = (creds, now)
+                self._credentials.move_to_end(user_id)
+        if is_fresh(creds, min_valid_seconds):
+            return creds
+        return None
+
+    def put(self, user_id: str, creds: Credentials, touch: bool = True):
+        now = time.monotonic()
+        with self._guard:
+            entry = self._credentials.get(user_id)
+            if not touch:
+                if entry is None:
+                    # Evicted while the background refresh ran; the user stays gone
+                    return
+                now = entry[1]
+            self._credentials[user_id] = (creds, now)
+            if touch:
+                self._credentials.move_to_end(user_id)
+            while len(self._credentials) > self.max_users:
+                self._remove(next(iter(self._credentials)))
+
+    def invalidate(self, user_id: str):
+        with self._guard:
+            self._remove(user_id)
+
+    def _remove(self, user_id: str):
+        self._credentials.pop(user_id, None)
+        lock = self._locks.get(user_id)
+        if lock is not None and not lock.locked():
+            del self._locks[user_id]
+
+    def lock_for(self, user_id: str) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(user_id)
+            if lock is None:
+                lock = self._locks[user_id] = threading.Lock()
+            return lock
+
+    def expiring_within(self, seconds: float) -> list[str]:
+        """Active users whose cached token expires in less than `seconds`; idle entries are dropped here."""
+        now = time.monotonic()
+        with self._guard:
+            for user_id in [k for k, (_, used_at) in self._credentials.items() if now - used_at >= self.idle_seconds]:
+                self._remove(user_id)
+            entries = list(self._credentials.items())
+        return [user_id for user_id, (creds, _) in entries if not is_fresh(creds, seconds)]
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {"users": len(self._credentials), "locks": len(self._locks)}
+
+
+credential_cache = CredentialCache()
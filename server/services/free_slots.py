@@ -0,0 +1,100 @@
+'''
+Free-slot search over a time-bucket availability bitmap.
+
+The search window is cut into fixed buckets (5 minutes by default). A bucket is
+free when it lies inside working hours (in the user's timezone), is not in the
+past and overlaps no busy interval. Free runs are found with a vectorized
+run-length scan, so cost stays flat no matter how many busy periods there are.
+'''
+import math
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+DEFAULT_BUCKET_MINUTES = 5
+
+
+def _interval_mask(n_buckets: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Boolean mask of buckets covered by any [start, end) bucket-index interval."""
+    starts = np.clip(starts, 0, n_buckets)
+    ends = np.clip(ends, 0, n_buckets)
+    delta = np.zeros(n_buckets + 1, dtype=np.int32)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, ends, -1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+def _bucket_index(moments: list[datetime], origin: datetime, bucket: timedelta, round_up: bool) -> np.ndarray:
+    seconds = np.array([(m - origin).total_seconds() for m in moments], dtype=np.float64)
+    scaled = seconds / bucket.total_seconds()
+    return (np.ceil(scaled) if round_up else np.floor(scaled)).astype(np.int64)
+
+
+def find_free_slots(
+    busy: list[tuple[datetime, datetime]],
+    date_from: date,
+    date_to: date,
+    tz_name: str,
+    duration_minutes: int,
+    work_start: time = time(9, 0),
+    work_end: time = time(17, 0),
+    limit: int = 5,
+    not_before: datetime | None = None,
+    bucket_minutes: int = DEFAULT_BUCKET_MINUTES,
+) -> list[dict]:
+    """
+    Earliest free windows of at least `duration_minutes` between date_from and
+    date_to (inclusive, local dates), one candidate per free run.
+
+    Returns dicts with local ISO 8601 `start`/`end` of the proposed slot and
+    `free_until`, the end of the free run it sits in.
+    """
+    tz = ZoneInfo(tz_name)
+    bucket = timedelta(minutes=bucket_minutes)
+    origin = datetime.combine(date_from, time(0), tz).astimezone(timezone.utc)
+    horizon = datetime.combine(date_to + timedelta(days=1), time(0), tz).astimezone(timezone.utc)
+    n_buckets = math.ceil((horizon - origin) / bucket)
+    if n_buckets <= 0:
+        return []
+
+    # Working hours, computed per local day so DST shifts land in the right bucket
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    work_starts = [datetime.combine(d, work_start, tz).astimezone(timezone.utc) for d in days]
+    work_ends = [datetime.combine(d, work_end, tz).astimezone(timezone.utc) for d in days]
+    # Round inwards: a partially covered bucket is outside working hours
+    allowed = _interval_mask(
+        n_buckets,
+        _bucket_index(work_starts, origin, bucket, round_up=True),
+        _bucket_index(work_ends, origin, bucket, round_up=False),
+    )
+
+    if busy:
+        # Round outwards: a partially busy bucket is busy
+        allowed &= ~_interval_mask(
+            n_buckets,
+            _bucket_index([s for s, _ in busy], origin, bucket, round_up=False),
+            _bucket_index([e for _, e in busy], origin, bucket, round_up=True),
+        )
+
+    if not_before is not None and not_before > origin:
+        allowed[: int(_bucket_index([not_before], origin, bucket, round_up=True)[0])] = False
+
+    # Run-length scan: +1 marks the start of a free run, -1 its end
+    edges = np.diff(np.concatenate(([0], allowed.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    needed = math.ceil(duration_minutes / bucket_minutes)
+    fits = (run_ends - run_starts) >= needed
+    run_starts, run_ends = run_starts[fits][:limit], run_ends[fits][:limit]
+
+    duration = timedelta(minutes=duration_minutes)
+    candidates = []
+    for start_idx, end_idx in zip(run_starts.tolist(), run_ends.tolist()):
+        start = (origin + start_idx * bucket).astimezone(tz)
+        candidates.append({
+            "start": start.isoformat(),
+            "end": (start + duration).isoformat(),
+            "free_until": (origin + end_idx * bucket).astimezone(tz).isoformat(),
+        })
+    return candidates
@@ -1,30 +1,233 @@
-from googleapiclient.discovery import build
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from zoneinfo import ZoneInfo
 from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from server.services.availability_cache import (
+    availability_cache,
+    format_rfc3339,
+    merge_intervals,
+    parse_rfc3339,
+)
+from server.services.calendar_mirror import calendar_mirror
+from server.services.free_slots import find_free_slots
+from server.services.google_client import google_client_factory
+from server.services.google_scheduler import QuotaExceededError, google_api_scheduler, retry_reason
+
+# freebusy.query accepts at most this many calendars per request
+FREEBUSY_MAX_ITEMS = 50
+# Larger lists are split into requests sent this many at a time
+FREEBUSY_MAX_CONCURRENT_REQUESTS = 4
+# events.insert calls per batch request. The API takes up to 1000, but every
+# call still counts against the per-user rate limit
+EVENTS_BATCH_MAX_REQUESTS = 50
+
+
+def event_id(slot: dict) -> str:
+    """
+    Client-generated id of the event booking `slot`: the same summary and
+    times always give the same id, so a repeated insert (a retry after a lost
+    response, or the model booking again after a timeout) gets a 409 for the
+    existing event instead of creating a second one.
+    """
+    key = "\n".join([
+        slot["summary"],
+        format_rfc3339(parse_rfc3339(slot["start"]["dateTime"])),
+        format_rfc3339(parse_rfc3339(slot["end"]["dateTime"])),
+    ])
+    # Hex digits are valid in Google's base32hex event ids
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def unavailable_calendars(slots: dict) -> list[dict]:
+    """Calendars of a get_slots result that came back with errors, with Google's reason."""
+    calendars = slots.get("calendars", {"primary": slots})
+    return [
+        {"calendar": calendar_id, "reason": result["errors"][0].get("reason")}
+        for calendar_id, result in calendars.items() if result.get("errors")
+    ]
 
 
 class GoogleCalendarService:
-    def __init__(self, creds: Credentials): 
-        self.client = build('calendar', 'v3', credentials=creds)
+    def __init__(self, creds: Credentials, user_id: str | None = None): 
+        # Cached discovery document + pooled connections, see GoogleClientFactory
+        self.client = google_client_factory.calendar(creds)
+        # Key for the per-user availability cache; no caching without it
+        self.user_id = user_id
+
+    def get_slots(self, time_min: str, time_max: str, calendars: list[str] | None = None):
+        """
+        Busy periods in [time_min, time_max) of the primary calendar, or of the
+        primary calendar plus `calendars` (other calendar ids or attendee emails).
+
+        With several calendars every id is queried in one freebusy request (split
+        into concurrent requests above FREEBUSY_MAX_ITEMS) and the result has
+        "busy": the merged intervals where anyone is busy, so the time outside
+        them is free for everyone, and "calendars": each calendar's own busy
+        list, or its errors (e.g. notFound for a guest who doesn't share).
+        """
+        calendar_ids = self.calendar_ids(calendars)
+        if len(calendar_ids) > 1:
+            return self.get_shared_slots(time_min, time_max, calendar_ids)
+        return self.get_primary_slots(time_min, time_max)
+
+    @staticmethod
+    def calendar_ids(calendars: list[str] | None) -> list[str]:
+        return list(dict.fromkeys(["primary", *(calendars or [])]))
+
+    def get_primary_slots(self, time_min: str, time_max: str):
+        """
+        Busy periods of the primary calendar.
+        Sub-ranges already in the availability cache are answered locally and
+        only the uncovered gaps are sent to freebusy.
+        """
+        if self.user_id is None:
+            return self.query_freebusy(time_min, time_max)["primary"]
+
+        start, end = parse_rfc3339(time_min), parse_rfc3339(time_max)
+        busy, gaps = availability_cache.lookup(self.user_id, start, end)
+        for gap_start, gap_end in gaps:
+            requested_at = time.monotonic()
+            slots = self.query_freebusy(format_rfc3339(gap_start), format_rfc3339(gap_end))["primary"]
+            if slots.get("errors"):
+                # Partial answers from Google are passed through, never cached
+                return slots
+            fetched = [(parse_rfc3339(b["start"]), parse_rfc3339(b["end"])) for b in slots.get("busy", [])]
+            availability_cache.store(self.user_id, gap_start, gap_end, fetched, requested_at)
+            busy.extend(fetched)
+
+        return {"busy": self.format_busy(merge_intervals(busy))}
+
+    def get_shared_slots(self, time_min: str, time_max: str, calendar_ids: list[str]):
+        calendars = self.cached_calendars(time_min, time_max)
+        requested_at = time.monotonic()
+        queried = self.query_calendars(time_min, time_max, [c for c in calendar_ids if c not in calendars])
+        return self.merge_calendars(time_min, time_max, calendar_ids, calendars, queried, requested_at)
 
-    def get_slots(self, time_min: str, time_max: str):
+    def cached_calendars(self, time_min: str, time_max: str) -> dict:
+        """The user's own calendar still comes from the cache when all of the range is there."""
+        if self.user_id is None:
+            return {}
+        busy, gaps = availability_cache.lookup(self.user_id, parse_rfc3339(time_min), parse_rfc3339(time_max))
+        return {} if gaps else {"primary": {"busy": busy}}
 
+    def merge_calendars(self, time_min: str, time_max: str, calendar_ids: list[str], calendars: dict, queried: dict, requested_at: float) -> dict:
+        """get_shared_slots' result from the cached and the queried calendars; caches a queried primary."""
+        start, end = parse_rfc3339(time_min), parse_rfc3339(time_max)
+        for calendar_id, slots in queried.items():
+            if slots.get("errors"):
+                calendars[calendar_id] = {"errors": slots["errors"]}
+                continue
+            busy = [(parse_rfc3339(b["start"]), parse_rfc3339(b["end"])) for b in slots.get("busy", [])]
+            calendars[calendar_id] = {"busy": busy}
+            if calendar_id == "primary" and self.user_id is not None:
+                availability_cache.store(self.user_id, start, end, busy, requested_at)
+
+        anyone_busy = []
+        by_calendar = {}
+        for calendar_id in calendar_ids:
+            slots = calendars.get(calendar_id, {"errors": [{"reason": "notReturned"}]})
+            if "busy" in slots:
+                anyone_busy.extend(slots["busy"])
+                slots = {"busy": self.format_busy(merge_intervals(slots["busy"]))}
+            by_calendar[calendar_id] = slots
+        return {"busy": self.format_busy(merge_intervals(anyone_busy)), "calendars": by_calendar}
+
+    def query_calendars(self, time_min: str, time_max: str, calendar_ids: list[str]) -> dict:
+        """freebusy for any number of calendars, FREEBUSY_MAX_ITEMS per request."""
+        if not calendar_ids:
+            return {}
+        chunks = [calendar_ids[i:i + FREEBUSY_MAX_ITEMS] for i in range(0, len(calendar_ids), FREEBUSY_MAX_ITEMS)]
+        if len(chunks) == 1:
+            return self.query_freebusy(time_min, time_max, chunks[0])
+        calendars = {}
+        with ThreadPoolExecutor(max_workers=min(len(chunks), FREEBUSY_MAX_CONCURRENT_REQUESTS)) as executor:
+            for result in executor.map(lambda chunk: self.query_freebusy(time_min, time_max, chunk), chunks):
+                calendars.update(result)
+        return calendars
+
+    @staticmethod
+    def format_busy(busy: list[tuple[datetime, datetime]]) -> list[dict]:
+        return [{"start": format_rfc3339(busy_start), "end": format_rfc3339(busy_end)} for busy_start, busy_end in busy]
+
+    def find_free_slots(
+        self,
+        duration_minutes: int,
+        date_from: str,
+        date_to: str,
+        timezone_name: str,
+        work_start: str = "09:00",
+        work_end: str = "17:00",
+        limit: int = 5,
+        calendars: list[str] | None = None,
+    ):
+        """
+        Earliest free windows of `duration_minutes` between two local dates
+        (YYYY-MM-DD, inclusive) within working hours (HH:MM, local time).
+        Busy periods come from get_slots, so the availability cache applies
+        (and the calendar mirror, through afind_free_slots); with `calendars`
+        the windows are free in all of them. Calendars that couldn't be read
+        (e.g. a guest who doesn't share) are listed in "unavailable_calendars":
+        the windows say nothing about them.
+        """
+        range_min, range_max = self.local_range(date_from, date_to, timezone_name)
+        slots = self.get_slots(range_min, range_max, calendars)
+        return self.free_windows(slots, duration_minutes, date_from, date_to, timezone_name, work_start, work_end, limit)
+
+    @staticmethod
+    def local_range(date_from: str, date_to: str, timezone_name: str) -> tuple[str, str]:
+        """RFC 3339 bounds of the local days date_from..date_to."""
+        tz = ZoneInfo(timezone_name)
+        range_start = datetime.combine(date.fromisoformat(date_from), dt_time(0), tz)
+        range_end = datetime.combine(date.fromisoformat(date_to) + timedelta(days=1), dt_time(0), tz)
+        return format_rfc3339(range_start), format_rfc3339(range_end)
+
+    @staticmethod
+    def free_windows(slots: dict, duration_minutes: int, date_from: str, date_to: str, timezone_name: str, work_start: str, work_end: str, limit: int) -> dict:
+        busy = [(parse_rfc3339(b["start"]), parse_rfc3339(b["end"])) for b in slots.get("busy", [])]
+        return {
+            "timezone": timezone_name,
+            "duration_minutes": duration_minutes,
+            "unavailable_calendars": unavailable_calendars(slots),
+            "candidates": find_free_slots(
+                busy,
+                date.fromisoformat(date_from),
+                date.fromisoformat(date_to),
+                timezone_name,
+                duration_minutes,
+                work_start=dt_time.fromisoformat(work_start),
+                work_end=dt_time.fromisoformat(work_end),
+                limit=limit,
+                not_before=datetime.now(timezone.utc),
+            ),
+        }
+
+    def freebusy_request(self, time_min: str, time_max: str, calendar_ids: list[str]):
         body = {
             "timeMin": time_min,
             "timeMax": time_max,
             "items": [
-                {"id": "primary"}
+                {"id": calendar_id} for calendar_id in calendar_ids
             ]
         }
+        return self.client.freebusy().query(body=body)
 
+    def query_freebusy(self, time_min: str, time_max: str, calendar_ids: list[str] = ("primary",)) -> dict:
+        """One freebusy request; returns the response's calendars by id."""
         # 3. Execute the Query
-        response = self.client.freebusy().query(body=body).execute()
+        request = self.freebusy_request(time_min, time_max, calendar_ids)
+        response = google_api_scheduler.execute(self.user_id, "freebusy.query", request.execute)
 
         # 4. Process the Response
-        slots = response['calendars']['primary']
-        return slots
+        return response['calendars']
     
-    def book_slot(self, slot: dict):
-        body = {
+    @staticmethod
+    def event_body(slot: dict) -> dict:
+        return {
+            "id": event_id(slot),
             "summary": slot["summary"],
             "description": slot["description"],
             "start": {
@@ -34,5 +237,256 @@ class GoogleCalendarService:
                 "dateTime": slot["end"]["dateTime"],
             }
         }
-        response = self.client.events().insert(calendarId='primary', body=body).execute()
-        return response
\ No newline at end of file
+
+    def book_slot(self, slot: dict):
+        """
+        Books the slot under its event_id, so the insert is safe to retry.
+        A 409 means the event is already there and it is returned instead.
+        """
+        request = self.client.events().insert(calendarId='primary', body=self.event_body(slot))
+        try:
+            response = google_api_scheduler.execute(self.user_id, "events.insert", request.execute)
+        except HttpError as e:
+            if e.status_code != 409:
+                raise
+            response = self.existing_event(slot)
+        self.invalidate_booked([slot])
+        return response
+
+    def existing_event(self, slot: dict) -> dict:
+        """The event holding the slot's id; one deleted since is booked again under an id Google picks."""
+        request = self.client.events().get(calendarId='primary', eventId=event_id(slot))
+        event = google_api_scheduler.execute(self.user_id, "events.get", request.execute)
+        if event.get("status") != "cancelled":
+            return event
+        # Ids of deleted events stay taken
+        request = self.client.events().insert(calendarId='primary', body=self.reissued_body(slot))
+        return google_api_scheduler.execute(self.user_id, "events.insert", request.execute, idempotent=False)
+
+    def reissued_body(self, slot: dict) -> dict:
+        return {key: value for key, value in self.event_body(slot).items() if key != "id"}
+
+    def book_slots(self, slots: list[dict]) -> list[dict]:
+        """
+        Books several events with batched events.insert calls, EVENTS_BATCH_MAX_REQUESTS
+        per HTTP request. Returns one result per slot, in order:
+        {"status": "booked", "event": {...}} or {"status": "failed", "error": "..."}.
+        Events refused for rate limits go out again in a later batch, after a backoff;
+        like book_slot, an event that already exists is reported as booked.
+        QuotaExceededError is raised only when the scheduler refuses a batch before any event was booked.
+        Cached availability over the whole span is invalidated once.
+        """
+        bookings = SlotBookings(self, slots)
+        attempt = 0
+        try:
+            while True:
+                for chunk, batch in bookings.batches():
+                    try:
+                        google_api_scheduler.execute(self.user_id, "events.batch_insert", batch.execute, cost=len(chunk))
+                    except Exception as e:
+                        bookings.batch_failed(chunk, e)
+                retry = bookings.next_round(attempt)
+                if retry is None:
+                    break
+                google_api_scheduler.wait_before_retry("events.batch_insert", attempt, *retry)
+                attempt += 1
+            for index in bookings.conflicts:
+                try:
+                    bookings.results[index] = {"status": "booked", "event": self.existing_event(slots[index])}
+                except Exception as e:
+                    bookings.results[index] = {"status": "failed", "error": str(e)}
+        finally:
+            self.invalidate_booked(slots)
+        return bookings.results
+
+    def invalidate_booked(self, slots: list[dict]):
+        """New events make any cached availability over their span stale."""
+        if self.user_id is not None and slots:
+            availability_cache.invalidate(
+                self.user_id,
+                min(parse_rfc3339(slot["start"]["dateTime"]) for slot in slots),
+                max(parse_rfc3339(slot["end"]["dateTime"]) for slot in slots),
+            )
+
+    # The async variants go through google_api_scheduler.aexecute: quota waits and
+    # backoff happen on the event loop, only the HTTP calls take a Google executor thread.
+    async def aget_slots(self, time_min: str, time_max: str, calendars: list[str] | None = None):
+        """
+        Async get_slots. The primary calendar alone is answered from the local
+        calendar mirror while it is fresh (see calendar_mirror.py), then from
+        the availability cache and freebusy like get_slots.
+        """
+        calendar_ids = self.calendar_ids(calendars)
+        if len(calendar_ids) > 1:
+            return await self.aget_shared_slots(time_min, time_max, calendar_ids)
+        if self.user_id is not None:
+            busy = await calendar_mirror.abusy(self.user_id, parse_rfc3339(time_min), parse_rfc3339(time_max))
+            if busy is not None:
+                return {"busy": self.format_busy(merge_intervals(busy))}
+        return await self.aget_primary_slots(time_min, time_max)
+
+    async def aget_primary_slots(self, time_min: str, time_max: str):
+        if self.user_id is None:
+            return (await self.aquery_freebusy(time_min, time_max))["primary"]
+
+        start, end = parse_rfc3339(time_min), parse_rfc3339(time_max)
+        busy, gaps = availability_cache.lookup(self.user_id, start, end)
+        for gap_start, gap_end in gaps:
+            requested_at = time.monotonic()
+            slots = (await self.aquery_freebusy(format_rfc3339(gap_start), format_rfc3339(gap_end)))["primary"]
+            if slots.get("errors"):
+                # Partial answers from Google are passed through, never cached
+                return slots
+            fetched = [(parse_rfc3339(b["start"]), parse_rfc3339(b["end"])) for b in slots.get("busy", [])]
+            availability_cache.store(self.user_id, gap_start, gap_end, fetched, requested_at)
+            busy.extend(fetched)
+
+        return {"busy": self.format_busy(merge_intervals(busy))}
+
+    async def aget_shared_slots(self, time_min: str, time_max: str, calendar_ids: list[str]):
+        calendars = self.cached_calendars(time_min, time_max)
+        requested_at = time.monotonic()
+        queried = await self.aquery_calendars(time_min, time_max, [c for c in calendar_ids if c not in calendars])
+        return self.merge_calendars(time_min, time_max, calendar_ids, calendars, queried, requested_at)
+
+    async def aquery_calendars(self, time_min: str, time_max: str, calendar_ids: list[str]) -> dict:
+        if not calendar_ids:
+            return {}
+        chunks = [calendar_ids[i:i + FREEBUSY_MAX_ITEMS] for i in range(0, len(calendar_ids), FREEBUSY_MAX_ITEMS)]
+        semaphore = asyncio.Semaphore(FREEBUSY_MAX_CONCURRENT_REQUESTS)
+
+        async def query(chunk: list[str]) -> dict:
+            async with semaphore:
+                return await self.aquery_freebusy(time_min, time_max, chunk)
+
+        calendars = {}
+        for result in await asyncio.gather(*(query(chunk) for chunk in chunks)):
+            calendars.update(result)
+        return calendars
+
+    async def aquery_freebusy(self, time_min: str, time_max: str, calendar_ids: list[str] = ("primary",)) -> dict:
+        request = self.freebusy_request(time_min, time_max, calendar_ids)
+        response = await google_api_scheduler.aexecute(self.user_id, "freebusy.query", request.execute)
+        return response['calendars']
+
+    async def abook_slot(self, slot: dict):
+        request = self.client.events().insert(calendarId='primary', body=self.event_body(slot))
+        try:
+            response = await google_api_scheduler.aexecute(self.user_id, "events.insert", request.execute)
+        except HttpError as e:
+            if e.status_code != 409:
+                raise
+            response = await self.aexisting_event(slot)
+        self.invalidate_booked([slot])
+        if self.user_id is not None:
+            await calendar_mirror.arecord_events(self.user_id, [response])
+        return response
+
+    async def aexisting_event(self, slot: dict) -> dict:
+        request = self.client.events().get(calendarId='primary', eventId=event_id(slot))
+        event = await google_api_scheduler.aexecute(self.user_id, "events.get", request.execute)
+        if event.get("status") != "cancelled":
+            return event
+        request = self.client.events().insert(calendarId='primary', body=self.reissued_body(slot))
+        return await google_api_scheduler.aexecute(self.user_id, "events.insert", request.execute, idempotent=False)
+
+    async def abook_slots(self, slots: list[dict]):
+        bookings = SlotBookings(self, slots)
+        attempt = 0
+        try:
+            while True:
+                for chunk, batch in bookings.batches():
+                    try:
+                        await google_api_scheduler.aexecute(self.user_id, "events.batch_insert", batch.execute, cost=len(chunk))
+                    except Exception as e:
+                        bookings.batch_failed(chunk, e)
+                retry = bookings.next_round(attempt)
+                if retry is None:
+                    break
+                await google_api_scheduler.await_before_retry("events.batch_insert", attempt, *retry)
+                attempt += 1
+            for index in bookings.conflicts:
+                try:
+                    bookings.results[index] = {"status": "booked", "event": await self.aexisting_event(slots[index])}
+                except Exception as e:
+                    bookings.results[index] = {"status": "failed", "error": str(e)}
+        finally:
+            self.invalidate_booked(slots)
+        results = bookings.results
+        if self.user_id is not None:
+            await calendar_mirror.arecord_events(self.user_id, [r["event"] for r in results if r["status"] == "booked"])
+        return results
+
+    async def afind_free_slots(
+        self,
+        duration_minutes: int,
+        date_from: str,
+        date_to: str,
+        timezone_name: str,
+        work_start: str = "09:00",
+        work_end: str = "17:00",
+        limit: int = 5,
+        calendars: list[str] | None = None,
+    ):
+        range_min, range_max = self.local_range(date_from, date_to, timezone_name)
+        slots = await self.aget_slots(range_min, range_max, calendars)
+        return self.free_windows(slots, duration_minutes, date_from, date_to, timezone_name, work_start, work_end, limit)
+
+
+class SlotBookings:
+    """
+    State of one book_slots call: a result per slot, and the events refused
+    with a retryable error in the current round.
+    """
+    def __init__(self, service: GoogleCalendarService, slots: list[dict]):
+        self.service = service
+        self.slots = slots
+        self.results: list[dict | None] = [None] * len(slots)
+        # index -> (error, reason) for events worth another attempt
+        self.retryable: dict[int, tuple[BaseException, str]] = {}
+        # Events refused with 409: already booked under their id, looked up after the batches
+        self.conflicts: list[int] = []
+        self.pending = list(range(len(slots)))
+
+    def record(self, request_id, response, exception):
+        index = int(request_id)
+        if exception is None:
+            self.results[index] = {"status": "booked", "event": response}
+            return
+        self.results[index] = {"status": "failed", "error": str(getattr(exception, "reason", None) or exception)}
+        if isinstance(exception, HttpError) and exception.status_code == 409:
+            self.conflicts.append(index)
+            return
+        reason = retry_reason(exception, idempotent=True)
+        if reason:
+            self.retryable[index] = (exception, reason)
+
+    def batches(self):
+        """Starts a round: yields the pending events' batch requests with their slot indices."""
+        self.retryable.clear()
+        for offset in range(0, len(self.pending), EVENTS_BATCH_MAX_REQUESTS):
+            chunk = self.pending[offset:offset + EVENTS_BATCH_MAX_REQUESTS]
+            batch = google_client_factory.batch("calendar", "v3", callback=self.record)
+            for index in chunk:
+                self.results[index] = None
+                request = self.service.client.events().insert(calendarId='primary', body=self.service.event_body(self.slots[index]))
+                batch.add(request, request_id=str(index))
+            yield chunk, batch
+
+    def batch_failed(self, chunk: list[int], error: Exception):
+        """The whole HTTP request failed; its events are reported and the next batch goes on."""
+        if isinstance(error, QuotaExceededError) and not any(
+            result is not None and result["status"] == "booked" for result in self.results
+        ):
+            # Throttled before anything was booked: the caller can retry the whole request
+            raise error
+        for index in chunk:
+            if self.results[index] is None:
+                self.results[index] = {"status": "failed", "error": str(error)}
+
+    def next_round(self, attempt: int) -> tuple[BaseException, str] | None:
+        """The (error, reason) to back off on before retrying the refused events, or None when done."""
+        if not self.retryable or attempt >= google_api_scheduler.max_retries:
+            return None
+        self.pending = sorted(self.retryable)
+        return next(iter(self.retryable.values()))
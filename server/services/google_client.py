@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import functools
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import BatchHttpRequest
+
+from server.config import settings
+
+# googleapiclient and google-auth block the calling thread; every such call the app
+# awaits runs here, never on asyncio's default executor
+google_executor = ThreadPoolExecutor(max_workers=settings.GOOGLE_EXECUTOR_THREADS, thread_name_prefix="google")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """asyncio.to_thread for Google calls: runs func(*args, **kwargs) on google_executor."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(google_executor, call)
+
+
+def apply_fix_ups(resource, description: dict):
+    """Builds every nested resource once, which is when googleapiclient fixes up their methods."""
+    for name, nested in description.get("resources", {}).items():
+        apply_fix_ups(getattr(resource, name)(), nested)
+
+
+class PooledAuthorizedHttp:
+    """
+    httplib2-compatible transport handed to googleapiclient resources.
+    Every request borrows a keep-alive httplib2.Http from the factory pool and
+    signs it with the bound user's credentials, so binding a user costs nothing
+    and concurrent requests never share a connection.
+    """
+    def __init__(self, factory: "GoogleClientFactory", credentials: Credentials):
+        self.factory = factory
+        # googleapiclient reads this attribute to refresh credentials for batch requests
+        self.credentials = credentials
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        with self.factory.lease() as http:
+            authed_http = AuthorizedHttp(self.credentials, http=http)
+            return authed_http.request(uri, method, body=body, headers=headers, **kwargs)
+
+    def close(self):
+        # Connections belong to the pool, there is nothing to close per user
+        pass
+
+
+class GoogleClientFactory:
+    """
+    Builds googleapiclient resources without re-reading discovery documents or
+    opening a fresh connection for every request.
+
+    - Discovery documents are loaded from the library's static cache and parsed once,
+      under a lock, with googleapiclient's fix-ups already applied.
+    - httplib2.Http objects (one persistent connection per host) are kept in a LIFO
+      pool so the most recently used, still-warm connection is reused first.
+    """
+    def __init__(
+        self,
+        pool_size: int = settings.GOOGLE_HTTP_POOL_SIZE,
+        timeout: float = settings.GOOGLE_HTTP_TIMEOUT_SECONDS,
+        api_endpoints: dict[str, str] | None = None,
+    ):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # Optional base URL per API name, e.g. {"calendar": "http://127.0.0.1:9000/calendar/v3/"}
+        self.api_endpoints = api_endpoints or {}
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        self._documents: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+
+    def discovery_document(self, service_name: str, version: str) -> dict:
+        """
+        Returns the parsed discovery document, loading it on first use.
+        googleapiclient applies in-place fix-ups to a method's description
+        (adding its parameters) the first time a resource holding it is built.
+        They are all applied here, under the lock, before the document is
+        shared. Later builds on worker threads then only rewrite existing
+        keys and never resize a dict another thread is reading.
+        """
+        key = (service_name, version)
+        document = self._documents.get(key)
+        if document is None:
+            with self._lock:
+                document = self._documents.get(key)
+                if document is None:
+                    raw = get_static_doc(service_name, version)
+                    if raw is None:
+                        raise ValueError(f"No bundled discovery document for {service_name} {version}")
+                    document = json.loads(raw)
+                    apply_fix_ups(build_from_document(document, http=httplib2.Http()), document)
+                    self._documents[key] = document
+        return document
+
+    @contextmanager
+    def lease(self):
+        """Borrow a pooled httplib2.Http, creating one when the pool is empty."""
+        try:
+            http = self._pool.get_nowait()
+        except queue.Empty:
+            http = httplib2.Http(timeout=self.timeout)
+        try:
+            yield http
+        finally:
+            try:
+                self._pool.put_nowait(http)
+            except queue.Full:
+                http.close()
+
+    def client(self, service_name: str, version: str, credentials: Credentials):
+        """Bind the user's credentials to a resource built from the cached document."""
+        client_options = None
+        if service_name in self.api_endpoints:
+            client_options = {"api_endpoint": self.api_endpoints[service_name]}
+        return build_from_document(
+            self.discovery_document(service_name, version),
+            http=PooledAuthorizedHttp(self, credentials),
+            client_options=client_options,
+        )
+
+    def batch(self, service_name: str, version: str, callback=None) -> BatchHttpRequest:
+        """
+        A BatchHttpRequest for the API. googleapiclient derives the batch URL
+        from the document's rootUrl only, so an api_endpoints override is
+        applied here the same way as for the client.
+        """
+        document = self.discovery_document(service_name, version)
+        root_url = document["rootUrl"]
+        endpoint = self.api_endpoints.get(service_name)
+        if endpoint:
+            # The endpoint replaces rootUrl + servicePath
+            root_url = endpoint.removesuffix(document["servicePath"])
+        return BatchHttpRequest(callback=callback, batch_uri=root_url + document.get("batchPath", "batch"))
+
+    def calendar(self, credentials: Credentials):
+        return self.client("calendar", "v3", credentials)
+
+    def oauth2(self, credentials: Credentials):
+        return self.client("oauth2", "v2", credentials)
+
+
+google_client_factory = GoogleClientFactory()
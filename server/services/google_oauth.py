@@ -1,10 +1,21 @@
-from googleapiclient.discovery import build
+import asyncio
+import logging
 from server.config import settings
+from google_auth_httplib2 import Request as GoogleAuthRequest
 from google_auth_oauthlib.flow import Flow
+from server.db.database import AsyncSessionLocal
 from server.db.models import User
-from sqlalchemy.orm import Session
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
 from google.oauth2.credentials import Credentials
-from datetime import datetime
+from datetime import datetime, timezone
+from server.services.credential_cache import credential_cache, is_fresh
+from server.services.google_client import google_client_factory, run_blocking
+from server.services.google_scheduler import google_api_scheduler
+from server.services.user_cache import CachedUser, load_user_by_id, user_cache
+from server.metrics import GOOGLE_API_DURATION, timed
+
+logger = logging.getLogger(__name__)
 
 class GoogleOAuthService:
     def __init__(self):
@@ -61,7 +72,8 @@ class GoogleOAuthService:
         )
         
         # Exchange code for tokens
-        flow.fetch_token(code=code)
+        with timed(GOOGLE_API_DURATION, "oauth2.token"):
+            flow.fetch_token(code=code)
         
         credentials = flow.credentials
         
@@ -72,7 +84,7 @@ class GoogleOAuthService:
             "expiry": credentials.expiry.isoformat() if credentials.expiry else None
         }
     
-    def save_tokens(self, db: Session, user_id: str, email: str, tokens: dict):
+    async def asave_tokens(self, db: AsyncSession, user_id: str, email: str, tokens: dict) -> User:
         """
         Save or update user tokens in database
         
@@ -82,14 +94,19 @@ class GoogleOAuthService:
             email: User email
             tokens: Token dictionary from exchange_code_for_tokens
         """
+        expiry = tokens["expiry"]
+        if isinstance(expiry, str):
+            # google_token_expiry is a DateTime column; only some drivers coerce ISO strings
+            expiry = datetime.fromisoformat(expiry)
+
         # Check if user exists
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         
         if user:
             # Update existing user
             user.google_access_token = tokens["token"]
             user.google_refresh_token = tokens["refresh_token"]
-            user.google_token_expiry = tokens["expiry"]
+            user.google_token_expiry = expiry
             user.email = email
         else:
             # Create new user
@@ -98,75 +115,148 @@ class GoogleOAuthService:
                 email=email,
                 google_access_token=tokens["token"],
                 google_refresh_token=tokens["refresh_token"],
-                google_token_expiry=tokens["expiry"]
+                google_token_expiry=expiry
             )
             db.add(user)
         
-        db.commit() # synchronous blocking operation
-        db.refresh(user) # synchronous blocking operation
+        await db.commit()
+        await db.refresh(user)
+        # New tokens from the consent flow replace whatever was cached
+        credential_cache.invalidate(user.id)
+        user_cache.invalidate(user.id)
         return user
 
     def get_user_info(self, access_token: str) -> tuple[str, str]:
         """
         Fetch user info (email, name) from Google using access token
         """
-        from google.oauth2.credentials import Credentials
-        
         creds = Credentials(token=access_token)
         
         # Use Google's OAuth2 API to get user info
-        service = build('oauth2', 'v2', credentials=creds)
-        user_info = service.userinfo().get().execute()
+        service = google_client_factory.oauth2(creds)
+        user_info = google_api_scheduler.execute(None, "userinfo.get", service.userinfo().get().execute)
         
         return user_info.get("email"), user_info.get("name") if user_info.get("name") else "Unknown Name"
+
+    async def aget_user_info(self, access_token: str) -> tuple[str, str]:
+        """Async get_user_info."""
+        service = google_client_factory.oauth2(Credentials(token=access_token))
+        user_info = await google_api_scheduler.aexecute(None, "userinfo.get", service.userinfo().get().execute)
+        return user_info.get("email"), user_info.get("name") if user_info.get("name") else "Unknown Name"
     
-    def refresh_and_get_credentials(self, db: Session, user: User) -> Credentials:
+    def build_credentials(self, user: User | CachedUser) -> Credentials:
+        """Constructs Google Credentials from the tokens stored for a user."""
+        expiry_dt = user.google_token_expiry
+        if isinstance(expiry_dt, str):
+            # Older rows/drivers hand the expiry back as an ISO string
+            expiry_dt = datetime.fromisoformat(expiry_dt) if expiry_dt else None
+        if expiry_dt is not None and expiry_dt.tzinfo is not None:
+            # google-auth compares expiry against naive UTC
+            expiry_dt = expiry_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return Credentials(
+            token=user.google_access_token,
+            # CRITICAL: We need the refresh_token to exist here!
+            refresh_token=user.google_refresh_token, 
+            token_uri=self.client_config["web"]["token_uri"],
+            client_id=self.client_config["web"]["client_id"],
+            client_secret=self.client_config["web"]["client_secret"],
+            scopes=settings.GOOGLE_SCOPES,
+            expiry=expiry_dt
+        )
+
+    def refresh_credentials(self, user: User | CachedUser, min_valid_seconds: float = 0, touch: bool = True) -> tuple[Credentials, bool]:
             """
-            Constructs and refreshes Google Credentials for a user.
-            Updates the database if the access token is refreshed.
+            Returns Google Credentials for a user valid for at least `min_valid_seconds`,
+            and whether this call refreshed them (so the caller must persist the new token).
+            `touch` counts the call as the user being active (see CredentialCache).
+
+            Blocking: refreshing calls Google's token endpoint. One caller per user
+            refreshes (single-flight) while the others wait on the same lock and
+            then reuse the refreshed credentials from the cache.
             """
-            
-            # Check if the expiry time exists and is a non-empty string
-            if user.google_token_expiry and isinstance(user.google_token_expiry, str):
-                # Convert the ISO string to a datetime object
-                expiry_dt = datetime.fromisoformat(user.google_token_expiry)
-            else:
-                # If the expiry is missing or invalid, treat it as expired 
-                # (or set it to None, which the Credentials object can handle)
-                expiry_dt = None
-            
-            creds = Credentials(
-                token=user.google_access_token,
-                # CRITICAL: We need the refresh_token to exist here!
-                refresh_token=user.google_refresh_token, 
-                token_uri=self.client_config["web"]["token_uri"],
-                client_id=self.client_config["web"]["client_id"],
-                client_secret=self.client_config["web"]["client_secret"],
-                scopes=settings.GOOGLE_SCOPES,
-                expiry=expiry_dt
+            with credential_cache.lock_for(user.id):
+                # Another request may have refreshed while we waited for the lock
+                creds = credential_cache.get(user.id, min_valid_seconds, touch)
+                if creds is not None:
+                    return creds, False
+
+                creds = self.build_credentials(user)
+                refreshed = False
+                if not is_fresh(creds, min_valid_seconds):
+                    if not creds.refresh_token:
+                        raise Exception("Refresh token is missing or invalid. User must re-authenticate.")
+                    logger.debug("Access token expired or expiring. Attempting refresh...")
+                    # refresh() will update creds.token and creds.expiry in-place
+                    try:
+                        with google_client_factory.lease() as http, timed(GOOGLE_API_DURATION, "oauth2.refresh"):
+                            creds.refresh(GoogleAuthRequest(http))
+                    except Exception as e:
+                        # Catch specific errors related to a revoked refresh token
+                        credential_cache.invalidate(user.id)
+                        raise Exception(f"Failed to refresh token. Re-authentication required: {e}")
+                    refreshed = True
+
+                credential_cache.put(user.id, creds, touch)
+                return creds, refreshed
+
+    async def arefresh_and_get_credentials(self, db: AsyncSession, user: User | CachedUser, min_valid_seconds: float = 0, touch: bool = True) -> Credentials:
+            """
+            Still-valid credentials come straight from the process-level credential
+            cache. Otherwise the refresh runs on the Google executor and the new token
+            is written back to the users table once.
+            """
+            creds = credential_cache.get(user.id, min_valid_seconds, touch)
+            if creds is not None:
+                return creds
+
+            creds, refreshed = await run_blocking(self.refresh_credentials, user, min_valid_seconds, touch)
+            if refreshed:
+                await self.asave_refreshed_token(db, user.id, creds)
+            return creds
+
+    async def asave_refreshed_token(self, db: AsyncSession, user_id: str, creds: Credentials):
+            """Save the new access token and expiry time back to the database."""
+            # The caller's user may be a cached snapshot, so update the row directly
+            await db.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(google_access_token=creds.token, google_token_expiry=creds.expiry)
             )
-            
-            # The library uses the 'expiry' argument to determine if it needs to refresh.
-            # It handles the case where 'expiry' is None/in the past by checking refresh_token.
-            if creds.expired and creds.refresh_token:
-                print("DEBUG: Access token expired. Attempting refresh...")
-                # refresh() will update creds.token and creds.expiry in-place
+            await db.commit()
+            user_cache.invalidate(user_id)
+
+    async def arefresh_expiring_credentials(self) -> int:
+        """
+        Refreshes cached credentials that expire within the refresh margin,
+        so request handlers find a valid token and never wait on Google.
+        Only users with a request within CREDENTIAL_CACHE_IDLE_SECONDS are
+        still cached. Returns the number of users refreshed.
+        """
+        refreshed = 0
+        for user_id in credential_cache.expiring_within(settings.CREDENTIAL_REFRESH_MARGIN_SECONDS):
+            async with AsyncSessionLocal() as db:
                 try:
-                    creds.refresh(None)
+                    user = await load_user_by_id(db, user_id)
+                    if user is None or not user.google_refresh_token:
+                        credential_cache.invalidate(user_id)
+                        continue
+                    await self.arefresh_and_get_credentials(db, user, settings.CREDENTIAL_REFRESH_MARGIN_SECONDS, touch=False)
+                    refreshed += 1
                 except Exception as e:
-                    # Catch specific errors related to a revoked refresh token
-                    raise Exception(f"Failed to refresh token. Re-authentication required: {e}")
-                
-                # Save the new access token and expiry time back to the database
-                user.google_access_token = creds.token
-                user.google_token_expiry = creds.expiry.isoformat()
-                
-                db.commit() # Save the new token data
-                db.refresh(user)
-                
-            elif creds.expired and not creds.refresh_token:
-                raise Exception("Refresh token is missing or invalid. User must re-authenticate.")
-                
-            return creds
+                    logger.error("Background token refresh failed for %s: %s", user_id, e)
+        return refreshed
+
+google_oauth_service = GoogleOAuthService()
+
 
-google_oauth_service = GoogleOAuthService()
\ No newline at end of file
+async def credential_refresh_loop(interval_seconds: float = settings.CREDENTIAL_REFRESH_INTERVAL_SECONDS):
+    """Background task (started in the app lifespan) refreshing tokens before they expire."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            refreshed = await google_oauth_service.arefresh_expiring_credentials()
+            if refreshed:
+                logger.debug("Proactively refreshed Google credentials for %s user(s)", refreshed)
+        except Exception as e:
+            logger.error("Credential refresh loop failed: %s", e)
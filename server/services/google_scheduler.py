@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import random
+import socket
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from server.config import settings
+from server.services.google_client import run_blocking
+from server.metrics import (
+    GOOGLE_API_DURATION,
+    GOOGLE_API_QUEUE_WAIT,
+    GOOGLE_API_REJECTIONS,
+    GOOGLE_API_RETRIES,
+    timed,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth another attempt; 403 only with one of RATE_LIMIT_REASONS
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+TRANSPORT_ERRORS = (socket.timeout, ConnectionError, httplib2.HttpLib2Error)
+
+
+class QuotaExceededError(Exception):
+    """The call would have waited longer than the scheduler's max wait for quota."""
+    def __init__(self, bucket: str, retry_after: float):
+        super().__init__(f"Google API {bucket} quota exhausted, retry in {retry_after:.1f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate_per_second` up to `capacity`.
+    Tokens are reserved in arrival order and the balance may go negative:
+    a caller is told how long to wait for its reservation, so waiting calls
+    are served first come, first served.
+    """
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def wait_for(self, cost: float, now: float) -> float:
+        """Seconds until `cost` tokens are available, without reserving them."""
+        self.refill(now)
+        missing = cost - self.tokens
+        return max(0.0, missing / self.rate_per_second)
+
+    def reserve(self, cost: float):
+        self.tokens -= cost
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+def error_reason(error: BaseException) -> str | None:
+    """Google's reason code for an HttpError (e.g. "rateLimitExceeded"), if it has one."""
+    details = getattr(error, "error_details", None)
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get("reason")
+    return None
+
+
+def retry_reason(error: BaseException, idempotent: bool) -> str | None:
+    """Why `error` is worth retrying, or None if it isn't."""
+    if isinstance(error, HttpError):
+        status = error.status_code
+        reason = error_reason(error)
+        if status == 403 and reason in RATE_LIMIT_REASONS:
+            return reason
+        if status in RETRYABLE_STATUSES:
+            return reason or str(status)
+        return None
+    # The request may have reached Google; only repeat calls that are safe to repeat
+    if idempotent and isinstance(error, TRANSPORT_ERRORS):
+        return "transport"
+    return None
+
+
+class GoogleApiScheduler:
+    """
+    Every Google API call goes through aexecute() (or execute() on sync paths):
+
+    - Quota: a project-wide token bucket and one per user, sized from the
+      Calendar API's per-minute quotas. A call that has to wait for tokens
+      waits in line; one that would wait longer than `max_wait_seconds` is
+      refused with QuotaExceededError.
+    - Retries: 429, 403 rate limits and 5xx (plus transport errors for
+      idempotent calls) are retried with full-jitter exponential backoff,
+      honouring Retry-After. Each attempt takes tokens again.
+
+    aexecute waits with asyncio.sleep and only hands the HTTP call itself to
+    the Google executor, so throttled users don't hold its threads.
+    execute() sleeps on the calling thread.
+    """
+    def __init__(
+        self,
+        project_per_minute: float = settings.GOOGLE_QUOTA_PROJECT_PER_MINUTE,
+        project_burst: int = settings.GOOGLE_QUOTA_PROJECT_BURST,
+        user_per_minute: float = settings.GOOGLE_QUOTA_USER_PER_MINUTE,
+        user_burst: int = settings.GOOGLE_QUOTA_USER_BURST,
+        max_wait_seconds: float = settings.GOOGLE_QUOTA_MAX_WAIT_SECONDS,
+        max_retries: int = settings.GOOGLE_API_MAX_RETRIES,
+        backoff_base_seconds: float = settings.GOOGLE_API_BACKOFF_BASE_SECONDS,
+        backoff_max_seconds: float = settings.GOOGLE_API_BACKOFF_MAX_SECONDS,
+        max_users: int = settings.USER_CACHE_MAX_USERS,
+    ):
+        self.project_bucket = TokenBucket(project_per_minute / 60, project_burst)
+        self.user_per_second = user_per_minute / 60
+        self.user_burst = user_burst
+        self.max_wait_seconds = max_wait_seconds
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.max_users = max_users
+        self._user_buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.rejections = 0
+        self.queued = 0
+        self.queue_wait_seconds = 0.0
+
+    def user_bucket(self, user_key: str) -> TokenBucket:
+        bucket = self._user_buckets.get(user_key)
+        if bucket is None:
+            if len(self._user_buckets) >= self.max_users:
+                # Full buckets hold no state worth keeping
+                now = time.monotonic()
+                for key in [k for k, b in self._user_buckets.items() if b.is_full(now)]:
+                    del self._user_buckets[key]
+            bucket = self._user_buckets[user_key] = TokenBucket(self.user_per_second, self.user_burst)
+        return bucket
+
+    def reserve(self, user_key: str | None, method: str, cost: int = 1) -> float:
+        """Reserve `cost` tokens from the project (and user) bucket; returns the seconds to wait for them."""
+        with self._lock:
+            now = time.monotonic()
+            buckets = [("project", self.project_bucket)]
+            if user_key is not None:
+                buckets.append(("user", self.user_bucket(user_key)))
+            waits = [(bucket.wait_for(cost, now), name) for name, bucket in buckets]
+            wait, bucket_name = max(waits)
+            if wait > self.max_wait_seconds:
+                self.rejections += 1
+                GOOGLE_API_REJECTIONS.labels(method, bucket_name).inc()
+                raise QuotaExceededError(bucket_name, wait)
+            for _, bucket in buckets:
+                bucket.reserve(cost)
+            self.calls += 1
+            if wait > 0:
+                self.queued += 1
+                self.queue_wait_seconds += wait
+        GOOGLE_API_QUEUE_WAIT.labels(method).observe(wait)
+        return wait
+
+    def acquire(self, user_key: str | None, method: str, cost: int = 1):
+        """Reserve tokens, sleeping in line on this thread if needed."""
+        wait = self.reserve(user_key, method, cost)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, user_key: str | None, method: str, cost: int = 1):
+        """Async acquire: waits in line without holding a thread."""
+        wait = self.reserve(user_key, method, cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Full jitter: uniform in [0, min(max, base * 2^attempt)], at least Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+        resp = getattr(error, "resp", None)
+        retry_after = resp.get("retry-after") if isinstance(resp, dict) else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    def execute(self, user_key: str | None, method: str, call: Callable[[], Any], cost: int = 1, idempotent: bool = True) -> Any:
+        """
+        Runs `call` (e.g. request.execute) under the quotas, retrying what is
+        retryable. `cost` is the number of API calls it makes (a batch counts
+        each of its requests).
+        """
+        attempt = 0
+        while True:
+            self.acquire(user_key, method, cost)
+            try:
+                with timed(GOOGLE_API_DURATION, method):
+                    return call()
+            except Exception as e:
+                reason = retry_reason(e, idempotent)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                self.wait_before_retry(method, attempt, e, reason)
+                attempt += 1
+
+    async def aexecute(self, user_key: str | None, method: str, call: Callable[[], Any], cost: int = 1, idempotent: bool = True) -> Any:
+        """Async execute: only `call` itself runs on the Google executor, waits happen on the event loop."""
+        attempt = 0
+        while True:
+            await self.aacquire(user_key, method, cost)
+            try:
+                with timed(GOOGLE_API_DURATION, method):
+                    return await run_blocking(call)
+            except Exception as e:
+                reason = retry_reason(e, idempotent)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                await self.await_before_retry(method, attempt, e, reason)
+                attempt += 1
+
+    def retry_delay(self, method: str, attempt: int, error: BaseException, reason: str) -> float:
+        """Counts the retry and returns its backoff."""
+        delay = self.backoff(attempt, error)
+        with self._lock:
+            self.retries += 1
+        GOOGLE_API_RETRIES.labels(method, reason).inc()
+        logger.warning("Google API %s failed (%s), retry %d in %.2fs", method, reason, attempt + 1, delay)
+        return delay
+
+    def wait_before_retry(self, method: str, attempt: int, error: BaseException, reason: str):
+        """Counts the retry and sleeps out its backoff."""
+        time.sleep(self.retry_delay(method, attempt, error, reason))
+
+    async def await_before_retry(self, method: str, attempt: int, error: BaseException, reason: str):
+        """Async wait_before_retry."""
+        await asyncio.sleep(self.retry_delay(method, attempt, error, reason))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "rejections": self.rejections,
+                "queued": self.queued,
+                "queue_wait_seconds": self.queue_wait_seconds,
+                "users": len(self._user_buckets),
+            }
+
+
+google_api_scheduler = GoogleApiScheduler()
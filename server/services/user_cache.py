@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from server.config import settings
+from server.db.models import User
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """
+    Read-only snapshot of a users row. Safe to share between requests and
+    threads, unlike a session-bound User instance.
+    """
+    id: str
+    email: str
+    google_access_token: str | None
+    google_refresh_token: str | None
+    google_token_expiry: datetime | str | None
+
+    @classmethod
+    def from_model(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            email=user.email,
+            google_access_token=user.google_access_token,
+            google_refresh_token=user.google_refresh_token,
+            google_token_expiry=user.google_token_expiry,
+        )
+
+
+class UserCache:
+    """
+    Process-level TTL + LRU cache of users, looked up by id (the session
+    cookie) or by email. Entries are dropped whenever the user's tokens are
+    written (GoogleOAuthService.asave_tokens and token refreshes).
+    """
+    def __init__(
+        self,
+        ttl_seconds: float = settings.USER_CACHE_TTL_SECONDS,
+        max_users: int = settings.USER_CACHE_MAX_USERS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        # user id -> (snapshot, cached_at)
+        self._users: OrderedDict[str, tuple[CachedUser, float]] = OrderedDict()
+        self._ids_by_email: dict[str, str] = {}
+        # Last invalidation per user, so a load that raced a token update isn't cached
+        self._invalidated_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_by_id(self, user_id: str) -> CachedUser | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or now - entry[1] >= self.ttl_seconds:
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def get_by_email(self, email: str) -> CachedUser | None:
+        user_id = self._ids_by_email.get(email)
+        if user_id is None:
+            return None
+        return self.get_by_id(user_id)
+
+    def record_miss(self):
+        """Counted by the loaders when a lookup has to go to the database."""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, user: CachedUser, loaded_at: float):
+        """
+        Cache a snapshot. `loaded_at` is the time.monotonic() taken before the
+        row was read; snapshots older than the user's last invalidation are discarded.
+        """
+        with self._lock:
+            if self._invalidated_at.get(user.id, float("-inf")) >= loaded_at:
+                return
+            self._remove(user.id)
+            self._users[user.id] = (user, time.monotonic())
+            self._ids_by_email[user.email] = user.id
+            while len(self._users) > self.max_users:
+                self._remove(next(iter(self._users)))
+
+    def invalidate(self, user_id: str):
+        now = time.monotonic()
+        with self._lock:
+            self._invalidated_at[user_id] = now
+            # Entries older than the TTL can no longer reject anything useful
+            for key in [k for k, t in self._invalidated_at.items() if now - t > self.ttl_seconds]:
+                del self._invalidated_at[key]
+            if self._remove(user_id):
+                self.invalidations += 1
+
+    def _remove(self, user_id: str) -> bool:
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return False
+        if self._ids_by_email.get(entry[0].email) == user_id:
+            del self._ids_by_email[entry[0].email]
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+user_cache = UserCache()
+
+
+async def load_user_by_id(db: AsyncSession, user_id: str) -> CachedUser | None:
+    """The user for a session id, from the cache or the request's DB session."""
+    user = user_cache.get_by_id(user_id)
+    if user is not None:
+        return user
+    user_cache.record_miss()
+    loaded_at = time.monotonic()
+    row = await db.get(User, user_id)
+    if row is None:
+        return None
+    user = CachedUser.from_model(row)
+    user_cache.put(user, loaded_at)
+    return user
+
+
+async def load_user_by_email(db: AsyncSession, email: str) -> CachedUser | None:
+    """The user with this email, from the cache or the request's DB session."""
+    user = user_cache.get_by_email(email)
+    if user is not None:
+        return user
+    user_cache.record_miss()
+    loaded_at = time.monotonic()
+    row = (await db.execute(select(User).where(User.email == email))).scalars().first()
+    if row is None:
+        return None
+    user = CachedUser.from_model(row)
+    user_cache.put(user, loaded_at)
+    return user
@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+from google.oauth2.credentials import Credentials
+
+from server.services.google_calendar import GoogleCalendarService
+
+
+class FreeWindowsWithUnreadableCalendarTest(unittest.TestCase):
+    """An attendee calendar that freebusy can't read must not pass for a free one."""
+
+    def setUp(self):
+        self.service = GoogleCalendarService(Credentials(token="token"))
+        freebusy = {
+            "primary": {"busy": [{"start": "2030-01-07T09:00:00Z", "end": "2030-01-07T10:00:00Z"}]},
+            "guest@example.com": {"errors": [{"domain": "global", "reason": "notFound"}], "busy": []},
+        }
+        for method in ("query_calendars", "query_freebusy"):
+            patcher = mock.patch.object(self.service, method, return_value=freebusy)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_errored_calendar_is_reported(self):
+        result = self.service.find_free_slots(60, "2030-01-07", "2030-01-07", "UTC", calendars=["guest@example.com"])
+        self.assertEqual(result["unavailable_calendars"], [{"calendar": "guest@example.com", "reason": "notFound"}])
+        # The candidates still respect the calendars that could be read
+        self.assertEqual(result["candidates"][0]["start"][:16], "2030-01-07T10:00")
+
+    def test_readable_calendars_report_nothing(self):
+        result = self.service.find_free_slots(60, "2030-01-07", "2030-01-07", "UTC")
+        self.assertEqual(result["unavailable_calendars"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()